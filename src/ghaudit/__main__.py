@@ -1,8 +1,9 @@
 import logging
 import os
+import sys
 from typing import Literal, Union
 
-from ghaudit.cli import cli
+from ghaudit import server
 
 LOGFILE = os.environ.get("LOGFILE")
 LOGLEVEL = os.environ.get("LOGLEVEL", "ERROR")
@@ -21,6 +22,16 @@ def main() -> None:
         root.addHandler(handler)
     else:
         logging.basicConfig(level=LOGLEVEL, format=LOG_FORMAT, style=STYLE)
+    forwarded = server.forward(sys.argv[1:])
+    if forwarded:
+        status, stdout, stderr = forwarded
+        sys.stdout.write(stdout)
+        sys.stderr.write(stderr)
+        sys.exit(status)
+    # imported once the command is known to run locally, see ghaudit.server
+    # pylint: disable=import-outside-toplevel
+    from ghaudit.cli import cli
+
     # pylint: disable=no-value-for-parameter
     cli()
 
@@ -7,17 +7,18 @@ import passpy.store
 AuthDriver = Callable[[], Mapping[str, str]]
 
 
+def secret_passpy(path: str) -> str:
+    """Return a secret from pass, the GnuPG-based password manager."""
+    secret = passpy.store.Store().get_key(path)
+    if not secret:
+        raise RuntimeError("{} not found.".format(path))
+    return secret.strip()
+
+
 def github_auth_token_passpy(path: str) -> AuthDriver:
     """Return a pass auth driver.
 
     Return a callback providing token authentication to github, given the path
     of a secret in pass, the GnuPG-based password manager.
     """
-
-    def get_token(path: str) -> str:
-        token = passpy.store.Store().get_key(path)
-        if not token:
-            raise RuntimeError("{} not found.".format(path))
-        return token.strip()
-
-    return lambda: {"Authorization": "token " + get_token(path)}
+    return lambda: {"Authorization": "token " + secret_passpy(path)}
@@ -1,32 +1,92 @@
 """Github remote state synchronisation with a local storage (hence cache)."""
 
+# pylint: disable=too-many-lines
+
 from __future__ import annotations
 
+import copy
+import functools
+import hashlib
 import json
+import mmap
+import resource
 import tempfile
-from os import environ, fsync, makedirs, path, rename
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from os import environ, fsync, makedirs, path, rename, unlink
 from pathlib import Path
-from typing import Dict, List
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+)
 
-from ghaudit import auth, config, schema
+from ghaudit import (
+    auth,
+    cache_format,
+    cache_freshness,
+    cache_generations,
+    cache_history,
+    cache_journal,
+    cache_remote,
+    cache_shards,
+    cache_sqlite,
+    cassette,
+    config,
+    indexes,
+    schema,
+    state_builder,
+    state_diff,
+    telemetry,
+    tracing,
+    utils,
+    webhooks,
+)
 from ghaudit.config import Config
 from ghaudit.query.branch_protection_push_allowances import (
     BranchProtectionPushAllowances,
 )
 from ghaudit.query.compound_query import CompoundQuery
+from ghaudit.query.namespaced import NamespacedQuery
 from ghaudit.query.org_members import OrgMembersQuery
 from ghaudit.query.org_repositories import OrgRepoQuery
 from ghaudit.query.org_teams import OrgTeamsQuery
 from ghaudit.query.repo_branch_protection import RepoBranchProtectionQuery
 from ghaudit.query.repo_collaborators import RepoCollaboratorQuery
+from ghaudit.query.sub_query import SubQuery
 from ghaudit.query.team_children import TeamChildrenQuery
 from ghaudit.query.team_permission import TeamRepoQuery
 from ghaudit.query.user import UserQuery
 from ghaudit.query.user_role import TeamMemberQuery
 from ghaudit.ui import ProgressCB
 
+NAME = "cache.json"
+
+# cache files pinned by the readers and writers of each thread, innermost
+# last
+_LOCAL = threading.local()
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+def data_dir() -> Path:
+    """Return the path of the directory holding the cache and its history.
+
+    In the context of `organisation', it is the directory of the cache of
+    the organisation.
+    """
 
-def file_path() -> Path:
     def parent_dir() -> Path:
         xdg_data_home = environ.get("XDG_DATA_HOME")
         if xdg_data_home:
@@ -36,42 +96,1054 @@ def file_path() -> Path:
             return Path(home) / ".local" / "share"
         return Path("/")
 
-    return parent_dir() / "ghaudit" / "compliance" / "cache.json"
+    if getattr(_LOCAL, "organisation", None):
+        return parent_dir() / "ghaudit" / "organisations" / _LOCAL.organisation
+    return parent_dir() / "ghaudit" / "compliance"
+
+
+@contextmanager
+def organisation(name: str) -> Iterator[None]:
+    """Use the cache of the organisation `name' in this context.
+
+    The caches of the organisations of a configuration describing several of
+    them are kept apart, see ghaudit.config.get_cache_apart. The generation
+    pinned by `pinned' outside of the context is not used in it.
+
+    :raises: RuntimeError if `name' cannot be a directory name.
+    """
+    if not name or name in (".", "..") or Path(name).name != name:
+        raise RuntimeError('invalid organisation name "{}"'.format(name))
+    previous = getattr(_LOCAL, "organisation", None)
+    pinned_paths = _pinned_paths()
+    _LOCAL.organisation = name
+    _LOCAL.pinned = []
+    try:
+        yield
+    finally:
+        _LOCAL.organisation = previous
+        _LOCAL.pinned = pinned_paths
+
+
+def _pinned_paths() -> List[Path]:
+    if not hasattr(_LOCAL, "pinned"):
+        _LOCAL.pinned = []
+    return _LOCAL.pinned
+
+
+def file_path() -> Path:
+    """Return the path of the cache file.
+
+    It is the file of the generation pinned by `pinned', or else of the
+    current generation (see ghaudit.cache_generations). A cache written
+    before generations were introduced is read from the data directory.
+    """
+    if _pinned_paths():
+        return _pinned_paths()[-1]
+    return _current_path()
+
+
+def _current_path() -> Path:
+    generation = cache_generations.current(data_dir())
+    if generation is None:
+        return data_dir() / NAME
+    return cache_generations.path(data_dir(), generation, NAME)
+
+
+@contextmanager
+def pinned() -> Iterator[Path]:
+    """Keep reading the current generation of the cache in this context.
+
+    Refreshes writing a new generation meanwhile neither modify nor remove
+    it. Nested contexts keep the generation of the outermost one.
+    """
+    pinned_paths = _pinned_paths()
+    if pinned_paths:
+        yield pinned_paths[-1]
+        return
+    # pylint: disable=contextmanager-generator-missing-cleanup
+    with cache_generations.reader(
+        data_dir(), NAME, data_dir() / NAME
+    ) as path_:
+        pinned_paths.append(path_)
+        try:
+            yield path_
+        finally:
+            pinned_paths.pop()
+
+
+def _pinning(func: _F) -> _F:
+    """Run `func' with the current generation of the cache pinned."""
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with pinned():
+            return func(*args, **kwargs)
+
+    return wrapper  # type: ignore
+
+
+@contextmanager
+def _new_generation() -> Iterator[Path]:
+    """Write a new generation of the cache, made current on success.
+
+    The cache file of the new generation is pinned in the context, so that
+    its journal, stamp and indexes are written next to it. Generations
+    without readers left are garbage-collected afterwards.
+    """
+    directory = data_dir()
+    with cache_generations.writer_lock(directory):
+        generation = cache_generations.create(directory)
+        path_ = cache_generations.path(directory, generation, NAME)
+        _pinned_paths().append(path_)
+        try:
+            yield path_
+        finally:
+            _pinned_paths().pop()
+        cache_generations.publish(directory, generation)
+        cache_generations.collect(directory, NAME)
+
+
+@contextmanager
+def _writing() -> Iterator[None]:
+    """Modify the current generation of the cache in this context.
+
+    The writer lock is held, and the current generation is used whichever
+    generation the caller pinned: a generation no longer current is only
+    read, its modifications would be lost.
+    """
+    with cache_generations.writer_lock(data_dir()):
+        _pinned_paths().append(_current_path())
+        try:
+            yield
+        finally:
+            _pinned_paths().pop()
+
+
+def collect() -> List[int]:
+    """Remove the generations of the cache no longer current nor read.
 
+    Return the removed generations.
+    """
+    with cache_generations.writer_lock(data_dir()):
+        return cache_generations.collect(data_dir(), NAME)
 
+
+def journal_path() -> Path:
+    """Return the path of the journal of the cache file.
+
+    See ghaudit.cache_journal.
+    """
+    return file_path().with_name(file_path().name + ".journal")
+
+
+def _stamp_path() -> Path:
+    return file_path().with_name(file_path().name + ".stamp")
+
+
+def _fetch_times_path() -> Path:
+    return file_path().with_name(file_path().name + ".fetched")
+
+
+@_pinning
+def fetch_times() -> cache_freshness.Times:
+    """Return the times the sections of the cache were fetched at.
+
+    See ghaudit.cache_freshness.
+    """
+    return cache_freshness.read(_fetch_times_path())
+
+
+def _write_fetch_times(times: cache_freshness.Times) -> None:
+    raw = json.dumps(times)
+    _write(_fetch_times_path(), lambda x: x.write_text(raw, encoding="UTF-8"))
+
+
+def _checksum(path_: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path_, "rb") as cache_file:
+        for chunk in iter(lambda: cache_file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stamp() -> Dict[str, Any]:
+    return {
+        "validation": schema.VALIDATION_VERSION,
+        "sha256": _checksum(file_path()),
+    }
+
+
+def _write_stamp() -> None:
+    """Record that the cache file is valid, as checked by schema.validate."""
+    stamp = json.dumps(_stamp())
+    _write(_stamp_path(), lambda x: x.write_text(stamp, encoding="UTF-8"))
+
+
+def _is_validated() -> bool:
+    """Return whether the cache file did not change since it was validated.
+
+    The cache file must also have been validated with the current version
+    of schema.validate.
+    """
+    try:
+        stamp = json.loads(_stamp_path().read_text(encoding="UTF-8"))
+    except (OSError, ValueError):
+        return False
+    return stamp == _stamp()
+
+
+def history_dir() -> Path:
+    """Return the path of the snapshot history of the cache.
+
+    See ghaudit.cache_history.
+    """
+    return data_dir() / "history"
+
+
+def _detect(path_: Path) -> Tuple[str, str]:
+    """Return the format and the compression of a cache file."""
+    with open(path_, "rb") as cache_file:
+        return cache_format.detect_stream(cache_file)
+
+
+def _decode(path_: Path, format_: str, compression: str) -> schema.Rstate:
+    with tracing.span("cache.decode", format=format_, compression=compression):
+        if format_ == "sqlite":
+            return cache_sqlite.load(path_)
+        with open(path_, "rb") as cache_file:
+            raw = None  # type: cache_format.Buffer
+            if compression != "none":
+                raw = cache_format.decompress(cache_file, compression)
+            elif format_ == "binary":
+                # sections are decoded from the memory map on first access
+                raw = mmap.mmap(
+                    cache_file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+            else:
+                raw = cache_file.read()
+        return cache_format.loads(raw)
+
+
+@_pinning
+def _sqlite_path() -> Path | None:
+    """Return the path of the cache file if it is a SQLite database.
+
+    None is returned as well when the cache has journal records, since they
+    are not part of the database.
+    """
+    if _detect(file_path())[0] != "sqlite" or cache_journal.read(
+        journal_path(), file_path()
+    ):
+        return None
+    return file_path()
+
+
+@tracing.traced("cache.load")
+@_pinning
 def load() -> schema.Rstate:
-    """Load remote state from cache file."""
-    with open(file_path(), encoding="UTF-8") as cache_file:
-        rstate = json.load(cache_file)
+    """Load remote state from cache file, and replay its journal.
+
+    The remote state is validated, unless the cache file is stamped as
+    validated by `store' or `verify' and no journal records were replayed.
+    This way, the sections of binary caches are only decoded when accessed.
+    """
+    format_, compression = _detect(file_path())
+    rstate = _decode(file_path(), format_, compression)
+    records = cache_journal.read(journal_path(), file_path())
+    if records:
+        with tracing.span("cache.replay", records=len(records)):
+            cache_journal.replay(rstate, records)
+    if records or not _is_validated():
         schema.validate(rstate)
-        return rstate
+    return rstate
+
+
+@tracing.traced("cache.verify")
+@_pinning
+def verify() -> int:
+    """Validate the cache file and its journal, whatever its stamp.
 
+    Raise a RuntimeError if the remote state is not valid. Otherwise, stamp
+    the cache file as validated, and return the number of journal records.
+    """
+    format_, compression = _detect(file_path())
+    rstate = _decode(file_path(), format_, compression)
+    schema.validate(rstate)
+    _write_stamp()
+    records = cache_journal.read(journal_path(), file_path())
+    if records:
+        schema.validate(cache_journal.replay(rstate, records))
+    return len(records)
 
-def store(data: schema.Rstate) -> None:
-    """Store remote state to file."""
-    ofilepath = file_path()
+
+def _indexes_path() -> Path:
+    return file_path().with_name(file_path().name + ".indexes")
+
+
+def _write_indexes(data: schema.Rstate) -> None:
+    """Compute and write the indexes of the remote state of the cache file.
+
+    See ghaudit.indexes.
+    """
+    with tracing.span("cache.indexes"):
+        indexes_ = indexes.build(data)
+        stamp = indexes.stamp(file_path())
+
+        def write(temp_path: Path) -> None:
+            with open(temp_path, "wb") as output:
+                indexes.dump(indexes_, stamp, output)
+
+        _write(_indexes_path(), write)
+
+
+@_pinning
+def load_indexes() -> indexes.Indexes | None:
+    """Load the persisted indexes of the cache, each decoded on access.
+
+    None is returned if there are no indexes, if they were computed from a
+    previous cache file, or if the cache has journal records.
+    """
+    try:
+        with open(_indexes_path(), "rb") as indexes_file:
+            raw = mmap.mmap(indexes_file.fileno(), 0, access=mmap.ACCESS_READ)
+        indexes_ = indexes.loads(raw)
+    except (OSError, ValueError, RuntimeError):
+        return None
+    if indexes_["stamp"] != indexes.stamp(file_path()) or cache_journal.read(
+        journal_path(), file_path()
+    ):
+        return None
+    return indexes_
+
+
+@_pinning
+def load_repository(name: str) -> schema.Rstate:
+    """Load the remote state needed to describe the repository `name'.
+
+    With the sqlite format, only the repository and its collaborators are
+    read. Otherwise, they are read from the persisted indexes when available,
+    and from the whole remote state loaded if not.
+    """
+    sqlite_path = _sqlite_path()
+    if sqlite_path:
+        return cache_sqlite.repository_state(sqlite_path, name)
+    indexes_ = load_indexes()
+    if indexes_:
+        return indexes.repository_state(indexes_, name)
+    return load()
+
+
+@_pinning
+def load_user(login: str) -> schema.Rstate:
+    """Load the remote state needed to describe the user `login'.
+
+    With the sqlite format, only the user and its teams are read. Otherwise,
+    they are read from the persisted indexes when available, and from the
+    whole remote state loaded if not.
+    """
+    sqlite_path = _sqlite_path()
+    if sqlite_path:
+        return cache_sqlite.user_state(sqlite_path, login)
+    indexes_ = load_indexes()
+    if indexes_:
+        return indexes.user_state(indexes_, login)
+    return load()
+
+
+@_pinning
+def load_team(name: str) -> schema.Rstate:
+    """Load the remote state needed to describe the team `name'.
+
+    The team, its repositories, members and children teams are read from the
+    persisted indexes when available. Otherwise the whole remote state is
+    loaded.
+    """
+    indexes_ = load_indexes()
+    if indexes_:
+        return indexes.team_state(indexes_, name)
+    return load()
+
+
+def _write(ofilepath: Path, writer: Callable[[Path], object]) -> None:
+    """Atomically replace a file with the one created by `writer'.
+
+    Processes which opened the previous file keep reading it.
+    """
     if not path.exists(ofilepath.parent):
         makedirs(ofilepath.parent)
-    temp_path = None
     with tempfile.NamedTemporaryFile(
-        mode="w+t", dir=ofilepath.parent, delete=False
+        dir=ofilepath.parent, delete=False
     ) as output:
-        json.dump(data, output)
-        temp_path = output.name
+        temp_path = Path(output.name)
+    try:
+        writer(temp_path)
+    except BaseException:
+        unlink(temp_path)
+        raise
     rename(temp_path, ofilepath)
     with open(ofilepath, encoding="UTF-8") as cache_file:
         fsync(cache_file.fileno())
 
 
+def _encode(
+    ofilepath: Path, data: schema.Rstate, format_: str, compression: str
+) -> None:
+    if format_ == "sqlite":
+        if compression != "none":
+            raise RuntimeError("sqlite caches cannot be compressed")
+        _write(ofilepath, lambda x: cache_sqlite.write(x, data))
+    else:
+
+        def write(temp_path: Path) -> None:
+            with open(temp_path, "wb") as output:
+                cache_format.dump(data, output, format_, compression)
+
+        _write(ofilepath, write)
+
+
+@tracing.traced("cache.store")
+def store(
+    data: schema.Rstate,
+    format_: str = cache_format.DEFAULT_FORMAT,
+    compression: str = cache_format.DEFAULT_COMPRESSION,
+    validated: bool = False,
+    times: cache_freshness.Times | None = None,
+    indexed: bool = True,
+) -> None:
+    """Store remote state to file, in the given format and compression.
+
+    The remote state is written as a stream, see cache_format.dump, in a new
+    generation of the cache, without journal. If `validated' is set, the
+    remote state was validated by schema.validate, and the cache file is
+    stamped so that it is not validated again when loaded. The fetch `times'
+    of the remote state default to those of the current cache. Unless
+    `indexed' is unset, the indexes of the cache are written too, see
+    ghaudit.indexes.
+    """
+    if times is None:
+        times = fetch_times()
+    with _new_generation() as path_:
+        _encode(path_, data, format_, compression)
+        if format_ != "sqlite" and indexed:
+            _write_indexes(data)
+        if validated:
+            _write_stamp()
+        _write_fetch_times(times)
+
+
+def _discard_journal() -> None:
+    if path.exists(journal_path()):
+        unlink(journal_path())
+
+
+# the journal is compacted by `update' when it grows larger than this ratio
+# of the cache file
+COMPACT_RATIO = 1.0
+
+
+def update(records: Iterable[cache_journal.Record]) -> int:
+    """Record changes of entities of the cached remote state.
+
+    The records are appended to the journal of the cache file, which is
+    compacted when it grows larger than the cache file. Return the number of
+    records.
+    """
+    with _writing():
+        count = cache_journal.append(journal_path(), file_path(), records)
+        if (
+            count
+            and journal_path().stat().st_size
+            > file_path().stat().st_size * COMPACT_RATIO
+        ):
+            compact()
+    return count
+
+
+@tracing.traced("cache.snapshot")
+def record_snapshot(data: schema.Rstate) -> cache_history.Snapshot:
+    """Record a snapshot of a remote state in the history of the cache."""
+    return cache_history.record(history_dir(), data)
+
+
+def snapshots() -> List[cache_history.Snapshot]:
+    """Return the snapshots of the history of the cache, oldest first."""
+    return cache_history.snapshots(history_dir())
+
+
+@tracing.traced("cache.load_snapshot")
+def load_snapshot(at: datetime) -> schema.Rstate:
+    """Load the last snapshot recorded at or before `at'."""
+    snapshot = cache_history.find(history_dir(), at)
+    rstate = cache_history.load(history_dir(), snapshot.name)
+    schema.validate(rstate)
+    return rstate
+
+
+def _snapshot_name(ref: str) -> str | None:
+    """Return the name of the snapshot designated by a name or a date."""
+    if cache_history.exists(history_dir(), ref):
+        return ref
+    try:
+        at = datetime.fromisoformat(ref)
+    except ValueError:
+        return None
+    return cache_history.find(history_dir(), at).name
+
+
+def load_reference(ref: str) -> schema.Rstate:
+    """Load a remote state designated by `ref'.
+
+    `ref' is either "cache" for the cache, the path of a cache file, the
+    name of a snapshot, or a date selecting the last snapshot recorded at or
+    before it.
+    """
+    if ref == "cache":
+        return load()
+    if Path(ref).exists():
+        return _decode(Path(ref), *_detect(Path(ref)))
+    name = _snapshot_name(ref)
+    if not name:
+        raise RuntimeError('unknown cache reference: "{}"'.format(ref))
+    return cache_history.load(history_dir(), name)
+
+
+def diff(old_ref: str, new_ref: str) -> Iterator[state_diff.Change]:
+    """Return the changes between two remote states.
+
+    See `load_reference' for the references. When both are snapshots, only
+    the entities which changed between them are read.
+    """
+    if not any(x == "cache" or Path(x).exists() for x in (old_ref, new_ref)):
+        old_name, new_name = _snapshot_name(old_ref), _snapshot_name(new_ref)
+        if old_name and new_name:
+            return cache_history.diff(history_dir(), old_name, new_name)
+    return state_diff.diff(load_reference(old_ref), load_reference(new_ref))
+
+
+def _remote_etags_path() -> Path:
+    return data_dir() / "remote.json"
+
+
+def publish(url: str, key: bytes) -> cache_remote.Transfer:
+    """Publish the cached remote state to `url', signed with `key'.
+
+    See ghaudit.cache_remote.
+    """
+    return cache_remote.publish(
+        cache_remote.location(url), key, history_dir(), load()
+    )
+
+
+def fetch(
+    url: str,
+    key: bytes,
+    format_: str = cache_format.DEFAULT_FORMAT,
+    compression: str = cache_format.DEFAULT_COMPRESSION,
+) -> cache_remote.Transfer:
+    """Replace the cache with the remote state published at `url'.
+
+    Nothing is downloaded if the published remote state did not change
+    since it was last fetched. The fetched remote state is validated and
+    recorded in the snapshot history.
+    """
+    try:
+        etags = json.loads(_remote_etags_path().read_text(encoding="UTF-8"))
+    except FileNotFoundError:
+        etags = {}
+    transfer, rstate = cache_remote.fetch(
+        cache_remote.location(url),
+        key,
+        history_dir(),
+        etags.get(url) if file_path().exists() else None,
+    )
+    if rstate is not None:
+        store(
+            rstate,
+            format_,
+            compression,
+            validated=schema.validate(rstate),
+            times=cache_freshness.full(
+                datetime.fromisoformat(transfer.time).timestamp()
+            ),
+        )
+        etags[url] = transfer.etag
+        etags_raw = json.dumps(etags)
+        _write(
+            _remote_etags_path(),
+            lambda x: x.write_text(etags_raw, encoding="UTF-8"),
+        )
+    return transfer
+
+
+@tracing.traced("cache.compact")
+def compact() -> int:
+    """Fold the journal into a new cache file, in the same format.
+
+    Return the number of journal records folded.
+    """
+    with _writing():
+        records = cache_journal.read(journal_path(), file_path())
+        if records:
+            format_, compression = _detect(file_path())
+            rstate = _decode(file_path(), format_, compression)
+            cache_journal.replay(rstate, records)
+            store(rstate, format_, compression, schema.validate(rstate))
+        else:
+            _discard_journal()
+    return len(records)
+
+
+def convert(
+    format_: str,
+    compression: str = cache_format.DEFAULT_COMPRESSION,
+    input_path: Path | None = None,
+    output_path: Path | None = None,
+) -> Tuple[str, str]:
+    """Convert a cache file to another format or compression.
+
+    By default the cache file is converted in place, to a new generation.
+    The journal of the cache file is folded into the converted file. The
+    remote state is validated before being converted. Return the format and
+    the compression the input file was found in.
+    """
+    with _writing():
+        input_path = input_path or file_path()
+        found = _detect(input_path)
+        rstate = _decode(input_path, *found)
+        if input_path == file_path():
+            cache_journal.replay(
+                rstate, cache_journal.read(journal_path(), file_path())
+            )
+        schema.validate(rstate)
+        if output_path and output_path != file_path():
+            _encode(output_path, rstate, format_, compression)
+        else:
+            store(rstate, format_, compression, validated=True)
+    return found
+
+
 def refresh(
-    config_: Config, auth_driver: auth.AuthDriver, progress: ProgressCB
+    config_: Config,
+    auth_driver: auth.AuthDriver,
+    progress: ProgressCB,
+    transport: utils.Transport = utils.github_graphql_call,
+    telemetry_path: Path | None = None,
+    openmetrics_path: Path | None = None,
+    bulk: bool = False,
+    spill: bool = False,
+) -> None:
+    """Refresh the remote state from github to a local file.
+
+    The github API is reached through `transport', which can be substituted
+    to record or replay the exchanges (see ghaudit.cassette).
+
+    If `telemetry_path' is set, a telemetry report of the synchronisation is
+    written to it as JSON (see ghaudit.telemetry), and to `openmetrics_path'
+    in the OpenMetrics text format if set. With `bulk', the remote state is
+    built once all the responses are received (see ghaudit.state_builder).
+    With `spill', the complete repositories and teams are written to a
+    temporary directory during the synchronisation, and read back one at a
+    time to store them. The indexes of the cache are not written then, to
+    keep the memory used bounded.
+    """
+    telemetry_ = telemetry.Telemetry() if telemetry_path else None
+    start = time.time()
+    with _spill_dir(spill) as spill_dir:
+        data = _sync(
+            config_,
+            auth_driver,
+            progress,
+            transport,
+            telemetry_,
+            bulk,
+            spill_dir,
+        )
+        _persist(config_, data, start, indexed=not spill)
+    if telemetry_ and telemetry_path:
+        telemetry_.write(telemetry_path, openmetrics_path)
+
+
+def _persist(
+    config_: Config, data: schema.Rstate, start: float, indexed: bool = True
 ) -> None:
-    """Refresh the remote state from github to a local file."""
-    data = _sync(config_, auth_driver, progress)
+    """Validate and store the remote state of a full refresh from `start'."""
     print("validating cache")
     if schema.validate(data):
         print("persisting cache")
-        store(data)
+        store(
+            data,
+            config.get_cache_format(config_),
+            config.get_cache_compression(config_),
+            validated=True,
+            times=cache_freshness.full(start),
+            indexed=indexed,
+        )
+        if config.get_cache_history(config_):
+            print("recording snapshot")
+            record_snapshot(data)
+
+
+def refresh_organisations(
+    configs: Sequence[Config],
+    auth_driver: auth.AuthDriver,
+    progress: ProgressCB,
+    transport: utils.Transport = utils.github_graphql_call,
+    bulk: bool = False,
+) -> None:
+    """Refresh the caches of several organisations in one synchronisation.
+
+    The sub-queries about all the organisations share the compound queries,
+    and so the round trips, of the synchronisation (see `_sync_organisations').
+    The remote state of each organisation is stored in its own cache when
+    kept apart, see `organisation'.
+    """
+    start = time.time()
+    datas = _sync_organisations(
+        configs, auth_driver, progress, transport, bulk
+    )
+    for config_, data in zip(configs, datas):
+        with (
+            organisation(config.get_org_name(config_))
+            if config.get_cache_apart(config_)
+            else nullcontext()
+        ):
+            print("organisation {}".format(config.get_org_name(config_)))
+            _persist(config_, data, start)
+
+
+@contextmanager
+def _spill_dir(enabled: bool) -> Iterator[Path | None]:
+    """Return a temporary spill directory next to the cache, if `enabled'."""
+    if not enabled:
+        yield None
+        return
+    makedirs(data_dir(), exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=data_dir(), prefix="spill-") as dir_:
+        yield Path(dir_)
+
+
+def _record(
+    old: schema.Rstate,
+    data: schema.Rstate,
+    sections: Iterable[cache_freshness.Section],
+    start: float,
+    listings: bool = False,
+) -> int:
+    """Record the remote state `data', with `sections' fetched from `start'.
+
+    The entities which differ from `old', the cached remote state, are
+    appended to the journal, and the fetch times of the sections, and of the
+    listings if `listings' is set, are updated. The writer lock must be
+    held. Return the number of journal records.
+    """
+    # written first, a compaction of the journal carries them over
+    times = fetch_times()
+    cache_freshness.mark(times, data, sections, start)
+    if listings:
+        times["listings"] = start
+    _write_fetch_times(times)
+    return update(cache_journal.diff(old, data))
+
+
+def ingest(
+    config_: Config,
+    auth_driver: auth.AuthDriver,
+    events: List[Tuple[str, Any]],
+    transport: utils.Transport = utils.github_graphql_call,
+) -> int:
+    """Apply webhook events to the cache as targeted updates.
+
+    The entities the events change are requested again (see
+    ghaudit.webhooks), and recorded in the journal of the cache. Return the
+    number of journal records.
+    """
+    changes = webhooks.changes(events, config.get_org_name(config_))
+    with _writing():
+        old = load()
+        start = time.time()
+        data, repositories, teams, logins = webhooks.prepare(old, changes)
+        sections = cache_freshness.sections(
+            "repository", repositories
+        ) + cache_freshness.sections("team", teams)
+        data = _sync_targets(
+            config_, auth_driver, data, sections, logins, transport
+        )
+        data = webhooks.finish(data, changes)
+        schema.validate(data)
+        return _record(old, data, sections, start)
+
+
+def _remove_users(
+    data: Any, logins: Iterable[str], repositories: Set[str], teams: Set[str]
+) -> Dict[str, Any]:
+    """Remove users, to request them again, and return their roles.
+
+    The repositories and teams the users have access to are added to
+    `repositories' and `teams'.
+
+    :raises: RuntimeError if a user is not in the cache.
+    """
+    users = data["data"]["users"]
+    ids = {schema.user_login(v): k for k, v in users.items()}
+    roles = {}  # type: Dict[str, Any]
+    for login in sorted(logins):
+        if login not in ids:
+            raise RuntimeError(
+                'unknown user "{}", a full refresh is needed'.format(login)
+            )
+        user_id = ids[login]
+        roles[user_id] = users.pop(user_id).get("role")
+    for connection, names, key in (
+        ("repositories", repositories, "collaborators"),
+        ("teams", teams, "members"),
+    ):
+        for edge in data["data"]["organization"][connection]["edges"]:
+            relations = (edge["node"].get(key) or {}).get("edges") or []
+            if any(x and x["node"]["id"] in roles for x in relations):
+                names.add(edge["node"]["name"])
+    return roles
+
+
+def refresh_entities(
+    config_: Config,
+    auth_driver: auth.AuthDriver,
+    repositories: Iterable[str] = (),
+    teams: Iterable[str] = (),
+    logins: Iterable[str] = (),
+    transport: utils.Transport = utils.github_graphql_call,
+) -> int:
+    """Request some repositories, teams and users of the cache again.
+
+    The collaborators and branch protection rules of the `repositories', the
+    repositories, members and children of the `teams', and the users of
+    `logins' with the repositories and teams they have access to are
+    replaced, and recorded in the journal of the cache. Return the number of
+    journal records.
+
+    :raises: RuntimeError if an entity is not in the cache.
+    """
+    repositories, teams, logins = set(repositories), set(teams), set(logins)
+    with _writing():
+        old = load()
+        start = time.time()
+        data = copy.deepcopy(old)  # type: Any
+        roles = _remove_users(data, logins, repositories, teams)
+        sections = cache_freshness.sections(
+            "repository", sorted(repositories)
+        ) + cache_freshness.sections("team", sorted(teams))
+        data = _sync_targets(
+            config_, auth_driver, data, sections, logins, transport
+        )
+        for user_id, role in roles.items():
+            if role and user_id in data["data"]["users"]:
+                data["data"]["users"][user_id]["role"] = role
+        schema.validate(data)
+        return _record(old, data, sections, start)
+
+
+def _refresh_all(
+    config_: Config,
+    auth_driver: auth.AuthDriver,
+    start: float,
+    transport: utils.Transport,
+) -> None:
+    rstate = _sync(config_, auth_driver, lambda _: None, transport)
+    schema.validate(rstate)
+    store(
+        rstate,
+        config.get_cache_format(config_),
+        config.get_cache_compression(config_),
+        validated=True,
+        times=cache_freshness.full(start),
+    )
+
+
+def refresh_stale(
+    config_: Config,
+    auth_driver: auth.AuthDriver,
+    max_age: float,
+    repositories: Iterable[str] | None = None,
+    teams: Iterable[str] | None = None,
+    transport: utils.Transport = utils.github_graphql_call,
+) -> int | None:
+    """Request again the parts of the cache older than `max_age' seconds.
+
+    The listings of the organisation are requested again when stale, with
+    the sections of the repositories and teams they add (see
+    ghaudit.cache_freshness). Of the other sections, only those of the
+    `repositories' and `teams' named are considered when given, and all of
+    them otherwise. The whole cache is refreshed when there is none. Return
+    the number of sections requested, or None after a full refresh.
+    """
+    with _writing():
+        start = time.time()
+        if not file_path().exists():
+            _refresh_all(config_, auth_driver, start, transport)
+            return None
+        old = load()
+        times = fetch_times()
+        changes = None
+        data, logins, sections = old, [], []  # type: Any, List[str], Any
+        if cache_freshness.listings_stale(times, start - max_age):
+            data, changes = cache_freshness.listing_changes(
+                old, _sync_listings(config_, auth_driver, transport)
+            )
+            data, new_repositories, new_teams, logins = webhooks.prepare(
+                data, changes
+            )
+            sections = cache_freshness.sections(
+                "repository", sorted(new_repositories)
+            ) + cache_freshness.sections("team", sorted(new_teams))
+        sections += [
+            x
+            for x in cache_freshness.stale(
+                times, data, start - max_age, repositories, teams
+            )
+            if x not in sections
+        ]
+        if changes is None and not sections:
+            return 0
+        data = _sync_targets(
+            config_,
+            auth_driver,
+            copy.deepcopy(data) if data is old else data,
+            sections,
+            logins,
+            transport,
+        )
+        if changes is not None:
+            data = webhooks.finish(data, changes)
+        schema.validate(data)
+        _record(old, data, sections, start, changes is not None)
+        return len(sections)
+
+
+def shard_path(index: int, count: int) -> Path:
+    """Return the default path of the file of a shard of the cache."""
+    return data_dir() / "shard-{}-of-{}".format(index, count)
+
+
+def refresh_shard(
+    config_: Config,
+    auth_driver: auth.AuthDriver,
+    index: int,
+    count: int,
+    output: Path,
+    seed: Path | None = None,
+    transport: utils.Transport = utils.github_graphql_call,
+) -> int:
+    """Request a shard of the remote state and write it to `output'.
+
+    See ghaudit.cache_shards. The listings of the organisation are read from
+    the cache file `seed' if given, and requested otherwise. The shard is
+    written in the cache format of the configuration, or json for sqlite.
+    Return the number of repositories and teams of the shard.
+    """
+    start = time.time()
+    if seed:
+        listings = cache_shards.listings(_decode(seed, *_detect(seed)))
+    else:
+        listings = _sync_listings(config_, auth_driver, transport)
+    repositories, teams = cache_shards.select(listings, index, count)
+    shard = cache_shards.Shard(
+        index, count, cache_shards.digest(listings), start, bool(seed)
+    )
+    data = _sync_targets(
+        config_,
+        auth_driver,
+        listings,
+        cache_freshness.sections("repository", repositories)
+        + cache_freshness.sections("team", teams),
+        [],
+        transport,
+    )
+    _write_shard(config_, output, {**data, "shard": shard._asdict()})
+    return len(repositories) + len(teams)
+
+
+def _write_shard(config_: Config, output: Path, data: Any) -> None:
+    format_ = config.get_cache_format(config_)
+    if format_ == "sqlite":
+        format_ = "json"
+
+    def write(temp_path: Path) -> None:
+        with open(temp_path, "wb") as output_file:
+            cache_format.dump(
+                data,
+                output_file,
+                format_,
+                config.get_cache_compression(config_),
+            )
+
+    _write(output, write)
+
+
+def _read_shard(path_: Path) -> Tuple[cache_shards.Shard, schema.Rstate]:
+    """Return a shard written by refresh_shard, and its remote state.
+
+    :raises: RuntimeError if the file is not a shard.
+    """
+    data = _decode(path_, *_detect(path_))  # type: Any
+    if "shard" not in data:
+        raise RuntimeError("not a shard of the cache: {}".format(path_))
+    return cache_shards.Shard(**data.pop("shard")), data
+
+
+def merge_shards(config_: Config, paths: Iterable[Path]) -> int:
+    """Merge the shards of a refresh and store the result as the cache.
+
+    The merged remote state is validated, and recorded as a snapshot if the
+    history is enabled. Return the number of shards.
+
+    :raises: RuntimeError if shards are missing, repeated, or were made from
+    different listings.
+    """
+    shards = [_read_shard(x) for x in paths]
+    data = cache_shards.merge(shards)
+    schema.validate(data)
+    times = cache_freshness.full(min(x.time for x, _ in shards))
+    if any(x.seeded for x, _ in shards):
+        times["listings"] = None
+    store(
+        data,
+        config.get_cache_format(config_),
+        config.get_cache_compression(config_),
+        validated=True,
+        times=times,
+    )
+    if config.get_cache_history(config_):
+        record_snapshot(data)
+    return len(shards)
+
+
+def replay(
+    config_: Config,
+    cassette_path: Path,
+    progress: ProgressCB,
+    bulk: bool = False,
+) -> Mapping[str, int | float]:
+    """Run a synchronisation against a recorded cassette.
+
+    No network access is made and the cache file is left untouched. Return
+    measurements of the run, meant to be compared between ghaudit versions
+    or between build modes (see `bulk' in refresh).
+    """
+    player = cassette.Player(cassette_path)
+    start = time.process_time()
+    data = _sync(config_, lambda: {}, progress, player, bulk=bulk)
+    cpu_time = time.process_time() - start
+    schema.validate(data)
+    return {
+        "roundtrips": player.played(),
+        "unplayed roundtrips": player.remaining(),
+        "cpu time (s)": round(cpu_time, 3),
+        "peak memory (KiB)": resource.getrusage(
+            resource.RUSAGE_SELF
+        ).ru_maxrss,
+        "teams": len(schema.org_teams(data)),
+        "repositories": len(schema.org_repositories(data)),
+        "users": len(schema.users(data)),
+    }
 
 
 FRAG_PAGEINFO_FIELDS = """
@@ -85,115 +1157,483 @@ MAX_PARALLEL_QUERIES = 40
 ORG_TEAMS_MAX = 90
 ORG_MEMBERS_MAX = 90
 ORG_REPOSITORIES_MAX = 90
+TEAM_REPOSITORIES_MAX = 40
+TEAM_MEMBERS_MAX = 40
+TEAM_CHILDREN_MAX = 40
+REPO_COLLABORATORS_MAX = 40
+REPO_BRANCH_PROTECTION_MAX = 40
+BRANCH_PROTECTION_PUSH_ALLOWANCES_MAX = 10
+
 
+def _counts(data: schema.Rstate) -> Mapping[str, int]:
+    return {
+        "teams": len(schema.org_teams(data)),
+        "repositories": len(schema.org_repositories(data)),
+        "members": len(schema.org_members(data)),
+        "users": len(schema.users(data)),
+        "bprules": len(schema.all_bp_rules(data)),
+    }
 
-def _sync_progress(data, query, found, progress: ProgressCB):
+
+def _sync_progress(counts: Mapping[str, int], query, found, progress):
     stats = query.stats()
     progress(
         [
             ("total HTTP roundtrips", stats["iterations"]),
             ("graphQL queries", stats["done"], stats["queries"]),
-            ("teams", len(schema.org_teams(data)), len(found["teams"])),
+            ("teams", counts["teams"], len(found["teams"])),
             (
                 "repositories",
-                len(schema.org_repositories(data)),
+                counts["repositories"],
                 len(found["repositories"]),
             ),
-            ("org members", len(schema.org_members(data))),
-            ("users", len(schema.users(data))),
+            ("org members", counts["members"]),
+            ("users", counts["users"]),
             (
                 "branch protection rules",
-                len(schema.all_bp_rules(data)),
+                counts["bprules"],
                 len(found["bprules"]),
             ),
         ]
     )
 
 
-def _sync(config_: Config, auth_driver, progress: ProgressCB):
-    data = schema.empty()
-    found = {
-        "teams": [],
-        "repositories": [],
-        "collaborators": [],
-        "bprules": [],
-    }  # type: Dict[str, List[str]]
-    workaround2 = {"team": 0, "repo": 0, "user": 0, "bprules": 0}
-    query = CompoundQuery(MAX_PARALLEL_QUERIES)
-    demo_params = {
+def _org_params(config_: Config) -> Dict[str, str | int]:
+    return {
         "organisation": config.get_org_name(config_),
         "teamsMax": ORG_TEAMS_MAX,
         "membersWithRoleMax": ORG_MEMBERS_MAX,
         "repositoriesMax": ORG_REPOSITORIES_MAX,
-    }  # type: Dict[str, str | int]
+    }
+
 
+def _sync_listings(
+    config_: Config,
+    auth_driver,
+    transport: utils.Transport = utils.github_graphql_call,
+) -> schema.Rstate:
+    """Request the repositories, teams and members of the organisation.
+
+    The connections of the repositories and teams are not requested.
+    """
+    data = schema.empty()
+    query = CompoundQuery(MAX_PARALLEL_QUERIES, transport)
     query.add_frag(FRAG_PAGEINFO_FIELDS)
     query.append(OrgTeamsQuery())
     query.append(OrgMembersQuery())
     query.append(OrgRepoQuery())
     while not query.finished():
-        result = query.run(auth_driver, demo_params)
-
+        result = query.run(auth_driver, _org_params(config_))
         for key, value in result["data"].items():
             data = schema.merge(data, key, {"data": {"organization": value}})
+    return data
 
-        new_teams = [
-            x
-            for x in schema.org_teams(data)
-            if schema.team_name(x) not in found["teams"]
-        ]
-        new_repos = [
-            x
-            for x in schema.org_repositories(data)
-            if schema.repo_name(x) not in found["repositories"]
+
+def _sync(
+    config_: Config,
+    auth_driver,
+    progress: ProgressCB,
+    transport: utils.Transport = utils.github_graphql_call,
+    telemetry_: telemetry.Telemetry | None = None,
+    bulk: bool = False,
+    spill: Path | None = None,
+):
+    """Request the remote state of the organisation.
+
+    With `bulk', the responses are buffered and the remote state is built
+    once they are all received (see ghaudit.state_builder), instead of
+    merging each response as it arrives. With a `spill' directory, the
+    responses are buffered too, and the complete repositories and teams are
+    written to the directory, which must be kept while the remote state is
+    used.
+    """
+    data = schema.empty()
+    builder = state_builder.Builder(spill) if bulk or spill else None
+    found = {
+        "teams": set(),
+        "repositories": set(),
+        "collaborators": set(),
+        "bprules": set(),
+    }  # type: Dict[str, Set[str]]
+    workaround2 = {"team": 0, "repo": 0, "user": 0, "bprules": 0}
+    query = CompoundQuery(MAX_PARALLEL_QUERIES, transport, telemetry_)
+    demo_params = _org_params(config_)
+
+    query.add_frag(FRAG_PAGEINFO_FIELDS)
+    query.append(OrgTeamsQuery())
+    query.append(OrgMembersQuery())
+    query.append(OrgRepoQuery())
+    while not query.finished():
+        with tracing.span(
+            "sync iteration", iteration=query.stats()["iterations"] + 1
+        ):
+            data = _sync_iteration(
+                data,
+                query,
+                found,
+                workaround2,
+                auth_driver,
+                demo_params,
+                telemetry_,
+                builder,
+            )
+        _sync_progress(
+            builder.counts() if builder else _counts(data),
+            query,
+            found,
+            progress,
+        )
+
+    if builder:
+        build_start = time.process_time()
+        with tracing.span("build"):
+            data = builder.build()
+        if telemetry_:
+            telemetry_.merge_cpu(time.process_time() - build_start)
+    return data
+
+
+class _Organisation(NamedTuple):
+    # prefix of the names of the sub-queries of the organisation
+    prefix: str
+    params: Mapping[str, str | int]
+    found: Dict[str, Set[str]]
+    workaround2: Dict[str, int]
+    builder: state_builder.Builder | None
+
+
+def _sync_organisations(
+    configs: Sequence[Config],
+    auth_driver,
+    progress: ProgressCB,
+    transport: utils.Transport = utils.github_graphql_call,
+    bulk: bool = False,
+) -> List[schema.Rstate]:
+    """Request the remote states of several organisations together.
+
+    As `_sync', but the sub-queries about every organisation are batched in
+    the same compound query, renamed apart (see
+    ghaudit.query.namespaced.NamespacedQuery), so that the round trips are
+    shared by the organisations. Return the remote states in the order of
+    `configs'.
+    """
+    query = CompoundQuery(MAX_PARALLEL_QUERIES, transport)
+    query.add_frag(FRAG_PAGEINFO_FIELDS)
+    orgs = [
+        _Organisation(
+            "org{}_".format(index),
+            _org_params(config_),
+            {
+                "teams": set(),
+                "repositories": set(),
+                "collaborators": set(),
+                "bprules": set(),
+            },
+            {"team": 0, "repo": 0, "user": 0, "bprules": 0},
+            state_builder.Builder() if bulk else None,
+        )
+        for index, config_ in enumerate(configs, 1)
+    ]
+    datas = [schema.empty() for _ in orgs]
+
+    def append(org: _Organisation, sub_query: SubQuery) -> None:
+        query.append(NamespacedQuery(sub_query, org.prefix, org.params))
+
+    for org in orgs:
+        append(org, OrgTeamsQuery())
+        append(org, OrgMembersQuery())
+        append(org, OrgRepoQuery())
+    while not query.finished():
+        with tracing.span(
+            "sync iteration", iteration=query.stats()["iterations"] + 1
+        ):
+            result = query.run(auth_driver, {})
+            for index, org in enumerate(orgs):
+                datas[index] = _apply(
+                    datas[index],
+                    {
+                        k[len(org.prefix) :]: v
+                        for k, v in result["data"].items()
+                        if k.startswith(org.prefix)
+                    },
+                    functools.partial(append, org),
+                    org.found,
+                    org.workaround2,
+                    [
+                        x.sub_query()
+                        for x in query.done()
+                        if isinstance(x, NamespacedQuery)
+                        and x.prefix() == org.prefix
+                    ],
+                    builder=org.builder,
+                )
+        counts = [
+            org.builder.counts() if org.builder else _counts(data)
+            for org, data in zip(orgs, datas)
         ]
-        new_collaborators = [
+        _sync_progress(
+            {k: sum(x[k] for x in counts) for k in counts[0]},
+            query,
+            {k: [y for x in orgs for y in x.found[k]] for k in orgs[0].found},
+            progress,
+        )
+    return [
+        org.builder.build() if org.builder else data
+        for org, data in zip(orgs, datas)
+    ]
+
+
+def _clear_sections(
+    data: Any, sections: Iterable[cache_freshness.Section]
+) -> None:
+    """Remove sections of a remote state, to request them again.
+
+    :raises: RuntimeError if a repository or a team is not in the cache.
+    """
+    org = data["data"]["organization"]
+    nodes = {
+        "repository": {
+            x["node"]["name"]: x["node"] for x in org["repositories"]["edges"]
+        },
+        "team": {x["node"]["name"]: x["node"] for x in org["teams"]["edges"]},
+    }
+    for section in sections:
+        if section.name not in nodes[section.kind]:
+            raise RuntimeError(
+                'unknown {} "{}", a full refresh is needed'.format(
+                    section.kind, section.name
+                )
+            )
+        nodes[section.kind][section.name].pop(section.connection, None)
+
+
+def _section_query(
+    section: cache_freshness.Section,
+    slugs: Mapping[str, str],
+    workaround2: Dict[str, int],
+) -> SubQuery:
+    """Return the sub-query requesting a section of a remote state."""
+    kind = "repo" if section.kind == "repository" else "team"
+    num = workaround2[kind]
+    workaround2[kind] += 1
+    if section.connection == "collaborators":
+        return RepoCollaboratorQuery(section.name, num, REPO_COLLABORATORS_MAX)
+    if section.connection == "branchProtectionRules":
+        return RepoBranchProtectionQuery(
+            section.name, num, REPO_BRANCH_PROTECTION_MAX
+        )
+    if section.connection == "repositories":
+        return TeamRepoQuery(section.name, num, TEAM_REPOSITORIES_MAX)
+    if section.connection == "members":
+        return TeamMemberQuery(slugs[section.name], num, TEAM_MEMBERS_MAX)
+    return TeamChildrenQuery(section.name, num, TEAM_CHILDREN_MAX)
+
+
+# pylint: disable=too-many-arguments
+def _sync_targets(
+    config_: Config,
+    auth_driver,
+    data: schema.Rstate,
+    sections: Iterable[cache_freshness.Section],
+    logins: Iterable[str],
+    transport: utils.Transport = utils.github_graphql_call,
+) -> schema.Rstate:
+    """Request some sections of a remote state again, in place.
+
+    The sections (see ghaudit.cache_freshness) are replaced using the
+    sub-queries of a synchronisation, followed by the sub-queries of the
+    users and branch protection rules they lead to. The users of `logins'
+    are requested too.
+
+    :raises: RuntimeError if a repository or a team is not in the cache.
+    """
+    sections = list(sections)
+    _clear_sections(data, sections)
+    found = {
+        "teams": {schema.team_name(x) for x in schema.org_teams(data)},
+        "repositories": {
+            schema.repo_name(x) for x in schema.org_repositories(data)
+        },
+        "collaborators": set(logins),
+        "bprules": {str(x) for x in schema.all_bp_rules(data)},
+    }  # type: Dict[str, Set[str]]
+    workaround2 = {"team": 0, "repo": 0, "user": 0, "bprules": 0}
+    query = CompoundQuery(MAX_PARALLEL_QUERIES, transport)
+    query.add_frag(FRAG_PAGEINFO_FIELDS)
+    for login in found["collaborators"]:
+        query.append(UserQuery(login, workaround2["user"]))
+        workaround2["user"] += 1
+    slugs = {
+        schema.team_name(x): x["node"]["slug"] for x in schema.org_teams(data)
+    }
+    for section in sections:
+        query.append(_section_query(section, slugs, workaround2))
+    params = {"organisation": config.get_org_name(config_)}
+    while not query.finished():
+        data = _sync_iteration(
+            data, query, found, workaround2, auth_driver, params
+        )
+    return data
+
+
+# pylint: disable=too-many-arguments
+def _sync_iteration(
+    data: schema.Rstate,
+    query: CompoundQuery,
+    found: Dict[str, Set[str]],
+    workaround2: Dict[str, int],
+    auth_driver,
+    params: Mapping[str, str | int],
+    telemetry_: telemetry.Telemetry | None = None,
+    builder: state_builder.Builder | None = None,
+) -> schema.Rstate:
+    """Run one round trip, merge its response and queue new sub-queries.
+
+    With a `builder', the response is buffered in it instead.
+    """
+    result = query.run(auth_driver, params)
+    return _apply(
+        data,
+        result["data"],
+        query.append,
+        found,
+        workaround2,
+        query.done(),
+        telemetry_,
+        builder,
+    )
+
+
+# pylint: disable=too-many-arguments
+def _apply(
+    data: schema.Rstate,
+    response: Mapping[str, Any],
+    append: Callable[[SubQuery], None],
+    found: Dict[str, Set[str]],
+    workaround2: Dict[str, int],
+    done: Iterable[SubQuery],
+    telemetry_: telemetry.Telemetry | None = None,
+    builder: state_builder.Builder | None = None,
+) -> schema.Rstate:
+    """Merge the response of a round trip and queue new sub-queries.
+
+    `done' are the sub-queries the round trip finished.
+    """
+    merge_start = time.process_time()
+    with tracing.span("merge", roots=len(response)):
+        for key, value in response.items():
+            if builder:
+                builder.add(key, value)
+            else:
+                data = schema.merge(
+                    data, key, {"data": {"organization": value}}
+                )
+    discovery_start = time.process_time()
+
+    with tracing.span("discovery"):
+        _queue(
+            append,
+            found,
+            workaround2,
+            builder.discover() if builder else _discover(data),
+        )
+    if builder:
+        builder.finished(_entities(done))
+
+    if telemetry_:
+        telemetry_.merge_cpu(discovery_start - merge_start)
+        telemetry_.discovery_cpu(time.process_time() - discovery_start)
+    return data
+
+
+def _discover(data: schema.Rstate) -> state_builder.Discovered:
+    """Return the entities of a remote state, to request the new ones."""
+    return state_builder.Discovered(
+        teams=[
+            (schema.team_name(x), x["node"]["slug"])
+            for x in schema.org_teams(data)
+        ],
+        repositories=[
+            schema.repo_name(x) for x in schema.org_repositories(data)
+        ],
+        logins=[
             y
             for x in schema.org_repositories(data)
             for y in schema.missing_collaborators(data, x)
-            if y not in found["collaborators"]
-        ]
-        new_bp_rules = [
-            x for x in schema.all_bp_rules(data) if x not in found["bprules"]
-        ]
+        ],
+        rules=[str(x) for x in schema.all_bp_rules(data)],
+    )
 
-        for team in new_teams:
-            name = schema.team_name(team)
-            query.append(TeamRepoQuery(name, workaround2["team"], 40))
-            workaround2["team"] += 1
-            query.append(
-                TeamMemberQuery(team["node"]["slug"], workaround2["team"], 40)
-            )
-            workaround2["team"] += 1
-            found["teams"].append(name)
-            query.append(TeamChildrenQuery(name, workaround2["team"], 40))
-            workaround2["team"] += 1
-            found["teams"].append(name)
-
-        for repo in new_repos:
-            name = schema.repo_name(repo)
-            query.append(RepoCollaboratorQuery(name, workaround2["repo"], 40))
-            workaround2["repo"] += 1
-            query.append(
-                RepoBranchProtectionQuery(name, workaround2["repo"], 40)
+
+def _entities(sub_queries: Iterable[SubQuery]) -> List[Tuple[str, str]]:
+    """Return the kind and the name of the entities of sub-queries.
+
+    See state_builder.Builder.finished.
+    """
+    kinds = (
+        (RepoCollaboratorQuery, "repository"),
+        (RepoBranchProtectionQuery, "repository"),
+        (TeamRepoQuery, "team"),
+        (TeamChildrenQuery, "team"),
+        (TeamMemberQuery, "team slug"),
+        (BranchProtectionPushAllowances, "rule"),
+    )
+    return [
+        (kind, x.entity())
+        for x in sub_queries
+        for type_, kind in kinds
+        if isinstance(x, type_)
+    ]
+
+
+def _queue(
+    append: Callable[[SubQuery], None],
+    found: Dict[str, Set[str]],
+    workaround2: Dict[str, int],
+    discovered: state_builder.Discovered,
+) -> None:
+    """Queue the sub-queries of the entities not found before with `append'."""
+    for name, slug in discovered.teams:
+        if name in found["teams"]:
+            continue
+        append(TeamRepoQuery(name, workaround2["team"], TEAM_REPOSITORIES_MAX))
+        workaround2["team"] += 1
+        append(TeamMemberQuery(slug, workaround2["team"], TEAM_MEMBERS_MAX))
+        workaround2["team"] += 1
+        append(TeamChildrenQuery(name, workaround2["team"], TEAM_CHILDREN_MAX))
+        workaround2["team"] += 1
+        found["teams"].add(name)
+
+    for name in discovered.repositories:
+        if name in found["repositories"]:
+            continue
+        append(
+            RepoCollaboratorQuery(
+                name, workaround2["repo"], REPO_COLLABORATORS_MAX
             )
-            workaround2["repo"] += 1
-            found["repositories"].append(name)
-
-        for login in new_collaborators:
-            query.append(UserQuery(login, workaround2["user"]))
-            workaround2["user"] += 1
-            found["collaborators"].append(login)
-
-        for rule_id in new_bp_rules:
-            query.append(
-                BranchProtectionPushAllowances(
-                    str(rule_id), workaround2["bprules"], 10
-                )
+        )
+        workaround2["repo"] += 1
+        append(
+            RepoBranchProtectionQuery(
+                name, workaround2["repo"], REPO_BRANCH_PROTECTION_MAX
             )
-            workaround2["bprules"] += 1
-            found["bprules"].append(str(rule_id))
+        )
+        workaround2["repo"] += 1
+        found["repositories"].add(name)
 
-        _sync_progress(data, query, found, progress)
+    # sorted, for the sub-queries not to depend on the build mode
+    for login in sorted(set(discovered.logins) - found["collaborators"]):
+        append(UserQuery(login, workaround2["user"]))
+        workaround2["user"] += 1
+        found["collaborators"].add(login)
 
-    return data
+    for rule_id in sorted(set(discovered.rules) - found["bprules"]):
+        append(
+            BranchProtectionPushAllowances(
+                rule_id,
+                workaround2["bprules"],
+                BRANCH_PROTECTION_PUSH_ALLOWANCES_MAX,
+            )
+        )
+        workaround2["bprules"] += 1
+        found["bprules"].add(rule_id)
@@ -0,0 +1,568 @@
+"""Serialisation formats of the cache file.
+
+Three formats are supported:
+
+ * json: the remote state as JSON text.
+ * binary: a header made of `MAGIC' and the format version as a 16 bits big
+   endian integer, followed by the remote state serialised with marshal.
+ * sqlite: a SQLite database, see ghaudit.cache_sqlite. As it is not
+   serialised to bytes, it is handled by ghaudit.cache.
+
+The binary format is split in sections (see `SECTIONS') which are decoded
+independently, located by an index: a marshal serialised mapping of section
+names to their offset and length. The sections are only decoded when first
+accessed, so that a command reading the organisation members does not
+decode repositories. The sections directly follow the header, and are
+followed by the index and its length as a 32 bits big endian integer, so
+that the file can be written as a stream.
+
+Node IDs and logins are repeated across the remote state (team members,
+team repositories, collaborators, push allowances...). Before being written
+in the binary format, equal strings are replaced by a single shared object,
+so that marshal stores each of them once per section and refers to it
+afterwards: the decoded section shares the object as well. The remote state
+written is not modified, the strings are shared in a copy. Remote states
+decoded from json share their strings too, as the decoder builds them.
+
+The json and binary formats can be compressed with gzip or zstd (the latter
+requires the zstandard package). Both the format and the compression of a
+cache file are detected from its first bytes when loading, so that the cache
+can be read whichever format it was written with.
+"""
+
+from __future__ import annotations
+
+import gc
+import gzip
+import io
+import json
+import marshal  # nosec: only reads cache files written by ghaudit
+import struct
+from contextlib import contextmanager
+from functools import partial
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Tuple,
+    Union,
+)
+
+from ghaudit import schema
+
+try:
+    import zstandard  # type: ignore
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+FORMATS = ("json", "binary", "sqlite")
+DEFAULT_FORMAT = "json"
+COMPRESSIONS = ("none", "gzip", "zstd")
+DEFAULT_COMPRESSION = "none"
+
+MAGIC = b"GHAC"
+SQLITE_MAGIC = b"SQLite format 3\x00"
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# number of bytes needed to detect formats and compressions
+MAGIC_SIZE = len(SQLITE_MAGIC)
+VERSION = 3
+_HEADER = struct.Struct(">4sH")
+_INDEX_SIZE = struct.Struct(">I")
+# marshal format version, fixed so that caches remain readable across python
+# versions
+_MARSHAL_VERSION = 4
+
+# sections of the binary format, in their order in the file. The remainder
+# of the remote state, with placeholders for the sections, is stored in
+# the "rest" section, decoded first.
+SECTIONS = ("users", "members", "repositories", "bprules", "teams")
+
+# bytes, or a memory map of the cache file
+Buffer = Union[bytes, Any]
+
+
+def detect(raw: bytes) -> str:
+    """Return the format of serialised remote state data."""
+    if raw.startswith(MAGIC):
+        return "binary"
+    if raw.startswith(SQLITE_MAGIC):
+        return "sqlite"
+    return "json"
+
+
+def detect_compression(raw: bytes) -> str:
+    """Return the compression of serialised remote state data."""
+    if raw.startswith(GZIP_MAGIC):
+        return "gzip"
+    if raw.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return "none"
+
+
+def _zstandard() -> Any:
+    if not zstandard:
+        raise RuntimeError(
+            "the zstandard package is required for zstd compression"
+        )
+    return zstandard
+
+
+@contextmanager
+def compressed_writer(
+    stream: IO[bytes], compression: str
+) -> Iterator[IO[bytes]]:
+    """Return a stream compressing what is written to `stream'."""
+    if compression == "none":
+        yield stream
+    elif compression == "gzip":
+        with gzip.GzipFile(fileobj=stream, mode="wb", mtime=0) as writer:
+            yield writer  # type: ignore
+    elif compression == "zstd":
+        compressor = _zstandard().ZstdCompressor()
+        with compressor.stream_writer(stream, closefd=False) as writer:
+            yield writer
+    else:
+        raise RuntimeError(
+            'unknown cache compression: "{}"'.format(compression)
+        )
+
+
+@contextmanager
+def _decompressed_reader(
+    stream: IO[bytes], compression: str
+) -> Iterator[IO[bytes]]:
+    if compression == "gzip":
+        with gzip.GzipFile(fileobj=stream, mode="rb") as reader:
+            yield reader  # type: ignore
+    elif compression == "zstd":
+        decompressor = _zstandard().ZstdDecompressor()
+        with decompressor.stream_reader(stream, closefd=False) as reader:
+            yield reader
+    else:
+        yield stream
+
+
+def decompress(stream: IO[bytes], compression: str) -> bytes:
+    """Read and decompress a stream, by chunks."""
+    with _decompressed_reader(stream, compression) as reader:
+        return reader.read()
+
+
+def detect_stream(stream: IO[bytes]) -> Tuple[str, str]:
+    """Return the format and the compression of a seekable stream.
+
+    Only the first bytes of the stream are read and decompressed.
+    """
+    head = stream.read(MAGIC_SIZE)
+    compression = detect_compression(head)
+    if compression != "none":
+        stream.seek(0)
+        with _decompressed_reader(stream, compression) as reader:
+            head = reader.read(MAGIC_SIZE)
+    return detect(head), compression
+
+
+class LazyDict(dict):
+    """Dictionary decoding some of its values on first access.
+
+    The keys of the values not decoded yet are present, associated to a
+    placeholder, so that membership tests do not decode anything.
+    """
+
+    def __init__(
+        self, items: Mapping[str, Any], loaders: Mapping[str, Callable]
+    ) -> None:
+        super().__init__(items)
+        self._loaders = dict(loaders)
+
+    def _load(self, key: Any) -> None:
+        loader = self._loaders.pop(key, None)
+        if loader:
+            dict.__setitem__(self, key, loader())
+
+    def _load_all(self) -> None:
+        for key in list(self._loaders):
+            self._load(key)
+
+    def __getitem__(self, key: Any) -> Any:
+        self._load(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._loaders.pop(key, None)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key: Any) -> None:
+        self._loaders.pop(key, None)
+        super().__delitem__(key)
+
+    # pylint: disable=useless-parent-delegation
+    def __iter__(self) -> Iterator:
+        # overriding __iter__ prevents dict(x) and {**x} from copying the
+        # placeholders, by using keys() and __getitem__ instead
+        return super().__iter__()
+
+    def __eq__(self, other: object) -> bool:
+        self._load_all()
+        return super().__eq__(other)
+
+    def __ne__(self, other: object) -> bool:
+        return not self == other
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        self._load_all()
+        return super().__repr__()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        self._load(key)
+        return super().get(key, default)
+
+    def items(self):  # type: ignore
+        self._load_all()
+        return super().items()
+
+    def values(self):  # type: ignore
+        self._load_all()
+        return super().values()
+
+    def pop(self, key: Any, *default: Any) -> Any:
+        self._load(key)
+        return super().pop(key, *default)
+
+    def setdefault(self, key: Any, default: Any = None) -> Any:
+        self._load(key)
+        return super().setdefault(key, default)
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        for key in dict(*args, **kwargs):
+            self._loaders.pop(key, None)
+        super().update(*args, **kwargs)
+
+    def copy(self) -> Dict:  # type: ignore
+        self._load_all()
+        return dict(self)
+
+
+def _split(rstate: schema.Rstate) -> Dict[str, Any]:
+    """Split a remote state in sections."""
+    data = rstate["data"]
+    org = data["organization"]
+    repos = []
+    rules = []  # type: List[List[Any]]
+    for edge in org["repositories"]["edges"]:
+        node = dict(edge["node"])
+        if "branchProtectionRules" in node:
+            rules.append([node["branchProtectionRules"]])
+            node["branchProtectionRules"] = None
+        else:
+            rules.append([])
+        repos.append({**edge, "node": node})
+    return {
+        "rest": {
+            **rstate,
+            "data": {
+                **data,
+                "users": None,
+                "organization": {
+                    **org,
+                    "membersWithRole": None,
+                    "repositories": {**org["repositories"], "edges": None},
+                    "teams": {**org["teams"], "edges": None},
+                },
+            },
+        },
+        "users": dict(data["users"]),
+        "members": list(org["membersWithRole"]),
+        "repositories": repos,
+        "bprules": rules,
+        "teams": list(org["teams"]["edges"]),
+    }
+
+
+def share_strings(value: Any, table: Dict[str, str] | None = None) -> Any:
+    """Return a copy of `value' where equal strings are a single object.
+
+    `value' is left as is. `table' maps the strings already seen to their
+    shared object, and can be reused between calls to share strings across
+    values.
+    """
+    if table is None:
+        table = {}
+    if isinstance(value, str):
+        return table.setdefault(value, value)
+    if isinstance(value, dict):
+        return {
+            table.setdefault(k, k) if isinstance(k, str) else k: share_strings(
+                v, table
+            )
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [share_strings(x, table) for x in value]
+    return value
+
+
+def _shared_pairs(
+    table: Dict[str, str], pairs: List[Tuple[str, Any]]
+) -> Dict[str, Any]:
+    """Build a decoded json object with the strings of `table' shared.
+
+    Used as the object_pairs_hook of the json decoder, which builds the
+    innermost objects first: the strings of lists, e.g. the organisation
+    members, are shared from their object too.
+    """
+    result = {}
+    for key, value in pairs:
+        if isinstance(value, str):
+            value = table.setdefault(value, value)
+        elif isinstance(value, list) and value and isinstance(value[0], str):
+            value = [table.setdefault(x, x) for x in value]
+        result[table.setdefault(key, key)] = value
+    return result
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _plain(value[k]) for k in value}
+    if isinstance(value, list):
+        return [_plain(x) for x in value]
+    return value
+
+
+def pack(value: Any) -> bytes:
+    """Serialise a value of a remote state, e.g. one entity, with marshal."""
+    return marshal.dumps(_plain(value), _MARSHAL_VERSION)
+
+
+def unpack(raw: Buffer) -> Any:
+    """Deserialise a value serialised with `pack'."""
+    return marshal.loads(raw)  # nosec: see import
+
+
+def dump_sections(
+    sections: Iterable[Tuple[str, Any]],
+    stream: IO[bytes],
+    magic: bytes = MAGIC,
+    version: int = VERSION,
+) -> None:
+    """Write named values as sections, in the layout of the binary format.
+
+    The sections are serialised with marshal one at a time, and can be read
+    back with `load_sections'.
+    """
+    stream.write(_HEADER.pack(magic, version))
+    index = {}  # type: Dict[str, Tuple[int, int]]
+    offset = 0
+    for name, value in sections:
+        blob = marshal.dumps(value, _MARSHAL_VERSION)
+        index[name] = (offset, len(blob))
+        offset += len(blob)
+        stream.write(blob)
+    raw_index = marshal.dumps(index, _MARSHAL_VERSION)
+    stream.write(raw_index)
+    stream.write(_INDEX_SIZE.pack(len(raw_index)))
+
+
+def _dump_binary(rstate: schema.Rstate, stream: IO[bytes]) -> None:
+    """Write a remote state in the binary format, one section at a time."""
+    strings = {}  # type: Dict[str, str]
+    dump_sections(
+        (
+            (name, share_strings(value, strings))
+            for name, value in _split(rstate).items()
+        ),
+        stream,
+    )
+
+
+# depth of the remote state containers written piecewise. Deeper values,
+# e.g. a repository, are encoded at once.
+_JSON_STREAM_DEPTH = 5
+
+
+def _json_chunks(value: Any, depth: int = _JSON_STREAM_DEPTH) -> Iterator[str]:
+    if depth and isinstance(value, dict):
+        yield "{"
+        for i, (key, item) in enumerate(value.items()):
+            yield "{}{}:".format("," if i else "", json.dumps(str(key)))
+            yield from _json_chunks(item, depth - 1)
+        yield "}"
+    elif depth and isinstance(value, list):
+        yield "["
+        for i, item in enumerate(value):
+            if i:
+                yield ","
+            yield from _json_chunks(item, depth - 1)
+        yield "]"
+    else:
+        yield json.dumps(value, separators=(",", ":"))
+
+
+def dump(
+    rstate: schema.Rstate,
+    stream: IO[bytes],
+    format_: str = DEFAULT_FORMAT,
+    compression: str = DEFAULT_COMPRESSION,
+) -> None:
+    """Write a remote state to a stream in the given format.
+
+    The remote state is serialised piecewise, and never as a whole in memory.
+    """
+    with compressed_writer(stream, compression) as writer:
+        if format_ == "json":
+            for chunk in _json_chunks(rstate):
+                writer.write(chunk.encode("UTF-8"))
+        elif format_ == "binary":
+            _dump_binary(rstate, writer)
+        else:
+            raise RuntimeError('unknown cache format: "{}"'.format(format_))
+
+
+def dumps(
+    rstate: schema.Rstate,
+    format_: str = DEFAULT_FORMAT,
+    compression: str = DEFAULT_COMPRESSION,
+) -> bytes:
+    """Serialise a remote state in the given format."""
+    output = io.BytesIO()
+    dump(rstate, output, format_, compression)
+    return output.getvalue()
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    """Pause the garbage collector.
+
+    Decoding creates a lot of containers and no reference cycle, the
+    collections it would trigger are wasted time.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _Sections:
+    """Decoder of the sections of a binary cache, each decoded once."""
+
+    def __init__(self, raw: Buffer) -> None:
+        (index_size,) = _INDEX_SIZE.unpack_from(
+            raw, len(raw) - _INDEX_SIZE.size
+        )
+        start = len(raw) - _INDEX_SIZE.size - index_size
+        self._start = _HEADER.size
+        self._raw = raw
+        self._index = marshal.loads(  # nosec: see import
+            raw[start : start + index_size]
+        )
+        self._decoded = {}  # type: Dict[str, Any]
+
+    def names(self) -> List[str]:
+        """Return the names of the sections."""
+        return list(self._index)
+
+    def get(self, name: str) -> Any:
+        """Return a decoded section."""
+        if name not in self._decoded:
+            offset, size = self._index[name]
+            start = self._start + offset
+            with _gc_paused():
+                self._decoded[name] = marshal.loads(  # nosec: see import
+                    self._raw[start : start + size]
+                )
+        return self._decoded[name]
+
+    def pop(self, name: str) -> Any:
+        """Return a decoded section, forgetting it."""
+        value = self.get(name)
+        del self._decoded[name]
+        return value
+
+    def _rules(self, position: int) -> Any:
+        return self.get("bprules")[position][0]
+
+    def repositories(self) -> List[schema.Repo]:
+        """Return the repositories, decoding their rules on access."""
+        edges = self.pop("repositories")
+        for i, edge in enumerate(edges):
+            if "branchProtectionRules" in edge["node"]:
+                edge["node"] = LazyDict(
+                    edge["node"],
+                    {"branchProtectionRules": partial(self._rules, i)},
+                )
+        return edges
+
+    def rstate(self) -> schema.Rstate:
+        """Return the remote state, with sections decoded on access."""
+        rstate = self.pop("rest")
+        data = rstate["data"]
+        org = data["organization"]
+        org["repositories"] = LazyDict(
+            org["repositories"], {"edges": self.repositories}
+        )
+        org["teams"] = LazyDict(
+            org["teams"], {"edges": partial(self.pop, "teams")}
+        )
+        data["organization"] = LazyDict(
+            org, {"membersWithRole": partial(self.pop, "members")}
+        )
+        rstate["data"] = LazyDict(data, {"users": partial(self.pop, "users")})
+        return rstate
+
+
+def load_sections(raw: Buffer, magic: bytes, version: int) -> LazyDict:
+    """Return the sections written by `dump_sections', decoded on access.
+
+    :raises: RuntimeError if `raw' does not start with `magic' and `version'.
+    """
+    if len(raw) < _HEADER.size or tuple(_HEADER.unpack_from(raw)) != (
+        magic,
+        version,
+    ):
+        raise RuntimeError(
+            "expected {!r} sections version {}".format(magic, version)
+        )
+    sections = _Sections(raw)
+    return LazyDict(
+        dict.fromkeys(sections.names()),
+        {x: partial(sections.pop, x) for x in sections.names()},
+    )
+
+
+def loads(raw: Buffer) -> schema.Rstate:
+    """Deserialise a remote state, whatever its format.
+
+    `raw' is either bytes or a memory map of a cache file. With the binary
+    format, the sections of the remote state are decoded on first access,
+    and `raw' must not be modified while the remote state is used.
+    """
+    compression = detect_compression(bytes(raw[:MAGIC_SIZE]))
+    if compression != "none":
+        raw = decompress(io.BytesIO(raw), compression)
+    format_ = detect(bytes(raw[:MAGIC_SIZE]))
+    if format_ == "sqlite":
+        raise RuntimeError("sqlite caches are not serialised to bytes")
+    if format_ == "json":
+        with _gc_paused():
+            return json.loads(
+                raw, object_pairs_hook=partial(_shared_pairs, {})
+            )
+    _, version = _HEADER.unpack_from(raw)
+    if version != VERSION:
+        raise RuntimeError(
+            "unsupported binary cache version: {} (expected {})".format(
+                version, VERSION
+            )
+        )
+    return _Sections(raw).rstate()
@@ -0,0 +1,183 @@
+"""Times at which the sections of the cached remote state were fetched.
+
+A section is a connection of a repository or a team, requested by its own
+sub-queries during a synchronisation: the collaborators and branch
+protection rules of a repository, the repositories, members and children of
+a team. The listings of the organisation, its repositories and teams without
+their connections and its members, are requested together.
+
+The fetch times are kept in a JSON file next to the cache file:
+
+ * listings: POSIX time the listings were fetched at, or null if unknown;
+ * refresh: POSIX time of the last full refresh, or null if unknown;
+ * sections: {KIND: {ID: {CONNECTION: POSIX time}}}, where KIND is
+   `repository' or `team', for the sections requested again since, e.g. by
+   `cache refresh --repo', `cache ingest' or `--max-age'.
+
+A section without time of its own was fetched by the last full refresh.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+from ghaudit import schema, webhooks
+
+CONNECTIONS = {
+    "repository": ("collaborators", "branchProtectionRules"),
+    "team": ("repositories", "members", "childTeams"),
+}
+
+Times = Dict[str, Any]
+
+
+class Section(NamedTuple):
+    kind: str
+    name: str
+    connection: str
+
+
+def sections(kind: str, names: Iterable[str]) -> List[Section]:
+    """Return all the sections of repositories or teams."""
+    return [Section(kind, x, y) for x in names for y in CONNECTIONS[kind]]
+
+
+def full(time: float | None) -> Times:
+    """Return the fetch times of a remote state requested as a whole."""
+    return {
+        "listings": time,
+        "refresh": time,
+        "sections": {"repository": {}, "team": {}},
+    }
+
+
+def read(path_: Path) -> Times:
+    """Read fetch times, unknown if the file is missing or invalid."""
+    try:
+        return json.loads(path_.read_text(encoding="UTF-8"))
+    except (OSError, ValueError):
+        return full(None)
+
+
+def mark(
+    times: Times,
+    rstate: schema.Rstate,
+    sections_: Iterable[Section],
+    time: float,
+) -> None:
+    """Record that sections of a remote state were fetched at `time'."""
+    ids = {
+        "repository": {
+            schema.repo_name(x): x["node"]["id"]
+            for x in schema.org_repositories(rstate)
+        },
+        "team": {
+            schema.team_name(x): x["node"]["id"]
+            for x in schema.org_teams(rstate)
+        },
+    }
+    for section in sections_:
+        id_ = ids[section.kind].get(section.name)
+        if id_ is not None:
+            times["sections"][section.kind].setdefault(id_, {})[
+                section.connection
+            ] = time
+
+
+def _older(time: float | None, oldest: float) -> bool:
+    return time is None or time < oldest
+
+
+def listings_stale(times: Times, oldest: float) -> bool:
+    """Return whether the listings were fetched before the time `oldest'."""
+    return _older(times["listings"], oldest)
+
+
+def stale(
+    times: Times,
+    rstate: schema.Rstate,
+    oldest: float,
+    repositories: Iterable[str] | None = None,
+    teams: Iterable[str] | None = None,
+) -> List[Section]:
+    """Return the sections fetched before the time `oldest'.
+
+    Only the sections of the `repositories' and `teams' named are considered
+    when given, and all of them otherwise.
+    """
+    wanted = {
+        "repository": None if repositories is None else set(repositories),
+        "team": None if teams is None else set(teams),
+    }
+    entities = [
+        ("repository", x["node"]["id"], schema.repo_name(x))
+        for x in schema.org_repositories(rstate)
+    ] + [
+        ("team", x["node"]["id"], schema.team_name(x))
+        for x in schema.org_teams(rstate)
+    ]
+    result = []  # type: List[Section]
+    for kind, id_, name in entities:
+        names = wanted[kind]
+        if names is not None and name not in names:
+            continue
+        fetched = times["sections"][kind].get(id_, {})
+        result.extend(
+            Section(kind, name, x)
+            for x in CONNECTIONS[kind]
+            if _older(fetched.get(x, times["refresh"]), oldest)
+        )
+    return result
+
+
+def listing_changes(
+    rstate: schema.Rstate, listings: schema.Rstate
+) -> Tuple[schema.Rstate, webhooks.Changes]:
+    """Return the changes of the listings of the organisation.
+
+    `listings' is a remote state holding the listings only. Return the
+    remote state with the users and members of `listings', and the changes
+    to apply to it with ghaudit.webhooks.prepare: the repositories and teams
+    listed are updated, new ones are requested, and the ones no longer
+    listed are removed.
+    """
+    changes = webhooks.no_changes()
+    for kind, old, new in (
+        (
+            "repositories",
+            schema.org_repositories(rstate),
+            schema.org_repositories(listings),
+        ),
+        ("teams", schema.org_teams(rstate), schema.org_teams(listings)),
+    ):
+        ids = {x["node"]["id"] for x in old}  # type: Any
+        new_ids = {x["node"]["id"] for x in new}
+        changes[kind] = {  # type: ignore[literal-required]
+            x["node"]["id"]: x["node"] for x in new
+        }
+        changes["refreshed_" + kind] = (  # type: ignore[literal-required]
+            new_ids - ids
+        )
+        changes["deleted_" + kind] = (  # type: ignore[literal-required]
+            ids - new_ids
+        )
+    changes["removed_members"] = set(schema.org_member_ids(rstate)) - set(
+        schema.org_member_ids(listings)
+    )
+    data = rstate["data"]
+    return (
+        {
+            **rstate,
+            "data": {
+                **data,
+                "users": {**data["users"], **listings["data"]["users"]},
+                "organization": {
+                    **data["organization"],
+                    "membersWithRole": schema.org_member_ids(listings),
+                },
+            },
+        },
+        changes,
+    )
@@ -0,0 +1,157 @@
+"""Generations of the cache, read and written concurrently.
+
+Each write of the cache (see ghaudit.cache) creates a new generation: a
+numbered directory in `generations' holding the cache file and the files
+kept next to it (journal, validation stamp, indexes). Once complete, the
+generation is made current by atomically replacing the manifest, a small
+JSON file naming it. A generation other than the current one is never
+modified.
+
+Writers take an exclusive advisory lock (flock) on the `writer.lock' file,
+so that two writers do not interleave. Readers take no writer lock: they
+pin the current generation by taking a shared lock on its cache file, and
+keep reading it while newer generations are written. A generation which is
+not current is garbage-collected by the next writer once no reader holds a
+lock on it.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+MANIFEST = "manifest.json"
+GENERATIONS = "generations"
+LOCK = "writer.lock"
+
+# writer locks held by the threads of this process, by directory and thread,
+# with their depth
+_WRITERS = {}  # type: Dict[Tuple[Path, int], int]
+
+
+def current(directory: Path) -> int | None:
+    """Return the current generation, None if no generation was written."""
+    try:
+        manifest = json.loads(
+            (directory / MANIFEST).read_text(encoding="UTF-8")
+        )
+    except FileNotFoundError:
+        return None
+    return manifest["generation"]
+
+
+def path(directory: Path, generation: int, name: str) -> Path:
+    """Return the path of the file `name' of a generation."""
+    return directory / GENERATIONS / str(generation) / name
+
+
+def _generations(directory: Path) -> List[int]:
+    if not (directory / GENERATIONS).exists():
+        return []
+    return sorted(
+        int(x.name)
+        for x in (directory / GENERATIONS).iterdir()
+        if x.name.isdigit()
+    )
+
+
+@contextmanager
+def writer_lock(directory: Path) -> Iterator[None]:
+    """Hold the writer lock of `directory', waiting for other writers.
+
+    The lock is reentrant within a thread.
+    """
+    key = (directory, threading.get_ident())
+    if key in _WRITERS:
+        _WRITERS[key] += 1
+        try:
+            yield
+        finally:
+            _WRITERS[key] -= 1
+        return
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / LOCK, "a", encoding="UTF-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _WRITERS[key] = 1
+        try:
+            yield
+        finally:
+            del _WRITERS[key]
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@contextmanager
+def reader(directory: Path, name: str, default: Path) -> Iterator[Path]:
+    """Pin the current generation, and return the path of its file `name'.
+
+    The generation is not garbage-collected until the context exits.
+    `default' is returned when no generation was written.
+    """
+    while True:
+        generation = current(directory)
+        if generation is None:
+            yield default
+            return
+        path_ = path(directory, generation, name)
+        try:
+            pinned = open(path_, "rb")  # pylint: disable=consider-using-with
+        except FileNotFoundError:
+            # collected after a newer generation was made current
+            continue
+        with pinned:
+            fcntl.flock(pinned, fcntl.LOCK_SH)
+            # the generation may have been collected before it was locked
+            if path_.exists():
+                yield path_
+                return
+
+
+def create(directory: Path) -> int:
+    """Create the directory of a new generation, and return its number.
+
+    The writer lock must be held.
+    """
+    generation = max([current(directory) or 0, *_generations(directory)]) + 1
+    path(directory, generation, "").mkdir(parents=True)
+    return generation
+
+
+def publish(directory: Path, generation: int) -> None:
+    """Make a generation current. The writer lock must be held."""
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, delete=False, encoding="UTF-8"
+    ) as manifest:
+        json.dump({"generation": generation}, manifest)
+        manifest.flush()
+        os.fsync(manifest.fileno())
+    os.replace(manifest.name, directory / MANIFEST)
+
+
+def collect(directory: Path, name: str) -> List[int]:
+    """Remove the generations other than the current one without readers.
+
+    `name' is the file readers lock. The writer lock must be held. Return
+    the removed generations.
+    """
+    removed = []
+    for generation in _generations(directory):
+        if generation == current(directory):
+            continue
+        try:
+            with open(path(directory, generation, name), "rb") as locked:
+                fcntl.flock(locked, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                shutil.rmtree(path(directory, generation, ""))
+        except FileNotFoundError:
+            # left over by a writer which failed
+            shutil.rmtree(path(directory, generation, ""))
+        except BlockingIOError:
+            continue
+        removed.append(generation)
+    return removed
@@ -0,0 +1,294 @@
+"""Content-addressed history of the remote states written by refreshes.
+
+Each snapshot of the remote state is split in entities: users, repositories
+(with their collaborators and branch protection rules), teams (with their
+members, repositories and children) and the rest of the organisation. Each
+entity is stored once, compressed, in the `objects' directory under the name
+of the SHA-256 digest of its canonical JSON serialisation, so that
+consecutive snapshots share the entities which did not change.
+
+A snapshot is a manifest in the `snapshots' directory listing the IDs,
+digests and names of its entities, the IDs of the organisation members and
+the time it was recorded at. Its name starts with that time, in UTC, so that
+snapshots sort chronologically. Since the entities of a manifest are indexed
+by ID, two snapshots are compared by only reading the entities whose digest
+changed (see `diff').
+
+The objects and manifests are also what `cache publish' distributes, see
+ghaudit.cache_remote.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import tempfile
+import zlib
+from datetime import datetime, timezone
+from os import replace
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Set
+
+from ghaudit import schema, state_diff
+
+VERSION = 2
+
+
+class Snapshot(NamedTuple):
+    name: str
+    time: datetime
+    repositories: int
+    teams: int
+    users: int
+
+
+def _canonical(value: Any) -> bytes:
+    return json.dumps(value, sort_keys=True, separators=(",", ":")).encode(
+        "UTF-8"
+    )
+
+
+def _write(path_: Path, raw: bytes) -> None:
+    """Atomically create a file, so that a partial file is never read."""
+    path_.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path_.parent, delete=False) as output:
+        output.write(raw)
+    replace(output.name, path_)
+
+
+def _object_path(directory: Path, digest: str) -> Path:
+    return directory / "objects" / digest[:2] / digest
+
+
+def _put(directory: Path, value: Any) -> str:
+    raw = _canonical(value)
+    digest = hashlib.sha256(raw).hexdigest()
+    path_ = _object_path(directory, digest)
+    if not path_.exists():
+        _write(path_, zlib.compress(raw))
+    return digest
+
+
+def _get(directory: Path, digest: str) -> Any:
+    return json.loads(
+        zlib.decompress(_object_path(directory, digest).read_bytes())
+    )
+
+
+def has_object(directory: Path, digest: str) -> bool:
+    """Return whether the history `directory' has an object."""
+    return _object_path(directory, digest).exists()
+
+
+def read_object(directory: Path, digest: str) -> bytes:
+    """Return an object of the history `directory', compressed."""
+    return _object_path(directory, digest).read_bytes()
+
+
+def write_object(directory: Path, digest: str, raw: bytes) -> None:
+    """Add a compressed object to the history `directory'.
+
+    :raises: RuntimeError if `raw' does not match `digest'.
+    """
+    if hashlib.sha256(zlib.decompress(raw)).hexdigest() != digest:
+        raise RuntimeError("corrupted history object: {}".format(digest))
+    _write(_object_path(directory, digest), raw)
+
+
+def _snapshot(name: str, manifest: Any) -> Snapshot:
+    return Snapshot(
+        name,
+        datetime.fromisoformat(manifest["time"]),
+        len(manifest["repositories"]),
+        len(manifest["teams"]),
+        len(manifest["users"]),
+    )
+
+
+def _manifest(directory: Path, name: str) -> Any:
+    path_ = directory / "snapshots" / "{}.json".format(name)
+    if not path_.exists():
+        raise RuntimeError('snapshot not found: "{}"'.format(name))
+    manifest = json.loads(path_.read_text(encoding="UTF-8"))
+    if manifest["version"] != VERSION:
+        raise RuntimeError(
+            "unsupported snapshot version: {} (expected {})".format(
+                manifest["version"], VERSION
+            )
+        )
+    return manifest
+
+
+def store_entities(
+    directory: Path, rstate: schema.Rstate, time: datetime | None = None
+) -> Dict[str, Any]:
+    """Store the entities of a remote state, and return its manifest.
+
+    Only the entities not already stored by a previous snapshot are written.
+    """
+    time = time or datetime.now(timezone.utc)
+    data = rstate["data"]
+    org = data["organization"]
+    rest = {
+        **rstate,
+        "data": {
+            **data,
+            "users": {},
+            "organization": {
+                **org,
+                "membersWithRole": [],
+                "repositories": {**org["repositories"], "edges": []},
+                "teams": {**org["teams"], "edges": []},
+            },
+        },
+    }
+    return {
+        "version": VERSION,
+        "time": time.astimezone(timezone.utc).isoformat(),
+        "rest": _put(directory, rest),
+        "members": list(org["membersWithRole"]),
+        "users": [
+            [k, _put(directory, v), schema.user_login(v)]
+            for k, v in data["users"].items()
+        ],
+        "repositories": [
+            [x["node"]["id"], _put(directory, x), schema.repo_name(x)]
+            for x in org["repositories"]["edges"]
+        ],
+        "teams": [
+            [x["node"]["id"], _put(directory, x), schema.team_name(x)]
+            for x in org["teams"]["edges"]
+        ],
+    }
+
+
+def add(directory: Path, manifest_: Any) -> Snapshot:
+    """Record a manifest as a snapshot of the history `directory'.
+
+    The objects of the manifest must be in the history.
+    """
+    raw = _canonical(manifest_)
+    name = "{}-{}".format(
+        datetime.fromisoformat(manifest_["time"]).strftime("%Y%m%dT%H%M%SZ"),
+        hashlib.sha256(raw).hexdigest()[:12],
+    )
+    _write(directory / "snapshots" / "{}.json".format(name), raw)
+    return _snapshot(name, manifest_)
+
+
+def record(
+    directory: Path, rstate: schema.Rstate, time: datetime | None = None
+) -> Snapshot:
+    """Record a snapshot of a remote state in the history `directory'.
+
+    Only the entities not already stored by a previous snapshot are written.
+    """
+    return add(directory, store_entities(directory, rstate, time))
+
+
+def snapshots(directory: Path) -> List[Snapshot]:
+    """Return the snapshots of the history `directory', oldest first."""
+    return [
+        _snapshot(x.stem, _manifest(directory, x.stem))
+        for x in sorted((directory / "snapshots").glob("*.json"))
+    ]
+
+
+def find(directory: Path, time: datetime) -> Snapshot:
+    """Return the last snapshot recorded at or before `time'.
+
+    A naive `time' is taken as local time.
+    """
+    time = time.astimezone(timezone.utc)
+    found = [x for x in snapshots(directory) if x.time <= time]
+    if not found:
+        raise RuntimeError(
+            "no cache snapshot recorded at or before {}".format(
+                time.isoformat()
+            )
+        )
+    return found[-1]
+
+
+def exists(directory: Path, name: str) -> bool:
+    """Return whether the history `directory' has a snapshot `name'."""
+    return (directory / "snapshots" / "{}.json".format(name)).exists()
+
+
+def _digests(manifest_: Any, key: str) -> List[str]:
+    return [x[1] for x in manifest_[key]]
+
+
+def objects(manifest_: Any) -> Set[str]:
+    """Return the digests of the objects of a manifest."""
+    return {
+        manifest_["rest"],
+        *(
+            x
+            for key in ("users", "repositories", "teams")
+            for x in _digests(manifest_, key)
+        ),
+    }
+
+
+def load_manifest(directory: Path, manifest_: Any) -> schema.Rstate:
+    """Load the remote state of a manifest from the history `directory'."""
+    rstate = _get(directory, manifest_["rest"])
+    data = rstate["data"]
+    org = data["organization"]
+    data["users"] = {x[0]: _get(directory, x[1]) for x in manifest_["users"]}
+    org["membersWithRole"] = manifest_["members"]
+    org["repositories"]["edges"] = [
+        _get(directory, x) for x in _digests(manifest_, "repositories")
+    ]
+    org["teams"]["edges"] = [
+        _get(directory, x) for x in _digests(manifest_, "teams")
+    ]
+    return rstate
+
+
+def load(directory: Path, name: str) -> schema.Rstate:
+    """Load the remote state of a snapshot of the history `directory'."""
+    return load_manifest(directory, _manifest(directory, name))
+
+
+def diff(
+    directory: Path, old_name: str, new_name: str
+) -> Iterator[state_diff.Change]:
+    """Return the changes between two snapshots, see ghaudit.state_diff.
+
+    Only the entities whose digest differs between both snapshots are read.
+    """
+    old, new = _manifest(directory, old_name), _manifest(directory, new_name)
+    names = {
+        kind: {x[0]: x[2] for x in old[key] + new[key]}
+        for kind, key in (
+            ("user", "users"),
+            ("repository", "repositories"),
+            ("team", "teams"),
+        )
+    }  # type: state_diff.Names
+    yield from state_diff.member_changes(names, old["members"], new["members"])
+    changes = (
+        ("users", state_diff.user_changes),
+        (
+            "repositories",
+            lambda n, _, x, y: state_diff.repository_changes(n, x, y),
+        ),
+        ("teams", lambda n, _, x, y: state_diff.team_changes(n, x, y)),
+    )  # type: Any
+    for key, entity_changes in changes:
+        old_digests = {x[0]: x[1] for x in old[key]}
+        new_digests = {x[0]: x[1] for x in new[key]}
+        ids = list(old_digests) + [
+            x for x in new_digests if x not in old_digests
+        ]
+        for id_ in ids:
+            old_digest, new_digest = old_digests.get(id_), new_digests.get(id_)
+            if old_digest != new_digest:
+                yield from entity_changes(
+                    names,
+                    id_,
+                    old_digest and _get(directory, old_digest),
+                    new_digest and _get(directory, new_digest),
+                )
@@ -0,0 +1,234 @@
+"""Append-only journal of changes to the cached remote state.
+
+The cache is made of a base, the remote state written as a whole by
+`cache refresh' (see ghaudit.cache), and of a journal: the entities
+inserted, updated or deleted since the base was written, appended to a file
+next to it. Loading the cache replays the journal onto the base, and
+compacting it writes a new base and discards the journal, so that an
+incremental update only costs the serialisation of the entities it changes.
+
+The journal is a JSON lines file. Its first line identifies the base file it
+applies to (inode, size and modification time): a journal left over after
+the base is replaced, e.g. by a crash between the two, is ignored. Each
+following line is a record, either
+
+ * {"op": "upsert", "kind": KIND, "id": ID, "value": VALUE}, or
+ * {"op": "delete", "kind": KIND, "id": ID},
+
+where KIND is one of `KINDS'. The value of a user is its entry in the users
+of the remote state, the value of a repository or a team is its edge, and
+organisation members have no value (their role is part of the user). A
+truncated last line, left by an interrupted append, is ignored, and removed
+by the next append.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from os import SEEK_END, fsync
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, List, Literal, TypedDict
+
+from ghaudit import schema
+
+Kind = Literal["user", "member", "repository", "team"]
+KINDS = ("user", "member", "repository", "team")
+
+# size of the blocks read back from the end of a journal
+_CHUNK = 4096
+
+# organisation connection holding the edges of each kind of entity
+_EDGES = {"repository": "repositories", "team": "teams"}
+
+
+class _RecordBase(TypedDict):
+    op: Literal["upsert", "delete"]
+    kind: Kind
+    id: Hashable
+
+
+class Record(_RecordBase, total=False):
+    value: Any
+
+
+def upsert(kind: Kind, id_: Hashable, value: Any = None) -> Record:
+    """Return a record inserting or replacing an entity."""
+    return {"op": "upsert", "kind": kind, "id": id_, "value": value}
+
+
+def delete(kind: Kind, id_: Hashable) -> Record:
+    """Return a record deleting an entity."""
+    return {"op": "delete", "kind": kind, "id": id_}
+
+
+def _base_stamp(base: Path) -> Dict[str, int]:
+    stat = base.stat()
+    return {
+        "inode": stat.st_ino,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def _read_header(path_: Path) -> Any:
+    with open(path_, encoding="UTF-8") as journal:
+        try:
+            return json.loads(journal.readline())
+        except ValueError:
+            return None
+
+
+def _is_current(path_: Path, base: Path) -> bool:
+    return path_.exists() and _read_header(path_) == {
+        "base": _base_stamp(base)
+    }
+
+
+def _drop_truncated(path_: Path) -> None:
+    """Remove the truncated last line of a journal, if any."""
+    with open(path_, "rb+") as journal:
+        end = journal.seek(0, SEEK_END)
+        position = end
+        while position > 0:
+            start = max(position - _CHUNK, 0)
+            journal.seek(start)
+            newline = journal.read(position - start).rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            logging.warning(
+                'dropping truncated record of cache journal "%s"', path_
+            )
+            journal.truncate(position)
+
+
+def append(path_: Path, base: Path, records: Iterable[Record]) -> int:
+    """Append records to the journal of the cache file `base'.
+
+    The journal is created, or replaced if it belongs to a previous base.
+    A truncated last line is removed first, so that the records are not
+    appended to it. Return the number of appended records.
+    """
+    lines = ["{}\n".format(json.dumps(x)) for x in records]
+    if not lines:
+        return 0
+    if not _is_current(path_, base):
+        lines.insert(0, "{}\n".format(json.dumps({"base": _base_stamp(base)})))
+        mode = "w"
+    else:
+        _drop_truncated(path_)
+        mode = "a"
+    with open(path_, mode, encoding="UTF-8") as journal:
+        journal.write("".join(lines))
+        journal.flush()
+        fsync(journal.fileno())
+    return len(lines) - (mode == "w")
+
+
+def read(path_: Path, base: Path) -> List[Record]:
+    """Return the records of the journal of the cache file `base'."""
+    if not path_.exists():
+        return []
+    if not _is_current(path_, base):
+        logging.warning(
+            'ignoring cache journal "%s" written for a previous cache', path_
+        )
+        return []
+    records = []
+    with open(path_, encoding="UTF-8") as journal:
+        journal.readline()
+        for line in journal:
+            if not line.endswith("\n"):
+                logging.warning(
+                    'ignoring truncated record of cache journal "%s"', path_
+                )
+                break
+            records.append(json.loads(line))
+    return records
+
+
+def replay(rstate: schema.Rstate, records: Iterable[Record]) -> schema.Rstate:
+    """Apply journal records to a remote state, in place, and return it.
+
+    Updated entities keep their position, inserted ones are appended.
+    """
+    data = rstate["data"]  # type: Any
+    org = data["organization"]  # type: Any
+    tables = {}  # type: Dict[str, Dict[Hashable, Any]]
+
+    def table(kind: str) -> Dict[Hashable, Any]:
+        if kind not in tables:
+            if kind == "user":
+                tables[kind] = data["users"]
+            elif kind == "member":
+                tables[kind] = dict.fromkeys(org["membersWithRole"])
+            elif kind in _EDGES:
+                tables[kind] = {
+                    x["node"]["id"]: x for x in org[_EDGES[kind]]["edges"]
+                }
+            else:
+                raise RuntimeError(
+                    'unknown cache journal entity kind: "{}"'.format(kind)
+                )
+        return tables[kind]
+
+    for record in records:
+        entities = table(record["kind"])
+        if record["op"] == "upsert":
+            entities[record["id"]] = record.get("value")
+        elif record["op"] == "delete":
+            entities.pop(record["id"], None)
+        else:
+            raise RuntimeError(
+                'unknown cache journal operation: "{}"'.format(record["op"])
+            )
+
+    if "member" in tables:
+        org["membersWithRole"] = list(tables["member"])
+    for kind, connection in _EDGES.items():
+        if kind in tables:
+            org[connection]["edges"] = list(tables[kind].values())
+    return rstate
+
+
+def diff(old: schema.Rstate, new: schema.Rstate) -> List[Record]:
+    """Return the records turning the remote state `old' into `new'."""
+    records = []  # type: List[Record]
+    old_data, new_data = old["data"], new["data"]  # type: Any, Any
+
+    def compare(
+        kind: Kind,
+        old_items: Dict[Hashable, Any],
+        new_items: Dict[Hashable, Any],
+    ) -> None:
+        records.extend(
+            delete(kind, x) for x in old_items if x not in new_items
+        )
+        records.extend(
+            upsert(kind, k, v)
+            for k, v in new_items.items()
+            if k not in old_items or old_items[k] != v
+        )
+
+    compare("user", old_data["users"], new_data["users"])
+    compare(
+        "member",
+        dict.fromkeys(old_data["organization"]["membersWithRole"]),
+        dict.fromkeys(new_data["organization"]["membersWithRole"]),
+    )
+    for kind, connection in _EDGES.items():
+        compare(
+            kind,  # type: ignore[arg-type]
+            {
+                x["node"]["id"]: x
+                for x in old_data["organization"][connection]["edges"]
+            },
+            {
+                x["node"]["id"]: x
+                for x in new_data["organization"][connection]["edges"]
+            },
+        )
+    return records
@@ -0,0 +1,206 @@
+"""Distribution of the cache through a shared location.
+
+`cache publish' copies the cached remote state to a location, a directory or
+an HTTP(S) URL, where `cache fetch' reads it back, so that a single refresh
+serves everyone. The remote state is published in the format of the
+snapshot history (see ghaudit.cache_history):
+
+ * `objects/ab/abcd…': users, repositories and teams, compressed, named
+   after the SHA-256 digest of their content;
+ * `manifest': the compressed manifest listing the objects, with an
+   HMAC-SHA256 signature of its content made with a shared key.
+
+The manifest is published last, so that its objects are always available.
+Publishing only uploads the objects missing from the previously published
+manifest, and fetching only downloads the objects missing from the local
+history. Fetching checks the signature of the manifest and the digest of
+each object. With HTTP, the manifest is only downloaded when its entity tag
+changed.
+
+HTTP locations are read with GET and written with PUT requests, without
+authentication, as accepted by an S3-compatible bucket open to the writers
+or by a presigned URL prefix.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import zlib
+from pathlib import Path
+from typing import Any, NamedTuple, Tuple, Union
+
+import requests
+
+from ghaudit import cache_history, schema
+
+MANIFEST = "manifest"
+
+# timeout of the HTTP requests, in seconds
+TIMEOUT = 60
+
+
+class Directory:
+    """Location in a local or mounted directory."""
+
+    def __init__(self, path_: Path) -> None:
+        self._path = path_
+
+    def get(self, name: str, etag: str | None = None) -> Tuple[bytes, str]:
+        """Return the content of a file and its entity tag.
+
+        The content is empty if the entity tag is still `etag'.
+        """
+        path_ = self._path / name
+        try:
+            stat = path_.stat()
+        except FileNotFoundError as exc:
+            raise RuntimeError("not found: {}".format(path_)) from exc
+        current = "{}-{}".format(stat.st_mtime_ns, stat.st_size)
+        if current == etag:
+            return b"", current
+        return path_.read_bytes(), current
+
+    def put(self, name: str, raw: bytes) -> None:
+        """Atomically write a file."""
+        path_ = self._path / name
+        path_.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=path_.parent, delete=False
+        ) as output:
+            output.write(raw)
+        os.replace(output.name, path_)
+
+
+class Http:
+    """Location under an HTTP(S) URL."""
+
+    def __init__(self, url: str) -> None:
+        self._url = url.rstrip("/")
+        self._session = requests.Session()
+
+    def get(self, name: str, etag: str | None = None) -> Tuple[bytes, str]:
+        """Return the content of a resource and its entity tag.
+
+        The content is empty if the entity tag is still `etag'.
+        """
+        url = "{}/{}".format(self._url, name)
+        response = self._session.get(
+            url,
+            headers={"If-None-Match": etag} if etag else {},
+            timeout=TIMEOUT,
+        )
+        if response.status_code == 304:
+            return b"", etag or ""
+        # S3 answers 403 for a missing key without the ListBucket permission
+        if response.status_code in (403, 404):
+            raise RuntimeError(
+                "not found: {} (HTTP {})".format(url, response.status_code)
+            )
+        response.raise_for_status()
+        return response.content, response.headers.get("ETag", "")
+
+    def put(self, name: str, raw: bytes) -> None:
+        """Upload a resource."""
+        response = self._session.put(
+            "{}/{}".format(self._url, name), data=raw, timeout=TIMEOUT
+        )
+        response.raise_for_status()
+
+
+Location = Union[Directory, Http]
+
+
+def location(url: str) -> Location:
+    """Return the location of a URL, or of a directory path."""
+    if url.startswith(("http://", "https://")):
+        return Http(url)
+    return Directory(Path(url))
+
+
+def _object_name(digest: str) -> str:
+    return "objects/{}/{}".format(digest[:2], digest)
+
+
+def _signature(key: bytes, manifest: Any) -> str:
+    raw = json.dumps(manifest, sort_keys=True, separators=(",", ":"))
+    return hmac.new(key, raw.encode("UTF-8"), hashlib.sha256).hexdigest()
+
+
+def _read_manifest(raw: bytes, key: bytes) -> Any:
+    """Return a published manifest, after checking its signature.
+
+    :raises: RuntimeError if the signature does not match.
+    """
+    signed = json.loads(zlib.decompress(raw))
+    if not hmac.compare_digest(
+        _signature(key, signed["manifest"]), signed["signature"]
+    ):
+        raise RuntimeError(
+            "the signature of the published cache does not match the key"
+        )
+    return signed["manifest"]
+
+
+class Transfer(NamedTuple):
+    objects: int
+    transferred: int
+    etag: str
+    # time the transferred remote state was recorded at, in ISO format
+    time: str = ""
+
+
+def publish(
+    location_: Location, key: bytes, directory: Path, rstate: schema.Rstate
+) -> Transfer:
+    """Publish a remote state, with the history `directory' as staging.
+
+    Only the objects which the previously published manifest does not list
+    are uploaded.
+    """
+    manifest = cache_history.store_entities(directory, rstate)
+    try:
+        published = cache_history.objects(
+            _read_manifest(location_.get(MANIFEST)[0], key)
+        )
+    except (RuntimeError, ValueError, zlib.error):
+        published = set()
+    missing = cache_history.objects(manifest) - published
+    for digest in sorted(missing):
+        location_.put(
+            _object_name(digest), cache_history.read_object(directory, digest)
+        )
+    signed = {"manifest": manifest, "signature": _signature(key, manifest)}
+    location_.put(MANIFEST, zlib.compress(json.dumps(signed).encode("UTF-8")))
+    return Transfer(len(cache_history.objects(manifest)), len(missing), "")
+
+
+def fetch(
+    location_: Location, key: bytes, directory: Path, etag: str | None = None
+) -> Tuple[Transfer, schema.Rstate | None]:
+    """Fetch the published remote state into the history `directory'.
+
+    The manifest is recorded as a snapshot. Only the objects missing from
+    the history are downloaded. No remote state is returned if the manifest
+    did not change since it had the entity tag `etag'.
+    """
+    raw, etag = location_.get(MANIFEST, etag)
+    if not raw:
+        return Transfer(0, 0, etag), None
+    manifest = _read_manifest(raw, key)
+    objects = cache_history.objects(manifest)
+    missing = [
+        x for x in objects if not cache_history.has_object(directory, x)
+    ]
+    for digest in sorted(missing):
+        cache_history.write_object(
+            directory, digest, location_.get(_object_name(digest))[0]
+        )
+    cache_history.add(directory, manifest)
+    return (
+        Transfer(len(objects), len(missing), etag, manifest["time"]),
+        cache_history.load_manifest(directory, manifest),
+    )
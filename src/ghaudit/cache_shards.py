@@ -0,0 +1,155 @@
+"""Refresh of the cache split in shards, merged afterwards.
+
+A shard refresh requests the connections of a part of the repositories and
+teams of the organisation only, so that N processes or machines, each with
+its own github token, share the work of a refresh. The repositories and
+teams of shard I out of N are those whose node ID hashes, with SHA-256, to
+I - 1 modulo N.
+
+All the shards must start from the same listings of the organisation: its
+repositories, teams and members without their connections. They are either
+requested by each shard, or read from a seed cache file shared by the
+shards. A shard file holds the remote state of the shard, in a cache format,
+with a `shard' entry:
+
+ * number, shards: the shard is shard `number' out of `shards', from 1;
+ * listings: the SHA-256 digest of the listings the shard started from;
+ * time: POSIX time the shard was requested at;
+ * seeded: whether the listings were read from a seed cache.
+
+Merging the shards checks that they are all present, once, and made from
+the same listings, and takes each repository and team from its shard, so
+that the merged remote state does not depend on the order of the shards.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from ghaudit import schema
+from ghaudit.cache_freshness import CONNECTIONS
+
+
+class Shard(NamedTuple):
+    number: int
+    shards: int
+    listings: str
+    time: float
+    seeded: bool
+
+
+def owner(id_: Any, count: int) -> int:
+    """Return the index of the shard of a repository or a team."""
+    hashed = hashlib.sha256(str(id_).encode("UTF-8")).digest()
+    return int.from_bytes(hashed[:8], "big") % count + 1
+
+
+def listings(rstate: schema.Rstate) -> schema.Rstate:
+    """Return the listings of a remote state, without connections."""
+    org = rstate["data"]["organization"]
+    members = schema.org_member_ids(rstate)
+    result = schema.empty()
+    result["data"]["users"] = {x: rstate["data"]["users"][x] for x in members}
+    result_org = result["data"]["organization"]  # type: Any
+    result_org["membersWithRole"] = list(members)
+    for key, kind in (("repositories", "repository"), ("teams", "team")):
+        result_org[key]["edges"] = [
+            {
+                **x,
+                "node": {
+                    k: v
+                    for k, v in x["node"].items()
+                    if k not in CONNECTIONS[kind]
+                },
+            }
+            for x in org[key]["edges"]  # type: ignore[literal-required]
+        ]
+    return result
+
+
+def digest(listings_: schema.Rstate) -> str:
+    """Return the digest identifying the listings of the organisation."""
+    raw = json.dumps(listings_, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("UTF-8")).hexdigest()
+
+
+def select(
+    listings_: schema.Rstate, index: int, count: int
+) -> Tuple[List[str], List[str]]:
+    """Return the names of the repositories and teams of a shard."""
+    return (
+        [
+            schema.repo_name(x)
+            for x in schema.org_repositories(listings_)
+            if owner(x["node"]["id"], count) == index
+        ],
+        [
+            schema.team_name(x)
+            for x in schema.org_teams(listings_)
+            if owner(x["node"]["id"], count) == index
+        ],
+    )
+
+
+def _check(shards: List[Tuple[Shard, schema.Rstate]]) -> None:
+    """Check that shards are complete and were made from the same listings.
+
+    :raises: RuntimeError otherwise.
+    """
+    if not shards:
+        raise RuntimeError("no shard to merge")
+    count = shards[0][0].shards
+    numbers = sorted(x.number for x, _ in shards)
+    if numbers != list(range(1, count + 1)) or any(
+        x.shards != count for x, _ in shards
+    ):
+        raise RuntimeError(
+            "expected shards 1 to {}, got: {}".format(
+                count,
+                ", ".join(
+                    "{}/{}".format(x.number, x.shards) for x, _ in shards
+                ),
+            )
+        )
+    if len({x.listings for x, _ in shards}) != 1:
+        raise RuntimeError(
+            "the shards were made from different listings of the"
+            " organisation, use the same seed cache for all of them"
+        )
+
+
+def merge(shards: List[Tuple[Shard, schema.Rstate]]) -> schema.Rstate:
+    """Merge the remote states of all the shards of a refresh.
+
+    :raises: RuntimeError if shards are missing, repeated, or were made from
+    different listings.
+    """
+    _check(shards)
+    by_index = {x.number: y for x, y in shards}
+    count = len(by_index)
+    first = by_index[1]
+    result = schema.empty()
+    users = {}  # type: Dict[Any, Any]
+    for index in sorted(by_index):
+        users.update(by_index[index]["data"]["users"])
+    result["data"]["users"] = users
+    result_org = result["data"]["organization"]  # type: Any
+    result_org["membersWithRole"] = list(schema.org_member_ids(first))
+    for key, entities in (
+        ("repositories", schema.org_repositories),
+        ("teams", schema.org_teams),
+    ):
+        owned = {}  # type: Dict[Any, Any]
+        for index, rstate in by_index.items():
+            owned.update(
+                (x["node"]["id"], x)
+                for x in entities(rstate)  # type: ignore[operator]
+                if owner(x["node"]["id"], count) == index
+            )
+        result_org[key]["edges"] = [
+            owned[x["node"]["id"]]
+            for x in entities(first)  # type: ignore[operator]
+        ]
+    return result
@@ -0,0 +1,511 @@
+"""SQLite storage of the remote state.
+
+Entities (repositories, teams, users, branch protection rules) are stored in
+tables, and their connections in relation tables, along with the position of
+each edge to preserve the order of the remote state. The attributes of an
+entity without a column of their own are kept as a JSON document in its
+`node' column. Null edges are not stored.
+
+Besides loading the whole remote state, a reduced remote state can be loaded
+for one repository or one user, by reading only the rows related to it.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Sequence, Tuple
+
+from ghaudit import schema
+
+VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE users (
+    id TEXT PRIMARY KEY, login TEXT, role TEXT, node TEXT NOT NULL
+);
+CREATE INDEX users_login ON users (login);
+CREATE TABLE org_member (position INTEGER PRIMARY KEY, user_id TEXT NOT NULL);
+CREATE TABLE repos (
+    position INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    node TEXT NOT NULL
+);
+CREATE INDEX repos_id ON repos (id);
+CREATE INDEX repos_name ON repos (name);
+CREATE TABLE teams (
+    position INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    slug TEXT,
+    node TEXT NOT NULL
+);
+CREATE INDEX teams_id ON teams (id);
+CREATE INDEX teams_name ON teams (name);
+CREATE TABLE team_repo (
+    team_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    repo_id TEXT NOT NULL,
+    permission TEXT,
+    PRIMARY KEY (team_id, position)
+);
+CREATE INDEX team_repo_repo ON team_repo (repo_id);
+CREATE TABLE team_member (
+    team_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    role TEXT,
+    PRIMARY KEY (team_id, position)
+);
+CREATE INDEX team_member_user ON team_member (user_id);
+CREATE TABLE repo_collaborator (
+    repo_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    login TEXT,
+    permission TEXT,
+    PRIMARY KEY (repo_id, position)
+);
+CREATE INDEX repo_collaborator_user ON repo_collaborator (user_id);
+CREATE TABLE bp_rule (
+    repo_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    pattern TEXT,
+    node TEXT NOT NULL,
+    PRIMARY KEY (repo_id, position)
+);
+CREATE INDEX bp_rule_id ON bp_rule (id);
+CREATE TABLE push_allowance (
+    rule_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    actor_id TEXT,
+    actor_type TEXT,
+    allowance TEXT NOT NULL,
+    PRIMARY KEY (rule_id, position)
+);
+CREATE INDEX push_allowance_actor ON push_allowance (actor_id);
+"""
+
+Rows = Dict[Any, List[Tuple]]
+
+
+def _edges(connection: Any) -> List[Any]:
+    if not isinstance(connection, Mapping):
+        return []
+    return [x for x in connection.get("edges", []) if x is not None]
+
+
+def _strip(node: Mapping[str, Any], key: str, list_key: str) -> Any:
+    """Return the value of a connection of `node' without its items."""
+    value = node[key]
+    if isinstance(value, Mapping):
+        return {k: v for k, v in value.items() if k != list_key}
+    if isinstance(value, list):
+        return []
+    return value
+
+
+def _node_json(node: Mapping[str, Any], connections: Mapping[str, str]) -> str:
+    return json.dumps(
+        {
+            k: _strip(node, k, connections[k]) if k in connections else v
+            for k, v in node.items()
+        }
+    )
+
+
+def _insert_repo(
+    conn: sqlite3.Connection, position: int, repo: schema.Repo
+) -> None:
+    node = repo["node"]
+    conn.execute(
+        "INSERT INTO repos VALUES (?, ?, ?, ?)",
+        (
+            position,
+            node["id"],
+            node["name"],
+            _node_json(
+                node,
+                {"collaborators": "edges", "branchProtectionRules": "nodes"},
+            ),
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO repo_collaborator VALUES (?, ?, ?, ?, ?)",
+        [
+            (
+                node["id"],
+                i,
+                edge["node"]["id"],
+                edge["node"].get("login"),
+                edge.get("permission"),
+            )
+            for i, edge in enumerate(_edges(node.get("collaborators")))
+        ],
+    )
+    rules = node.get("branchProtectionRules")  # type: ignore
+    for i, rule in enumerate(rules["nodes"] if rules else []):
+        conn.execute(
+            "INSERT INTO bp_rule VALUES (?, ?, ?, ?, ?)",
+            (
+                node["id"],
+                i,
+                rule["id"],
+                rule.get("pattern"),
+                _node_json(rule, {"pushAllowances": ""}),
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO push_allowance VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    rule["id"],
+                    j,
+                    allowance["actor"].get("id"),
+                    allowance["actor"].get("__typename"),
+                    json.dumps(allowance),
+                )
+                for j, allowance in enumerate(rule.get("pushAllowances", []))
+            ],
+        )
+
+
+def _insert_team(
+    conn: sqlite3.Connection, position: int, team: schema.Team
+) -> None:
+    node = team["node"]
+    conn.execute(
+        "INSERT INTO teams VALUES (?, ?, ?, ?, ?)",
+        (
+            position,
+            node["id"],
+            node["name"],
+            node.get("slug"),
+            _node_json(node, {"repositories": "edges", "members": "edges"}),
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO team_repo VALUES (?, ?, ?, ?)",
+        [
+            (node["id"], i, edge["node"]["id"], edge.get("permission"))
+            for i, edge in enumerate(_edges(node.get("repositories")))
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO team_member VALUES (?, ?, ?, ?)",
+        [
+            (node["id"], i, edge["node"]["id"], edge.get("role"))
+            for i, edge in enumerate(_edges(node.get("members")))
+        ],
+    )
+
+
+def write(path: Path, rstate: schema.Rstate) -> None:
+    """Write a remote state to a new SQLite database."""
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.executescript(_SCHEMA)
+            conn.execute(
+                "INSERT INTO meta VALUES ('version', ?)", (str(VERSION),)
+            )
+            conn.executemany(
+                "INSERT INTO users VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        user_id,
+                        user["node"].get("login"),
+                        user.get("role"),
+                        json.dumps(user["node"]),
+                    )
+                    for user_id, user in rstate["data"]["users"].items()
+                ],
+            )
+            conn.executemany(
+                "INSERT INTO org_member VALUES (?, ?)",
+                enumerate(schema.org_member_ids(rstate)),
+            )
+            for i, repo in enumerate(schema.org_repositories(rstate)):
+                _insert_repo(conn, i, repo)
+            for i, team in enumerate(schema.org_teams(rstate)):
+                _insert_team(conn, i, team)
+    finally:
+        conn.close()
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        "{}?mode=ro".format(Path(path).resolve().as_uri()), uri=True
+    )
+    (version,) = conn.execute(
+        "SELECT value FROM meta WHERE key = 'version'"
+    ).fetchone()
+    if int(version) != VERSION:
+        conn.close()
+        raise RuntimeError(
+            "unsupported SQLite cache version: {} (expected {})".format(
+                version, VERSION
+            )
+        )
+    return conn
+
+
+def _group(rows: Iterable[Tuple]) -> Rows:
+    """Group rows by their first column, which is removed."""
+    result = {}  # type: Rows
+    for row in rows:
+        result.setdefault(row[0], []).append(row[1:])
+    return result
+
+
+def _fill(
+    node: Dict[str, Any], key: str, list_key: str, items: List[Any]
+) -> None:
+    """Restore the items of a connection stripped by _strip."""
+    if key not in node:
+        return
+    if isinstance(node[key], dict):
+        node[key][list_key] = items
+    elif isinstance(node[key], list):
+        node[key] = items
+
+
+def _select(
+    conn: sqlite3.Connection, query: str, where: str, params: Sequence[Any]
+) -> List[Tuple]:
+    # `where' is one of the constant filters of this module, never user input
+    return conn.execute(
+        query.format(where=where), params  # nosec: see above
+    ).fetchall()
+
+
+def _repos(
+    conn: sqlite3.Connection, where: str, params: Sequence[Any]
+) -> List[schema.Repo]:
+    repo_ids = "SELECT id FROM repos WHERE {where}"
+    collaborators = _group(
+        _select(
+            conn,
+            "SELECT repo_id, user_id, login, permission"
+            " FROM repo_collaborator WHERE repo_id IN (" + repo_ids + ")"
+            " ORDER BY repo_id, position",
+            where,
+            params,
+        )
+    )
+    rules = _group(
+        _select(
+            conn,
+            "SELECT repo_id, id, node FROM bp_rule"
+            " WHERE repo_id IN (" + repo_ids + ") ORDER BY repo_id, position",
+            where,
+            params,
+        )
+    )
+    allowances = _group(
+        _select(
+            conn,
+            "SELECT rule_id, allowance FROM push_allowance"
+            " WHERE rule_id IN (SELECT id FROM bp_rule WHERE repo_id IN ("
+            + repo_ids
+            + ")) ORDER BY rule_id, position",
+            where,
+            params,
+        )
+    )
+    result = []
+    for repo_id, node_json in _select(
+        conn,
+        "SELECT id, node FROM repos WHERE {where} ORDER BY position",
+        where,
+        params,
+    ):
+        node = json.loads(node_json)
+        _fill(
+            node,
+            "collaborators",
+            "edges",
+            [
+                {"permission": perm, "node": {"id": user_id, "login": login}}
+                for user_id, login, perm in collaborators.get(repo_id, [])
+            ],
+        )
+        nodes = []
+        for rule_id, rule_json in rules.get(repo_id, []):
+            rule = json.loads(rule_json)
+            _fill(
+                rule,
+                "pushAllowances",
+                "",
+                [json.loads(x) for (x,) in allowances.get(rule_id, [])],
+            )
+            nodes.append(rule)
+        _fill(node, "branchProtectionRules", "nodes", nodes)
+        result.append({"node": node})
+    return result  # type: ignore
+
+
+def _teams(
+    conn: sqlite3.Connection, where: str, params: Sequence[Any]
+) -> List[schema.Team]:
+    team_ids = "SELECT id FROM teams WHERE {where}"
+    repos = _group(
+        _select(
+            conn,
+            "SELECT team_id, repo_id, permission FROM team_repo"
+            " WHERE team_id IN (" + team_ids + ") ORDER BY team_id, position",
+            where,
+            params,
+        )
+    )
+    members = _group(
+        _select(
+            conn,
+            "SELECT team_id, user_id, role FROM team_member"
+            " WHERE team_id IN (" + team_ids + ") ORDER BY team_id, position",
+            where,
+            params,
+        )
+    )
+    result = []
+    for team_id, node_json in _select(
+        conn,
+        "SELECT id, node FROM teams WHERE {where} ORDER BY position",
+        where,
+        params,
+    ):
+        node = json.loads(node_json)
+        _fill(
+            node,
+            "repositories",
+            "edges",
+            [
+                {"permission": perm, "node": {"id": repo_id}}
+                for repo_id, perm in repos.get(team_id, [])
+            ],
+        )
+        _fill(
+            node,
+            "members",
+            "edges",
+            [
+                {"role": role, "node": {"id": user_id}}
+                for user_id, role in members.get(team_id, [])
+            ],
+        )
+        result.append({"node": node})
+    return result  # type: ignore
+
+
+def _users(
+    conn: sqlite3.Connection, where: str, params: Sequence[Any]
+) -> Dict[schema.UserID, schema.UserWithOrgRole]:
+    result = {}  # type: Dict[schema.UserID, Any]
+    for user_id, role, node_json in _select(
+        conn, "SELECT id, role, node FROM users WHERE {where}", where, params
+    ):
+        user = {"node": json.loads(node_json)}  # type: Dict[str, Any]
+        if role is not None:
+            user["role"] = role
+        result[user_id] = user
+    return result
+
+
+def _rstate(
+    users: Dict[schema.UserID, schema.UserWithOrgRole],
+    members: List[schema.UserID],
+    repos: List[schema.Repo],
+    teams: List[schema.Team],
+) -> schema.Rstate:
+    return {
+        "data": {
+            "users": users,
+            "organization": {
+                "repositories": {"edges": repos},
+                "membersWithRole": members,
+                "teams": {"edges": teams},
+            },
+        }
+    }
+
+
+def load(path: Path) -> schema.Rstate:
+    """Load the whole remote state from a SQLite database."""
+    conn = _connect(path)
+    try:
+        return _rstate(
+            _users(conn, "1", ()),
+            [
+                x
+                for (x,) in conn.execute(
+                    "SELECT user_id FROM org_member ORDER BY position"
+                )
+            ],
+            _repos(conn, "1", ()),
+            _teams(conn, "1", ()),
+        )
+    finally:
+        conn.close()
+
+
+def repository_state(path: Path, name: str) -> schema.Rstate:
+    """Load the part of the remote state describing one repository.
+
+    The reduced remote state contains the repository and its collaborators.
+    """
+    conn = _connect(path)
+    try:
+        return _rstate(
+            _users(
+                conn,
+                "id IN (SELECT user_id FROM repo_collaborator WHERE repo_id IN"
+                " (SELECT id FROM repos WHERE name = ?))",
+                (name,),
+            ),
+            [],
+            _repos(conn, "name = ?", (name,)),
+            [],
+        )
+    finally:
+        conn.close()
+
+
+def user_state(path: Path, login: str) -> schema.Rstate:
+    """Load the part of the remote state describing one user.
+
+    The reduced remote state contains the user, and the teams the user is a
+    member of. Other members of these teams are left out.
+    """
+    conn = _connect(path)
+    try:
+        users = _users(conn, "login = ?", (login,))
+        user_ids = list(users.keys())
+        teams = _teams(
+            conn,
+            "id IN (SELECT team_id FROM team_member WHERE user_id IN"
+            " (SELECT id FROM users WHERE login = ?))",
+            (login,),
+        )
+        for team in teams:
+            team_members = team["node"].get("members")
+            if team_members:
+                team_members["edges"] = [
+                    x
+                    for x in team_members["edges"]
+                    if x["node"]["id"] in user_ids
+                ]
+        members = [
+            x
+            for (x,) in conn.execute(
+                "SELECT user_id FROM org_member WHERE user_id IN"
+                " (SELECT id FROM users WHERE login = ?) ORDER BY position",
+                (login,),
+            )
+        ]
+        return _rstate(users, members, [], teams)
+    finally:
+        conn.close()
@@ -0,0 +1,144 @@
+"""Record and replay of github GraphQL exchanges.
+
+A cassette is a gzip compressed JSON lines file where each line holds one
+HTTP round trip: the normalised query text, its variables and the response.
+Recording wraps the real transport during a cache refresh. Replaying serves
+the recorded responses without network, which makes synchronisation runs
+deterministic and comparable between ghaudit versions.
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+from pathlib import Path
+from types import TracebackType
+from typing import IO, Any, Dict, List, Mapping, Type, TypedDict
+
+import requests
+
+from ghaudit import utils
+from ghaudit.auth import AuthDriver
+
+
+class Entry(TypedDict):
+    query: str
+    variables: Any
+    response: Mapping[str, Any]
+
+
+def normalise(call_str: str) -> str:
+    """Return a query text insensitive to formatting differences."""
+    return " ".join(call_str.split())
+
+
+def _normalise_variables(variables: Any) -> Any:
+    return json.loads(json.dumps(variables, sort_keys=True))
+
+
+class Recorder:
+    """Transport recording the exchanges of another transport to a file."""
+
+    def __init__(
+        self,
+        path: Path,
+        transport: utils.Transport = utils.github_graphql_call,
+    ) -> None:
+        self._path = path
+        self._transport = transport
+        self._file: IO[str] | None = None
+        self._recorded = 0
+
+    def __enter__(self) -> Recorder:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def __call__(
+        self,
+        call_str: str,
+        auth_driver: AuthDriver,
+        variables: Any,
+        session: requests.Session | None,
+    ) -> Mapping[str, Any]:
+        result = self._transport(call_str, auth_driver, variables, session)
+        if not self._file:
+            self._file = gzip.open(self._path, "wt", encoding="UTF-8")
+        entry = {
+            "query": normalise(call_str),
+            "variables": _normalise_variables(variables),
+            "response": result,
+        }  # type: Entry
+        self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._recorded += 1
+        return result
+
+    def close(self) -> None:
+        """Flush and close the cassette file."""
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def recorded(self) -> int:
+        """Return the number of round trips recorded so far."""
+        return self._recorded
+
+
+class Player:
+    """Transport serving the responses recorded in a cassette.
+
+    Requests are matched on their normalised query text and their
+    variables. When several recorded round trips match, they are served in
+    recording order.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._entries = {}  # type: Dict[str, List[Entry]]
+        self._played = 0
+        with gzip.open(path, "rt", encoding="UTF-8") as cassette:
+            for line in cassette:
+                entry = json.loads(line)  # type: Entry
+                self._entries.setdefault(entry["query"], []).append(entry)
+
+    def __call__(
+        self,
+        call_str: str,
+        auth_driver: AuthDriver,
+        variables: Any,
+        session: requests.Session | None,
+    ) -> Mapping[str, Any]:
+        del auth_driver
+        del session
+        query = normalise(call_str)
+        candidates = self._entries.get(query)
+        if not candidates:
+            raise RuntimeError(
+                'no recorded response for query: "{}"'.format(query[:200])
+            )
+        variables = _normalise_variables(variables)
+        matching = [x for x in candidates if x["variables"] == variables]
+        if not matching:
+            raise RuntimeError(
+                'no recorded response for query: "{}" with variables'
+                " {}".format(
+                    query[:200], json.dumps(variables, sort_keys=True)
+                )
+            )
+        entry = matching[0]
+        candidates.remove(entry)
+        self._played += 1
+        return entry["response"]
+
+    def played(self) -> int:
+        """Return the number of round trips served so far."""
+        return self._played
+
+    def remaining(self) -> int:
+        """Return the number of recorded round trips not served."""
+        return sum(len(x) for x in self._entries.values())
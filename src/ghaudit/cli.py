@@ -1,8 +1,15 @@
 """CLI interface."""
 
+# pylint: disable=too-many-lines
+
 from __future__ import annotations
 
-from typing import Any, Callable, Iterable
+import contextlib
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Iterable, List, Tuple
 
 import click
 from ruamel.yaml import YAML
@@ -10,12 +17,20 @@ from ruamel.yaml import YAML
 from ghaudit import (
     auth,
     cache,
+    cache_format,
+    cassette,
     compliance,
     config,
+    planner,
     policy,
+    profiling,
     schema,
+    server,
+    tracing,
     ui,
     user_map,
+    utils,
+    webhooks,
 )
 
 try:
@@ -25,12 +40,24 @@ except ImportError:
     from typing_extensions import get_args as typing_get_args
 
 
-def _load_organisation_conf(
+def _load_organisations_conf(
     filename: str, usermap: Callable[[], user_map.UserMap]
-) -> config.Config:
+) -> List[config.Config]:
     with open(filename, encoding="UTF-8") as conf_file:
         conf = YAML(typ="safe").load(conf_file)
-    return config.load(conf, usermap())
+    return config.load_all(conf, usermap())
+
+
+def _load_organisation_conf(
+    filename: str,
+    usermap: Callable[[], user_map.UserMap],
+    org: str | None = None,
+) -> config.Config:
+    configs = _load_organisations_conf(filename, usermap)
+    try:
+        return config.select(configs, org)
+    except RuntimeError as exc:
+        raise click.UsageError("{} (see --org)".format(exc)) from exc
 
 
 def _load_user_map_conf(filename: str) -> user_map.UserMap:
@@ -47,6 +74,74 @@ def _load_policy_conf(filename: str) -> policy.Policy:
     return policy_
 
 
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _max_age(
+    ctx: click.Context, _: click.Parameter, value: str | None
+) -> None:
+    """Keep the --max-age of a command in the context, in seconds."""
+    if value is None:
+        return
+    number, unit = value, "s"
+    if value[-1:] in _DURATION_UNITS:
+        number, unit = value[:-1], value[-1]
+    try:
+        ctx.meta["ghaudit.max_age"] = float(number) * _DURATION_UNITS[unit]
+    except ValueError as exc:
+        raise click.BadParameter(
+            "expected a duration such as 90s, 30m, 1h or 2d"
+        ) from exc
+
+
+_max_age_option = click.option(
+    "--max-age",
+    metavar="DURATION",
+    expose_value=False,
+    callback=_max_age,
+    help="First refresh the parts of the cache the command reads which are"
+    " older than DURATION, e.g. 30m, 1h or 2d.",
+)
+
+
+def _load_rstate(
+    ctx: click.Context,
+    load: Callable[[], schema.Rstate] = cache.load,
+    repositories: Iterable[str] | None = None,
+    teams: Iterable[str] | None = None,
+) -> schema.Rstate:
+    """Load the remote state with `load', or the snapshot selected by --at.
+
+    In `ghaudit serve', the remote state kept in memory is used instead.
+    With --max-age, the sections of the `repositories' and `teams' the
+    command reads (all when None) are refreshed first if stale, see
+    ghaudit.cache.refresh_stale. The generation of the cache read is then
+    pinned until the command ends.
+    """
+    max_age = ctx.meta.get("ghaudit.max_age")
+    if ctx.obj["at"]:
+        if max_age is not None:
+            raise click.UsageError("--max-age cannot be used with --at")
+        return cache.load_snapshot(ctx.obj["at"])
+    if max_age is not None:
+        refreshed = cache.refresh_stale(
+            ctx.obj["config"](),
+            auth.github_auth_token_passpy("ghaudit/github-token"),
+            max_age,
+            repositories,
+            teams,
+        )
+        if refreshed is None:
+            logging.info("refreshed the cache")
+        else:
+            logging.info("refreshed %d stale cache sections", refreshed)
+    if "rstate" in ctx.obj:
+        return ctx.obj["rstate"]()
+    # read a single generation of the cache, whatever refreshes happen
+    ctx.find_root().with_resource(cache.pinned())
+    return load()
+
+
 @click.group(context_settings={"help_option_names": ["-h", "--help"]})
 @click.option(
     "-c",
@@ -62,20 +157,137 @@ def _load_policy_conf(filename: str) -> policy.Policy:
 @click.option(
     "--policy", "policy_filename", default=config.default_dir() / "policy.yml"
 )
+@click.option(
+    "--trace",
+    "trace_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Write a Chrome trace event file of the command phases.",
+)
+@click.option(
+    "--profile",
+    "profile_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Profile the command with cProfile, to a pstats file.",
+)
+@click.option(
+    "--memprofile",
+    is_flag=True,
+    help="Report the peak memory and the top allocation sites.",
+)
+@click.option(
+    "--profile-top",
+    type=click.IntRange(min=1),
+    default=20,
+    show_default=True,
+    help="Number of entries printed by --profile and --memprofile.",
+)
+@click.option(
+    "--org",
+    metavar="NAME",
+    help="Organisation to audit, out of the ones configured. Its cache is"
+    " kept apart from the other organisations.",
+)
+@click.option(
+    "--at",
+    type=click.DateTime(),
+    help="Read the last cache snapshot recorded at or before this date"
+    " (local time) instead of the cache, see `ghaudit cache snapshots'.",
+)
 @click.pass_context
+# pylint: disable=too-many-arguments
 def cli(
     ctx: click.Context,
     config_filename: str,
     usermap_filename: str,
     policy_filename: str,
+    trace_path: Path | None,
+    profile_path: Path | None,
+    memprofile: bool,
+    profile_top: int,
+    org: str | None,
+    at: datetime | None,
 ) -> None:
     """Github organisation security auditing tool."""
     ctx.ensure_object(dict)
-    ctx.obj["usermap"] = lambda: _load_user_map_conf(usermap_filename)
-    ctx.obj["config"] = lambda: _load_organisation_conf(
-        config_filename, ctx.obj["usermap"]
+    ctx.obj["at"] = at
+    ctx.obj["org"] = org
+    if trace_path:
+        tracer = tracing.enable()
+        ctx.call_on_close(lambda: tracer.export_chrome(trace_path))
+    if memprofile:
+        ctx.with_resource(profiling.memory_profile(profile_top))
+    if profile_path:
+        ctx.with_resource(profiling.cpu_profile(profile_path, profile_top))
+    # the loaders are already set when running in `ghaudit serve'
+    ctx.obj.setdefault(
+        "usermap", lambda: _load_user_map_conf(usermap_filename)
     )
-    ctx.obj["policy"] = lambda: _load_policy_conf(policy_filename)
+    ctx.obj.setdefault(
+        "config",
+        lambda: _load_organisation_conf(
+            config_filename, ctx.obj["usermap"], org
+        ),
+    )
+    ctx.obj.setdefault("policy", lambda: _load_policy_conf(policy_filename))
+    ctx.obj["files"] = {
+        "config": Path(config_filename),
+        "usermap": Path(usermap_filename),
+        "policy": Path(policy_filename),
+    }
+    if org and config.get_cache_apart(ctx.obj["config"]()):
+        ctx.with_resource(cache.organisation(org))
+
+
+@cli.command("serve")
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Path of the socket, by default the one the commands forward to.",
+)
+@click.pass_context
+def serve(ctx: click.Context, socket_path: Path | None) -> None:
+    """Answer the commands reading the cache from memory.
+
+    The cache, the organisation configuration, the user map and the policy
+    are loaded once, and again when their files change. The `compliance',
+    `config', `org', `stats', `user' and `usermap' commands are forwarded to
+    this server when it runs, unless an option precedes them, and unless
+    they would read other files than the server.
+    """
+    files = ctx.obj["files"]
+    usermap = server.Resident(
+        lambda: [files["usermap"]],
+        lambda: _load_user_map_conf(files["usermap"]),
+    )
+    resident = {
+        "usermap": usermap,
+        "config": server.Resident(
+            lambda: [files["config"], files["usermap"]],
+            lambda: _load_organisation_conf(
+                files["config"], usermap, ctx.obj["org"]
+            ),
+        ),
+        "policy": server.Resident(
+            lambda: [files["policy"]],
+            lambda: _load_policy_conf(files["policy"]),
+        ),
+        "rstate": server.Resident(
+            lambda: [cache.file_path(), cache.journal_path()], cache.load
+        ),
+    }
+    path_ = socket_path or server.socket_path()
+    files_ = server.files(
+        files["config"], files["usermap"], files["policy"], cache.data_dir()
+    )
+    with server.server(path_, cli, lambda: dict(resident), files_) as server_:
+        print("serving on {}".format(path_))
+        try:
+            server_.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            path_.unlink()
 
 
 @cli.group("compliance")
@@ -84,11 +296,15 @@ def compliance_group() -> None:
 
 
 @compliance_group.command("check-all")
+@_max_age_option
 @click.pass_context
 def compliance_check_all(ctx: click.Context) -> None:
     """Run all compliance checks."""
     compliance.check_all(
-        ctx.obj["config"](), ctx.obj["usermap"](), ctx.obj["policy"]()
+        ctx.obj["config"](),
+        ctx.obj["usermap"](),
+        ctx.obj["policy"](),
+        _load_rstate(ctx),
     )
 
 
@@ -105,19 +321,541 @@ def cache_path() -> None:
 
 @cache_group.command("refresh")
 @click.option("--token-pass-name", default="ghaudit/github-token")
+@click.option(
+    "--record",
+    "record_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Record the github API exchanges to a cassette file.",
+)
+@click.option(
+    "--telemetry",
+    "telemetry_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Write a JSON telemetry report of the refresh.",
+)
+@click.option(
+    "--openmetrics",
+    "openmetrics_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Write the telemetry report in the OpenMetrics text format too.",
+)
+@click.option(
+    "--plan",
+    is_flag=True,
+    help="Estimate the cost of the refresh from the current cache, without"
+    " running it.",
+)
+@click.option(
+    "--latency",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="Latency of a github API round trip in seconds, used by --plan.",
+)
+@click.option(
+    "--repo",
+    "repositories",
+    multiple=True,
+    metavar="NAME",
+    help="Only refresh the collaborators and branch protection rules of a"
+    " cached repository.",
+)
+@click.option(
+    "--team",
+    "teams",
+    multiple=True,
+    metavar="NAME",
+    help="Only refresh the repositories, members and children of a cached"
+    " team.",
+)
+@click.option(
+    "--user",
+    "logins",
+    multiple=True,
+    metavar="LOGIN",
+    help="Only refresh a cached user, and the repositories and teams they"
+    " have access to.",
+)
+@click.option(
+    "--bulk",
+    is_flag=True,
+    help="Buffer the responses and build the cache once they are all"
+    " received, instead of merging each of them.",
+)
+@click.option(
+    "--spill",
+    is_flag=True,
+    help="Write the repositories and teams to disk as soon as they are"
+    " complete, to bound the memory used (implies --bulk). The indexes of the"
+    " cache are not written.",
+)
 @click.pass_context
-def cache_refresh(ctx: click.Context, token_pass_name: str) -> None:
+# pylint: disable-next=too-many-locals
+def cache_refresh(
+    ctx: click.Context,
+    token_pass_name: str,
+    record_path: Path | None,
+    telemetry_path: Path | None,
+    openmetrics_path: Path | None,
+    plan: bool,
+    latency: float,
+    repositories: Tuple[str, ...],
+    teams: Tuple[str, ...],
+    logins: Tuple[str, ...],
+    bulk: bool,
+    spill: bool,
+) -> None:
     """Refresh ghaudit cache.
 
     Request the state of the configured github organisation and store it to a
-    cache file to evaluate later.
+    cache file to evaluate later. With --repo, --team or --user, only the
+    given entities are requested again, and updated in the cache.
     """
+    partial = repositories or teams or logins
+    if plan:
+        _print_refresh_plan(planner.estimate(cache.load()), latency)
+        return
     auth_driver = auth.github_auth_token_passpy(token_pass_name)
-    cache.refresh(
-        ctx.obj["config"](),
-        auth_driver,
-        ui.Progress(),
+    if openmetrics_path and not telemetry_path:
+        raise click.UsageError("--openmetrics requires --telemetry")
+    if partial and (telemetry_path or bulk or spill):
+        raise click.UsageError(
+            "--telemetry, --bulk and --spill cannot be used with --repo,"
+            " --team or --user"
+        )
+    with contextlib.ExitStack() as stack:
+        transport = utils.github_graphql_call  # type: utils.Transport
+        if record_path:
+            transport = stack.enter_context(cassette.Recorder(record_path))
+        if partial:
+            records = cache.refresh_entities(
+                ctx.obj["config"](),
+                auth_driver,
+                repositories,
+                teams,
+                logins,
+                transport,
+            )
+            print("updated the cache ({} journal records)".format(records))
+            return
+        cache.refresh(
+            ctx.obj["config"](),
+            auth_driver,
+            ui.Progress(),
+            transport,
+            telemetry_path,
+            openmetrics_path,
+            bulk,
+            spill,
+        )
+
+
+@cache_group.command("refresh-all")
+@click.option("--token-pass-name", default="ghaudit/github-token")
+@click.option(
+    "--record",
+    "record_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Record the github API exchanges to a cassette file.",
+)
+@click.option(
+    "--bulk",
+    is_flag=True,
+    help="Buffer the responses and build the caches once they are all"
+    " received, instead of merging each of them.",
+)
+@click.pass_context
+def cache_refresh_all(
+    ctx: click.Context,
+    token_pass_name: str,
+    record_path: Path | None,
+    bulk: bool,
+) -> None:
+    """Refresh the caches of all the configured organisations.
+
+    The organisations are requested together, sharing the github API round
+    trips. The cache of each organisation is then read with --org.
+    """
+    if ctx.obj["org"]:
+        raise click.UsageError("--org cannot be used with `cache refresh-all'")
+    configs = _load_organisations_conf(
+        ctx.obj["files"]["config"], ctx.obj["usermap"]
+    )
+    auth_driver = auth.github_auth_token_passpy(token_pass_name)
+    with contextlib.ExitStack() as stack:
+        transport = utils.github_graphql_call  # type: utils.Transport
+        if record_path:
+            transport = stack.enter_context(cassette.Recorder(record_path))
+        cache.refresh_organisations(
+            configs, auth_driver, ui.Progress(), transport, bulk
+        )
+    print("refreshed the caches of {} organisations".format(len(configs)))
+
+
+def _shard(value: str) -> Tuple[int, int]:
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError as exc:
+        raise click.BadParameter("expected I/N, e.g. 1/4") from exc
+    if not 1 <= index <= count:
+        raise click.BadParameter("expected a shard from 1 to {}".format(count))
+    return index, count
+
+
+def _print_refresh_plan(estimate: planner.Estimate, latency: float) -> None:
+    print(
+        "estimated HTTP roundtrips: {}\n"
+        "estimated graphQL queries: {}\n"
+        "estimated rate limit points: {}\n"
+        "estimated wall time: {:.0f}s ({}s per roundtrip)\n"
+        "peak pending queue size: {}".format(
+            estimate.requests,
+            estimate.queries,
+            estimate.points,
+            estimate.requests * latency,
+            latency,
+            estimate.peak_queue,
+        )
+    )
+
+
+@cache_group.command("refresh-shard")
+@click.argument(
+    "shard", metavar="I/N", callback=lambda _, __, value: _shard(value)
+)
+@click.option("--token-pass-name", default="ghaudit/github-token")
+@click.option(
+    "--record",
+    "record_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Record the github API exchanges to a cassette file.",
+)
+@click.option(
+    "--seed",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Cache file to read the listings of the organisation from.",
+)
+@click.option(
+    "--output",
+    "output_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Shard file to write (in the directory of the cache by default).",
+)
+@click.pass_context
+# pylint: disable=too-many-arguments
+def cache_refresh_shard(
+    ctx: click.Context,
+    shard: Tuple[int, int],
+    token_pass_name: str,
+    record_path: Path | None,
+    seed: Path | None,
+    output_path: Path | None,
+) -> None:
+    """Refresh shard I out of N of the cache, to a shard file.
+
+    Only the repositories and teams of the shard are requested, see `cache
+    merge-shards'.
+    """
+    auth_driver = auth.github_auth_token_passpy(token_pass_name)
+    output_path = output_path or cache.shard_path(*shard)
+    with contextlib.ExitStack() as stack:
+        transport = utils.github_graphql_call  # type: utils.Transport
+        if record_path:
+            transport = stack.enter_context(cassette.Recorder(record_path))
+        entities = cache.refresh_shard(
+            ctx.obj["config"](),
+            auth_driver,
+            *shard,
+            output_path,
+            seed,
+            transport,
+        )
+    print(
+        "wrote shard {}/{} ({} repositories and teams) to {}".format(
+            *shard, entities, output_path
+        )
+    )
+
+
+@cache_group.command("merge-shards")
+@click.argument(
+    "paths",
+    metavar="SHARD...",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.pass_context
+def cache_merge_shards(ctx: click.Context, paths: Tuple[Path, ...]) -> None:
+    """Merge the shard files of `cache refresh-shard' into the cache.
+
+    All the shards of the refresh must be given, made from the same listings
+    of the organisation. The merged cache is validated.
+    """
+    count = cache.merge_shards(ctx.obj["config"](), paths)
+    print("merged {} shards into the cache".format(count))
+
+
+@cache_group.command("replay")
+@click.argument(
+    "cassette_path",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.option("--bulk", is_flag=True, help="Replay as `cache refresh --bulk'.")
+@click.pass_context
+def cache_replay(ctx: click.Context, cassette_path: Path, bulk: bool) -> None:
+    """Replay a recorded cache refresh without network.
+
+    The cassette is recorded with `cache refresh --record'. The cache is not
+    modified. Measurements of the synchronisation are displayed, to compare
+    the performance of ghaudit versions on the same organisation.
+    """
+    measures = cache.replay(
+        ctx.obj["config"](), cassette_path, ui.Progress(), bulk
     )
+    for name, value in measures.items():
+        print("{}: {}".format(name, value))
+
+
+@cache_group.command("convert")
+@click.argument(
+    "format_", metavar="FORMAT", type=click.Choice(cache_format.FORMATS)
+)
+@click.option(
+    "--compression",
+    type=click.Choice(cache_format.COMPRESSIONS),
+    default=cache_format.DEFAULT_COMPRESSION,
+    show_default=True,
+)
+@click.option(
+    "--input",
+    "input_path",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Cache file to convert (the cache of ghaudit by default).",
+)
+@click.option(
+    "--output",
+    "output_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Converted file (the input file by default).",
+)
+def cache_convert(
+    format_: str,
+    compression: str,
+    input_path: Path | None,
+    output_path: Path | None,
+) -> None:
+    """Convert the cache to another format or compression.
+
+    The format and compression used by `cache refresh' are set in the
+    configuration file.
+    """
+    found = cache.convert(format_, compression, input_path, output_path)
+    print(
+        "converted cache from {} ({}) to {} ({})".format(
+            *found, format_, compression
+        )
+    )
+
+
+@cache_group.command("compact")
+def cache_compact() -> None:
+    """Fold the cache journal into the cache file.
+
+    The journal records the changes made to the cache since it was last
+    written as a whole. It is also compacted when it grows larger than the
+    cache file, and discarded by `cache refresh'.
+    """
+    print("compacted {} journal records".format(cache.compact()))
+
+
+@cache_group.command("verify")
+def cache_verify() -> None:
+    """Fully validate the cache.
+
+    The cache is validated when written by `cache refresh', and is not
+    validated again when loaded while it does not change. This command
+    validates it regardless, and stamps it as validated.
+    """
+    records = cache.verify()
+    print("cache is valid ({} journal records)".format(records))
+
+
+def _remote_url(ctx: click.Context, url: str | None) -> str:
+    url = url or config.get_cache_remote(ctx.obj["config"]())
+    if not url:
+        raise click.UsageError(
+            "no cache location given, and no remote in the cache settings"
+        )
+    return url
+
+
+@cache_group.command("publish")
+@click.option("--to", "url", help="Directory or HTTP(S) URL.")
+@click.option("--key-pass-name", default="ghaudit/cache-key")
+@click.pass_context
+def cache_publish(
+    ctx: click.Context, url: str | None, key_pass_name: str
+) -> None:
+    """Publish the cache, signed, for `cache fetch'.
+
+    The location defaults to the remote of the cache settings.
+    """
+    transfer = cache.publish(
+        _remote_url(ctx, url),
+        auth.secret_passpy(key_pass_name).encode("UTF-8"),
+    )
+    print(
+        "published {} objects, {} uploaded".format(
+            transfer.objects, transfer.transferred
+        )
+    )
+
+
+@cache_group.command("fetch")
+@click.option("--from", "url", help="Directory or HTTP(S) URL.")
+@click.option("--key-pass-name", default="ghaudit/cache-key")
+@click.pass_context
+def cache_fetch(
+    ctx: click.Context, url: str | None, key_pass_name: str
+) -> None:
+    """Replace the cache with the one published by `cache publish'.
+
+    The location defaults to the remote of the cache settings.
+    """
+    config_ = ctx.obj["config"]()
+    transfer = cache.fetch(
+        _remote_url(ctx, url),
+        auth.secret_passpy(key_pass_name).encode("UTF-8"),
+        config.get_cache_format(config_),
+        config.get_cache_compression(config_),
+    )
+    if transfer.objects:
+        print(
+            "fetched {} objects, {} downloaded".format(
+                transfer.objects, transfer.transferred
+            )
+        )
+    else:
+        print("cache is up to date")
+
+
+def _ingest_spool(
+    config_: config.Config, auth_driver: auth.AuthDriver, spool: Path
+) -> None:
+    paths = webhooks.spooled(spool)
+    if not paths:
+        return
+    records = cache.ingest(
+        config_, auth_driver, [webhooks.read(x) for x in paths]
+    )
+    for path_ in paths:
+        path_.unlink()
+    print("applied {} events ({} cache records)".format(len(paths), records))
+
+
+@cache_group.command("ingest")
+@click.argument(
+    "spool", type=click.Path(file_okay=False, path_type=Path), required=True
+)
+@click.option(
+    "--listen",
+    metavar="HOST:PORT",
+    help="Receive the webhook deliveries over HTTP into the spool.",
+)
+@click.option(
+    "--delay",
+    type=float,
+    default=2.0,
+    show_default=True,
+    help="Seconds without delivery before the received events are applied.",
+)
+@click.option("--secret-pass-name", default="ghaudit/webhook-secret")
+@click.option("--token-pass-name", default="ghaudit/github-token")
+@click.pass_context
+def cache_ingest(
+    ctx: click.Context,
+    spool: Path,
+    listen: str | None,
+    delay: float,
+    secret_pass_name: str,
+    token_pass_name: str,
+) -> None:
+    """Apply github webhook events to the cache.
+
+    The events spooled in SPOOL are applied as targeted updates of the
+    cache, requesting only the entities they change, and removed. With
+    --listen, the webhook deliveries are received over HTTP, checked against
+    the webhook secret and spooled, and applied until interrupted.
+    """
+    config_ = ctx.obj["config"]()
+    auth_driver = auth.github_auth_token_passpy(token_pass_name)
+    if not listen:
+        _ingest_spool(config_, auth_driver, spool)
+        return
+    host, _, port = listen.rpartition(":")
+    if not port.isdigit():
+        raise click.BadParameter("expected HOST:PORT", param_hint="--listen")
+
+    def idle() -> None:
+        try:
+            _ingest_spool(config_, auth_driver, spool)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("failed to apply the spooled events")
+
+    receiver = webhooks.receiver(
+        (host, int(port)),
+        spool,
+        auth.secret_passpy(secret_pass_name).encode("UTF-8"),
+        idle,
+    )
+    receiver.timeout = delay
+    with receiver:
+        idle()
+        while True:
+            receiver.handle_request()
+
+
+@cache_group.command("gc")
+def cache_gc() -> None:
+    """Remove the previous generations of the cache no longer read."""
+    removed = cache.collect()
+    print("removed {} cache generations".format(len(removed)))
+
+
+@cache_group.command("snapshots")
+def cache_snapshots() -> None:
+    """List the snapshots of the cache.
+
+    A snapshot of the cache is recorded by each `cache refresh', unless the
+    history is disabled in the configuration file. A snapshot is read by
+    commands with the global --at option.
+    """
+    for snapshot in cache.snapshots():
+        print(
+            "{}  {}  repositories: {}, teams: {}, users: {}".format(
+                snapshot.time.astimezone().strftime("%Y-%m-%d %H:%M:%S %Z"),
+                snapshot.name,
+                snapshot.repositories,
+                snapshot.teams,
+                snapshot.users,
+            )
+        )
+
+
+@cache_group.command("diff")
+@click.argument("old")
+@click.argument("new")
+def cache_diff(old: str, new: str) -> None:
+    """Show the changes between two states of the organisation.
+
+    OLD and NEW are either `cache' for the cache, the path of a cache file,
+    the name of a snapshot (see `cache snapshots'), or a date selecting the
+    last snapshot recorded at or before it. Each change is printed as a JSON
+    line.
+    """
+    for change in cache.diff(old, new):
+        print(json.dumps(change))
 
 
 def _user_short_str(user: schema.User) -> str:
@@ -137,9 +875,11 @@ def _team_short_str(team: schema.Team) -> str:
 
 
 @cli.command()
-def stats() -> None:
+@_max_age_option
+@click.pass_context
+def stats(ctx: click.Context) -> None:
     """Show some statistics about the cached state."""
-    rstate = cache.load()
+    rstate = _load_rstate(ctx, teams=[])
     teams = len(schema.org_teams(rstate))
     repositories = len(schema.org_repositories(rstate))
     members = len(schema.org_members(rstate))
@@ -166,10 +906,8 @@ def _common_list(
     list_func: Callable[[schema.Rstate], Iterable[Any]],
     mode: ui.DisplayMode,
     fmt: ui.Formatter,
-    rstate: schema.Rstate | None = None,
+    rstate: schema.Rstate,
 ) -> None:
-    if not rstate:
-        rstate = cache.load()
     _list = list_func(rstate)
     ui.print_items(mode, _list, fmt)
 
@@ -191,7 +929,9 @@ def org_repositories_group() -> None:
     type=click.Choice(typing_get_args(ui.DisplayMode)),
     default="basic",
 )
-def org_repositories_list(mode: ui.DisplayMode) -> None:
+@_max_age_option
+@click.pass_context
+def org_repositories_list(ctx: click.Context, mode: ui.DisplayMode) -> None:
     """List the repositories of the configured organisation."""
     _common_list(
         schema.org_repositories,
@@ -205,13 +945,16 @@ def org_repositories_list(mode: ui.DisplayMode) -> None:
             ),
             _repo_short_str,
         ),
+        _load_rstate(ctx, repositories=[], teams=[]),
     )
 
 
 @org_repositories_group.command("count")
-def org_repositories_count() -> None:
+@_max_age_option
+@click.pass_context
+def org_repositories_count(ctx: click.Context) -> None:
     """Count the number of repositories in the configured organisation."""
-    rstate = cache.load()
+    rstate = _load_rstate(ctx, repositories=[], teams=[])
     repos = schema.org_repositories(rstate)
     print(len(repos))
 
@@ -224,12 +967,13 @@ def org_repositories_count() -> None:
     default="basic",
 )
 @click.argument("name")
+@_max_age_option
 @click.pass_context
 def org_repositories_branch_protection(
     ctx: click.Context, name: str, mode: ui.DisplayMode
 ) -> None:
     """Show branch protection rules of a repository."""
-    rstate = cache.load()
+    rstate = _load_rstate(ctx, lambda: cache.load_repository(name), [name], [])
     usermap = ctx.obj["usermap"]()
     repo = schema.org_repo_by_name(rstate, name)
     _common_list(
@@ -265,6 +1009,7 @@ def org_repositories_branch_protection(
             ),
             schema.branch_protection_pattern,
         ),
+        rstate,
     )
 
 
@@ -280,7 +1025,9 @@ def org_members_group() -> None:
     type=click.Choice(typing_get_args(ui.DisplayMode)),
     default="basic",
 )
-def org_members_list(mode: ui.DisplayMode) -> None:
+@_max_age_option
+@click.pass_context
+def org_members_list(ctx: click.Context, mode: ui.DisplayMode) -> None:
     """Show the list of members in the configured organisation."""
     _common_list(
         schema.org_members,
@@ -295,13 +1042,16 @@ def org_members_list(mode: ui.DisplayMode) -> None:
             ),
             _user_short_str,
         ),
+        _load_rstate(ctx, repositories=[], teams=[]),
     )
 
 
 @org_members_group.command("count")
-def org_members_count() -> None:
+@_max_age_option
+@click.pass_context
+def org_members_count(ctx: click.Context) -> None:
     """Count the number of members in the configured organisation."""
-    rstate = cache.load()
+    rstate = _load_rstate(ctx, repositories=[], teams=[])
     members = schema.org_members(rstate)
     print(len(members))
 
@@ -312,7 +1062,9 @@ def org_teams_group() -> None:
 
 
 @org_teams_group.command("tree")
-def org_teams_tree() -> None:
+@_max_age_option
+@click.pass_context
+def org_teams_tree(ctx: click.Context) -> None:
     """Show the list of teams hierarchically."""
 
     def print_teams(teams: Iterable[schema.Team], indent: int) -> None:
@@ -326,7 +1078,7 @@ def org_teams_tree() -> None:
             ]
             print_teams(children, indent + 1)
 
-    rstate = cache.load()
+    rstate = _load_rstate(ctx, repositories=[], teams=[])
     teams = schema.org_teams(rstate)
     roots = [x for x in teams if not schema.team_parent(rstate, x)]
     print_teams(roots, 1)
@@ -339,9 +1091,11 @@ def org_teams_tree() -> None:
     type=click.Choice(typing_get_args(ui.DisplayMode)),
     default="basic",
 )
-def org_teams_list(mode: ui.DisplayMode) -> None:
+@_max_age_option
+@click.pass_context
+def org_teams_list(ctx: click.Context, mode: ui.DisplayMode) -> None:
     """Show the list of teams in the configured organisation."""
-    rstate = cache.load()
+    rstate = _load_rstate(ctx, repositories=[], teams=[])
     _common_list(
         schema.org_teams,
         mode,
@@ -359,9 +1113,11 @@ def org_teams_list(mode: ui.DisplayMode) -> None:
 
 
 @org_teams_group.command("count")
-def org_teams_count() -> None:
+@_max_age_option
+@click.pass_context
+def org_teams_count(ctx: click.Context) -> None:
     """Count the number of teams in the configured organisation."""
-    rstate = cache.load()
+    rstate = _load_rstate(ctx, repositories=[], teams=[])
     teams = schema.org_teams(rstate)
     print(len(teams))
 
@@ -373,7 +1129,9 @@ def org_repository_group() -> None:
 
 @org_repository_group.command("show")
 @click.argument("name")
-def org_repository_show(name: str) -> None:
+@_max_age_option
+@click.pass_context
+def org_repository_show(ctx: click.Context, name: str) -> None:
     """Show detailed attributes of a given repository."""
 
     def collaborators(repository: schema.Repo) -> str:
@@ -387,7 +1145,7 @@ def org_repository_show(name: str) -> None:
             )
         return result
 
-    rstate = cache.load()
+    rstate = _load_rstate(ctx, lambda: cache.load_repository(name), [name], [])
     repository = schema.org_repo_by_name(rstate, name)
     print(
         (
@@ -413,7 +1171,9 @@ def org_team_group() -> None:
 
 @org_team_group.command("show")
 @click.argument("name")
-def org_team_show(name: str) -> None:
+@_max_age_option
+@click.pass_context
+def org_team_show(ctx: click.Context, name: str) -> None:
     """Show detailed attributes of a given team."""
 
     def members(team: schema.Team) -> str:
@@ -445,7 +1205,7 @@ def org_team_show(name: str) -> None:
             )
         return result
 
-    rstate = cache.load()
+    rstate = _load_rstate(ctx, lambda: cache.load_team(name), [], [name])
     team = schema.org_team_by_name(rstate, name)
     print(
         (
@@ -473,7 +1233,9 @@ def user_group() -> None:
 
 @user_group.command("show")
 @click.argument("login")
-def user_show(login: str) -> None:
+@_max_age_option
+@click.pass_context
+def user_show(ctx: click.Context, login: str) -> None:
     """Show detailed attributes of a given github user.
 
     The user does not need to belong to the organisation. ghaudit gathers user
@@ -487,7 +1249,7 @@ def user_show(login: str) -> None:
                     result += "   * {}\n".format(schema.team_name(team))
         return result
 
-    rstate = cache.load()
+    rstate = _load_rstate(ctx, lambda: cache.load_user(login))
     user = schema.user_by_login(rstate, login)
     if user:
         print(
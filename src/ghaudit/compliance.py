@@ -2,7 +2,7 @@
 
 from __future__ import annotations
 
-from ghaudit import cache, config, policy, schema, user_map
+from ghaudit import cache, config, policy, schema, tracing, user_map
 
 
 def error(msg: str) -> None:
@@ -350,24 +350,43 @@ def check_repo_branch_protection(
 
 
 def check_all(
-    conf: config.Config, usermap: user_map.UserMap, policy_: policy.Policy
+    conf: config.Config,
+    usermap: user_map.UserMap,
+    policy_: policy.Policy,
+    rstate: schema.Rstate | None = None,
 ) -> None:
-    rstate = cache.load()
-    for repo in schema.org_repositories(rstate):
-        check_repo_unref(rstate, conf, policy_, repo)
-    for repo in schema.org_repositories(rstate):
-        check_repo_visibility(rstate, policy_, repo)
-    for member in schema.org_members(rstate):
-        check_user(rstate, conf, usermap, policy_, member)
-    for team in schema.org_teams(rstate):
-        check_team_unref(rstate, conf, policy_, team)
-    for team in schema.org_teams(rstate):
-        check_team_permissions(rstate, conf, policy_, team)
-    for team in schema.org_teams(rstate):
-        check_team_members(rstate, conf, usermap, policy_, team)
-    for repo in schema.org_repositories(rstate):
-        check_repo_collaborators(rstate, conf, usermap, policy_, repo)
-    for repo in schema.org_repositories(rstate):
-        check_repo_branch_protection(rstate, conf, policy_, repo)
-    check_missing_teams(rstate, conf, policy_)
-    check_missing_repos(rstate, conf, policy_)
+    if rstate is None:
+        rstate = cache.load()
+    repos = schema.org_repositories(rstate)
+    teams = schema.org_teams(rstate)
+    with tracing.span("compliance.check_repo_unref", count=len(repos)):
+        for repo in repos:
+            check_repo_unref(rstate, conf, policy_, repo)
+    with tracing.span("compliance.check_repo_visibility", count=len(repos)):
+        for repo in repos:
+            check_repo_visibility(rstate, policy_, repo)
+    members = schema.org_members(rstate)
+    with tracing.span("compliance.check_user", count=len(members)):
+        for member in members:
+            check_user(rstate, conf, usermap, policy_, member)
+    with tracing.span("compliance.check_team_unref", count=len(teams)):
+        for team in teams:
+            check_team_unref(rstate, conf, policy_, team)
+    with tracing.span("compliance.check_team_permissions", count=len(teams)):
+        for team in teams:
+            check_team_permissions(rstate, conf, policy_, team)
+    with tracing.span("compliance.check_team_members", count=len(teams)):
+        for team in teams:
+            check_team_members(rstate, conf, usermap, policy_, team)
+    with tracing.span("compliance.check_repo_collaborators", count=len(repos)):
+        for repo in repos:
+            check_repo_collaborators(rstate, conf, usermap, policy_, repo)
+    with tracing.span(
+        "compliance.check_repo_branch_protection", count=len(repos)
+    ):
+        for repo in repos:
+            check_repo_branch_protection(rstate, conf, policy_, repo)
+    with tracing.span("compliance.check_missing_teams"):
+        check_missing_teams(rstate, conf, policy_)
+    with tracing.span("compliance.check_missing_repos"):
+        check_missing_repos(rstate, conf, policy_)
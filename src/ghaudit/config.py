@@ -18,11 +18,18 @@ from typing import (
     Mapping,
     NamedTuple,
     NoReturn,
+    Sequence,
     Set,
     TypedDict,
 )
 
 import ghaudit.user_map
+from ghaudit.cache_format import (
+    COMPRESSIONS,
+    DEFAULT_COMPRESSION,
+    DEFAULT_FORMAT,
+    FORMATS,
+)
 from ghaudit.user_map import UserMap
 from ghaudit.utils import find_duplicates
 
@@ -49,6 +56,11 @@ class Config(NamedTuple):
     teams: Mapping[str, Team]
     by_member: Mapping[str, Set[str]]
     effective_members: Mapping[str, set[str]]
+    cache_format: str = DEFAULT_FORMAT
+    cache_compression: str = DEFAULT_COMPRESSION
+    cache_history: bool = True
+    cache_remote: str | None = None
+    cache_apart: bool = False
 
 
 class RawTeamBase1(TypedDict):
@@ -177,6 +189,33 @@ def _check_teams(teams: Any, usermap: UserMap) -> List[str]:
     return errors
 
 
+# pylint: disable=too-many-return-statements
+def _check_cache(cache: Any) -> List[str]:
+    if not isinstance(cache, Mapping):
+        return ["The cache settings should be a mapping."]
+    format_ = cache.get("format", DEFAULT_FORMAT)
+    compression = cache.get("compression", DEFAULT_COMPRESSION)
+    if format_ not in FORMATS:
+        return [
+            'Unknown cache format "{}", expected one of: {}'.format(
+                format_, ", ".join(FORMATS)
+            )
+        ]
+    if compression not in COMPRESSIONS:
+        return [
+            'Unknown cache compression "{}", expected one of: {}'.format(
+                compression, ", ".join(COMPRESSIONS)
+            )
+        ]
+    if format_ == "sqlite" and compression != "none":
+        return ["The sqlite cache format cannot be compressed."]
+    if not isinstance(cache.get("history", True), bool):
+        return ["The cache history setting should be a boolean."]
+    if not isinstance(cache.get("remote", ""), str):
+        return ["The cache remote setting should be a string."]
+    return []
+
+
 def _check_config(raw: Mapping[str, Any], usermap: UserMap) -> None:
     error_separator = "\n * "
 
@@ -200,6 +239,7 @@ def _check_config(raw: Mapping[str, Any], usermap: UserMap) -> None:
     errors += _check_owners(organisation["owners"], usermap)
     if "teams" in organisation and organisation["teams"]:
         errors += _check_teams(organisation["teams"], usermap)
+    errors += _check_cache(raw.get("cache") or {})
 
     if errors:
         fail(error_separator.join(errors))
@@ -295,14 +335,103 @@ def load(raw_config: Mapping[str, Any], usermap: UserMap):
         },
         by_member=index_members(teams),
         effective_members=compute_effective_members(teams, descendants_map),
+        cache_format=(raw_config.get("cache") or {}).get(
+            "format", DEFAULT_FORMAT
+        ),
+        cache_compression=(raw_config.get("cache") or {}).get(
+            "compression", DEFAULT_COMPRESSION
+        ),
+        cache_history=(raw_config.get("cache") or {}).get("history", True),
+        cache_remote=(raw_config.get("cache") or {}).get("remote"),
     )
 
 
+def load_all(raw_config: Mapping[str, Any], usermap: UserMap) -> List[Config]:
+    """Load the configuration of one or several organisations.
+
+    Several organisations are described by a list of `organisations',
+    instead of an `organisation'. The other settings are shared by all of
+    them, but their caches are kept apart.
+
+    :raises: RuntimeError if an organisation is described twice.
+    """
+    if "organisations" not in raw_config:
+        return [load(raw_config, usermap)]
+    if not raw_config["organisations"]:
+        raise RuntimeError(
+            "no organisation could be found in the configuration."
+        )
+    configs = [
+        load({**raw_config, "organisation": x}, usermap)._replace(
+            cache_apart=True
+        )
+        for x in raw_config["organisations"]
+    ]
+    duplicates = find_duplicates(get_org_name(x) for x in configs)
+    if duplicates:
+        raise RuntimeError(
+            "organisations configured more than once: {}".format(
+                ", ".join(sorted(duplicates))
+            )
+        )
+    return configs
+
+
+def select(configs: Sequence[Config], name: str | None) -> Config:
+    """Return the configuration of the organisation `name'.
+
+    Without `name', the configuration must describe a single organisation.
+
+    :raises: RuntimeError if the organisation is not configured, or is not
+    given out of several.
+    """
+    if name is None:
+        if len(configs) > 1:
+            raise RuntimeError(
+                "several organisations are configured: {}".format(
+                    ", ".join(get_org_name(x) for x in configs)
+                )
+            )
+        return configs[0]
+    for config in configs:
+        if get_org_name(config) == name:
+            return config
+    raise RuntimeError('organisation "{}" is not configured'.format(name))
+
+
 def get_org_name(config: Config) -> str:
     """Return the name of the organisation to audit."""
     return config.organisation
 
 
+def get_cache_format(config: Config) -> str:
+    """Return the format the cache is stored with."""
+    return config.cache_format
+
+
+def get_cache_compression(config: Config) -> str:
+    """Return the compression of the cache file."""
+    return config.cache_compression
+
+
+def get_cache_history(config: Config) -> bool:
+    """Return whether the refreshes of the cache are kept as snapshots."""
+    return config.cache_history
+
+
+def get_cache_remote(config: Config) -> str | None:
+    """Return the location the cache is published to and fetched from."""
+    return config.cache_remote
+
+
+def get_cache_apart(config: Config) -> bool:
+    """Return whether the organisation has a cache of its own.
+
+    It is the case of the organisations of a list of `organisations'.
+    """
+    return config.cache_apart
+
+
 def get_teams(config: Config) -> Collection[Team]:
     """Return all teams from the configuration."""
     return config.teams.values()
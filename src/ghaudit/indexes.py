@@ -0,0 +1,189 @@
+"""Indexes of the remote state, computed once and persisted with the cache.
+
+The indexes map names and IDs to the entities of the remote state and to
+their relations, so that a command looking up one entity does not scan the
+whole remote state, nor even load it:
+
+ * records: ID of a user, a repository or a team -> the entity, serialised
+   on its own (see ghaudit.cache_format.pack).
+ * names: ID of a user, a repository or a team -> login or name.
+ * repository_ids, team_ids, user_ids: name or login -> ID.
+ * members: IDs of the organisation members.
+ * user_teams: user ID -> [[team ID, role]].
+ * stamp: the cache file the indexes were computed from, see `stamp'.
+
+The indexes are written in the layout of the binary cache format (see
+ghaudit.cache_format.dump_sections), so that each of them is only decoded
+when first used. Only the records of the entities a command describes are
+deserialised.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import IO, Any, Dict, Hashable, List, Mapping
+
+from ghaudit import cache_format, schema
+
+MAGIC = b"GHAI"
+VERSION = 1
+
+Indexes = Mapping[str, Any]
+
+
+def stamp(cache_path: Path) -> List[int]:
+    """Identify a cache file by its inode, size and modification time."""
+    stat = cache_path.stat()
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def _append(index: Dict[Hashable, List], key: Hashable, value: Any) -> None:
+    index.setdefault(key, []).append(value)
+
+
+def _edges(connection: Any) -> List[Any]:
+    if not connection:
+        return []
+    return [x for x in connection["edges"] if x is not None]
+
+
+def build(rstate: schema.Rstate) -> Dict[str, Any]:
+    """Compute the indexes of a remote state."""
+    users = rstate["data"]["users"]
+    repos = schema.org_repositories(rstate)
+    teams = schema.org_teams(rstate)
+    result = {
+        "records": {k: cache_format.pack(v) for k, v in users.items()},
+        "names": {k: schema.user_login(v) for k, v in users.items()},
+        "repository_ids": {},
+        "team_ids": {},
+        "user_ids": {schema.user_login(v): k for k, v in users.items()},
+        "members": set(schema.org_member_ids(rstate)),
+        "user_teams": {},
+    }  # type: Dict[str, Any]
+    for repo in repos:
+        repo_id = repo["node"]["id"]
+        result["records"][repo_id] = cache_format.pack(repo)
+        result["names"][repo_id] = schema.repo_name(repo)
+        result["repository_ids"][schema.repo_name(repo)] = repo_id
+    for team in teams:
+        team_id = team["node"]["id"]
+        result["records"][team_id] = cache_format.pack(team)
+        result["names"][team_id] = schema.team_name(team)
+        result["team_ids"][schema.team_name(team)] = team_id
+        for edge in _edges(team["node"].get("members")):
+            _append(
+                result["user_teams"],
+                edge["node"]["id"],
+                [team_id, edge["role"]],
+            )
+    return result
+
+
+def dump(indexes: Indexes, cache_stamp: List[int], stream: IO[bytes]) -> None:
+    """Write indexes computed from the cache file identified by a stamp."""
+    cache_format.dump_sections(
+        [("stamp", cache_stamp), *indexes.items()], stream, MAGIC, VERSION
+    )
+
+
+def loads(raw: cache_format.Buffer) -> Indexes:
+    """Read indexes, each decoded on first access."""
+    return cache_format.load_sections(raw, MAGIC, VERSION)
+
+
+def _entity(indexes: Indexes, id_: Hashable) -> Any:
+    return cache_format.unpack(indexes["records"][id_])
+
+
+def _reduced(
+    users: Mapping[schema.UserID, Any],
+    members: List[schema.UserID],
+    repos: List[Any],
+    teams: List[Any],
+) -> schema.Rstate:
+    return {
+        "data": {
+            "users": dict(users),
+            "organization": {
+                "repositories": {"edges": repos},
+                "membersWithRole": members,
+                "teams": {"edges": teams},
+            },
+        }
+    }
+
+
+def repository_state(indexes: Indexes, name: str) -> schema.Rstate:
+    """Return the part of the remote state describing one repository.
+
+    The reduced remote state contains the repository and its collaborators.
+    """
+    repo_id = indexes["repository_ids"].get(name)
+    if repo_id is None:
+        return _reduced({}, [], [], [])
+    repo = _entity(indexes, repo_id)
+    return _reduced(
+        {
+            x["node"]["id"]: _entity(indexes, x["node"]["id"])
+            for x in _edges(repo["node"].get("collaborators"))
+        },
+        [],
+        [repo],
+        [],
+    )
+
+
+def user_state(indexes: Indexes, login: str) -> schema.Rstate:
+    """Return the part of the remote state describing one user.
+
+    The reduced remote state contains the user, and the teams the user is a
+    member of. Other members of these teams are left out.
+    """
+    user_id = indexes["user_ids"].get(login)
+    if user_id is None:
+        return _reduced({}, [], [], [])
+    teams = []
+    for team_id, role in indexes["user_teams"].get(user_id, []):
+        team = _entity(indexes, team_id)
+        node = {
+            **team["node"],
+            "members": {"edges": [{"role": role, "node": {"id": user_id}}]},
+        }
+        teams.append({**team, "node": node})
+    return _reduced(
+        {user_id: _entity(indexes, user_id)},
+        [user_id] if user_id in indexes["members"] else [],
+        [],
+        teams,
+    )
+
+
+def team_state(indexes: Indexes, name: str) -> schema.Rstate:
+    """Return the part of the remote state describing one team.
+
+    The reduced remote state contains the team, its repositories, its
+    members and its children teams.
+    """
+    team_id = indexes["team_ids"].get(name)
+    if team_id is None:
+        return _reduced({}, [], [], [])
+    team = _entity(indexes, team_id)
+    node = team["node"]
+    children = [
+        _entity(indexes, x["node"]["id"])
+        for x in _edges(node.get("childTeams"))
+        if x["node"]["id"] != team_id
+    ]
+    return _reduced(
+        {
+            x["node"]["id"]: _entity(indexes, x["node"]["id"])
+            for x in _edges(node.get("members"))
+        },
+        [],
+        [
+            _entity(indexes, x["node"]["id"])
+            for x in _edges(node.get("repositories"))
+        ],
+        [team, *children],
+    )
@@ -0,0 +1,243 @@
+"""Cost estimation of a cache refresh.
+
+The planner simulates the schedule of the sub-queries sent by a cache refresh
+without network access. The shape of the organisation (entities, and the size
+of their connections) is taken from a previous remote state, and the batch
+and page sizes are the ones used by the synchronisation.
+"""
+
+from __future__ import annotations
+
+import functools
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Sequence
+
+from ghaudit import cache, schema
+
+# number of connections requested by one page of each kind of sub-query,
+# used to compute the rate limit cost of a call. See the github
+# documentation on GraphQL resource limitations.
+CONNECTIONS = {
+    "teams": 1,
+    "members": 1,
+    "repositories": 1,
+    "team repositories": 2,
+    "team members": 1,
+    "team children": 2,
+    "repository collaborators": 1,
+    "repository branch protection rules": 1,
+    "branch protection push allowances": 1,
+    "user": 0,
+}  # type: Mapping[str, int]
+
+
+class Settings(NamedTuple):
+    max_parallel: int
+    page_sizes: Mapping[str, int]
+
+
+class Estimate(NamedTuple):
+    requests: int
+    queries: int
+    points: int
+    peak_queue: int
+
+
+def default_settings() -> Settings:
+    """Return the batch and page sizes used by a cache refresh."""
+    return Settings(
+        max_parallel=cache.MAX_PARALLEL_QUERIES,
+        page_sizes={
+            "teams": cache.ORG_TEAMS_MAX,
+            "members": cache.ORG_MEMBERS_MAX,
+            "repositories": cache.ORG_REPOSITORIES_MAX,
+            "team repositories": cache.TEAM_REPOSITORIES_MAX,
+            "team members": cache.TEAM_MEMBERS_MAX,
+            "team children": cache.TEAM_CHILDREN_MAX,
+            "repository collaborators": cache.REPO_COLLABORATORS_MAX,
+            "repository branch protection rules": (
+                cache.REPO_BRANCH_PROTECTION_MAX
+            ),
+            "branch protection push allowances": (
+                cache.BRANCH_PROTECTION_PUSH_ALLOWANCES_MAX
+            ),
+            "user": 1,
+        },
+    )
+
+
+def points(kinds: Sequence[str]) -> int:
+    """Return the rate limit cost of a call made of the given sub-queries."""
+    return max(1, round(sum(CONNECTIONS[x] for x in kinds) / 100))
+
+
+class _SimQuery:
+    """Simulated sub-query, paginating through a known list of items."""
+
+    def __init__(
+        self,
+        kind: str,
+        items: Sequence[Any],
+        on_page: Callable[[Sequence[Any]], None] | None = None,
+    ) -> None:
+        self.kind = kind
+        self._items = items
+        self._on_page = on_page
+        self._cursor = 0
+
+    def fetch(self, page_size: int) -> bool:
+        """Simulate the next page. Return whether the sub-query is done."""
+        page = self._items[self._cursor : self._cursor + page_size]
+        self._cursor += page_size
+        if self._on_page:
+            self._on_page(page)
+        return self._cursor >= len(self._items)
+
+
+class _Simulation:
+    """Replica of the synchronisation loop of cache._sync.
+
+    Sub-queries are scheduled the same way as CompoundQuery does: at most
+    `max_parallel' of them are active in one call, the others are queued and
+    dequeued in last in, first out order.
+    """
+
+    def __init__(self, rstate: schema.Rstate, settings: Settings) -> None:
+        self._settings = settings
+        self._active = []  # type: List[_SimQuery]
+        self._queue = []  # type: List[_SimQuery]
+        self._peak_queue = 0
+        self._queries = 0
+        self._known_users = set()  # type: set
+        self._found_users = set()  # type: set
+        self._new = {
+            "teams": [],
+            "repositories": [],
+            "collaborators": [],
+            "bprules": [],
+        }  # type: Dict[str, List[Any]]
+        self._rstate = rstate
+
+    def _append(self, query: _SimQuery) -> None:
+        self._queries += 1
+        if len(self._active) >= self._settings.max_parallel:
+            self._queue.append(query)
+            self._peak_queue = max(self._peak_queue, len(self._queue))
+        else:
+            self._active.append(query)
+
+    def _discover(self, key: str) -> Callable[[Sequence[Any]], None]:
+        return self._new[key].extend
+
+    def _team_queries(self, team: schema.Team) -> List[_SimQuery]:
+        def edges(name: str) -> List[Any]:
+            connection = team["node"].get(name)  # type: Any
+            return connection["edges"] if connection else []
+
+        return [
+            _SimQuery("team repositories", edges("repositories")),
+            _SimQuery("team members", edges("members")),
+            _SimQuery("team children", edges("childTeams")),
+        ]
+
+    def _repo_queries(self, repo: schema.Repo) -> List[_SimQuery]:
+        collaborators = repo["node"].get("collaborators")
+        edges = collaborators["edges"] if collaborators else []
+        rules = repo["node"].get("branchProtectionRules")  # type: ignore
+        return [
+            _SimQuery(
+                "repository collaborators",
+                [x["node"]["id"] for x in edges if x],
+                self._discover("collaborators"),
+            ),
+            _SimQuery(
+                "repository branch protection rules",
+                rules["nodes"] if rules else [],
+                self._discover("bprules"),
+            ),
+        ]
+
+    def _rule_query(self, rule: schema.BranchProtectionRuleNode) -> _SimQuery:
+        # count distinct actors, in case allowances were merged more than once
+        actors = {
+            schema.push_allowance_actor(x)["id"]
+            for x in rule.get("pushAllowances", [])
+        }
+        return _SimQuery("branch protection push allowances", list(actors))
+
+    def _flush_discoveries(self) -> None:
+        for team in self._new["teams"]:
+            for query in self._team_queries(team):
+                self._append(query)
+        for repo in self._new["repositories"]:
+            for query in self._repo_queries(repo):
+                self._append(query)
+        for user_id in self._new["collaborators"]:
+            if user_id in self._known_users or user_id in self._found_users:
+                continue
+            self._found_users.add(user_id)
+            self._append(
+                _SimQuery("user", [], functools.partial(self._known, user_id))
+            )
+        for rule in self._new["bprules"]:
+            self._append(self._rule_query(rule))
+        for value in self._new.values():
+            value.clear()
+
+    def _known(self, user_id: Any, page: Sequence[Any] = ()) -> None:
+        del page
+        self._known_users.add(user_id)
+
+    def run(self) -> Estimate:
+        """Simulate the synchronisation until all the sub-queries are done."""
+        self._append(
+            _SimQuery(
+                "teams",
+                schema.org_teams(self._rstate),
+                self._discover("teams"),
+            )
+        )
+        self._append(
+            _SimQuery(
+                "members",
+                schema.org_member_ids(self._rstate),
+                self._known_users.update,
+            )
+        )
+        self._append(
+            _SimQuery(
+                "repositories",
+                schema.org_repositories(self._rstate),
+                self._discover("repositories"),
+            )
+        )
+        requests = 0
+        total_points = 0
+        while self._active or self._queue:
+            while (
+                self._queue and len(self._active) < self._settings.max_parallel
+            ):
+                self._active.append(self._queue.pop())
+            requests += 1
+            total_points += points([x.kind for x in self._active])
+            self._active = [
+                x
+                for x in self._active
+                if not x.fetch(self._settings.page_sizes[x.kind])
+            ]
+            self._flush_discoveries()
+        return Estimate(
+            requests=requests,
+            queries=self._queries,
+            points=total_points,
+            peak_queue=self._peak_queue,
+        )
+
+
+def estimate(
+    rstate: schema.Rstate, settings: Settings | None = None
+) -> Estimate:
+    """Estimate the cost of refreshing the given remote state.
+
+    By default, the batch and page sizes of the cache refresh are used.
+    """
+    return _Simulation(rstate, settings or default_settings()).run()
@@ -0,0 +1,61 @@
+"""CPU and memory profiling of ghaudit commands."""
+
+from __future__ import annotations
+
+import cProfile
+import pstats
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, TextIO
+
+
+@contextmanager
+def cpu_profile(
+    path: Path, top: int, output: TextIO = sys.stderr
+) -> Iterator[cProfile.Profile]:
+    """Profile the CPU usage of the enclosed code with cProfile.
+
+    The statistics are written to `path' in the pstats format, and the `top'
+    entries sorted by cumulative time are printed to `output'.
+    """
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        stats = pstats.Stats(profile, stream=output)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+
+
+@contextmanager
+def memory_profile(top: int, output: TextIO = sys.stderr) -> Iterator[None]:
+    """Trace the memory allocations of the enclosed code with tracemalloc.
+
+    The peak of traced memory and the `top' allocation sites still holding
+    memory at the end are printed to `output'.
+    """
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            "peak traced memory: {:.1f} KiB".format(peak / 1024), file=output
+        )
+        print("top {} allocation sites:".format(top), file=output)
+        snapshot = snapshot.filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, pstats.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ]
+        )
+        for stat in snapshot.statistics("lineno")[:top]:
+            print("  {}".format(stat), file=output)
@@ -35,3 +35,9 @@ class BranchProtectionPushAllowances(SubQueryCommon):
         return SubQueryCommon.render(
             self, {**args, "num": self._num, "bp_id": self._bp_id}
         )
+
+    def root(self) -> str:
+        return "branch_protection{}".format(self._num)
+
+    def entity(self) -> str:
+        return self._bp_id
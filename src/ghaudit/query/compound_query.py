@@ -1,15 +1,21 @@
+from __future__ import annotations
+
 import functools
 import json
 import logging
-from typing import Any, List, Mapping, Set, TypedDict
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Set, TypedDict
 
 import requests
 
-from ghaudit import utils
+from ghaudit import tracing, utils
 from ghaudit.auth import AuthDriver
 from ghaudit.query.sub_query import SubQuery, ValidValueType
 from ghaudit.query.utils import jinja_env, page_info_continue
 
+if TYPE_CHECKING:
+    from ghaudit.telemetry import Telemetry
+
 
 class Stats(TypedDict):
     iterations: int
@@ -18,17 +24,28 @@ class Stats(TypedDict):
 
 
 class CompoundQuery:
-    def __init__(self, max_parallel: int) -> None:
+    def __init__(
+        self,
+        max_parallel: int,
+        transport: utils.Transport = utils.github_graphql_call,
+        telemetry: Telemetry | None = None,
+    ) -> None:
         self._sub_queries = []  # type: List[SubQuery]
         self._common_frags = []  # type: List[str]
         self._max_parallel = max_parallel
         self._queue = []  # type: List[SubQuery]
+        self._done = []  # type: List[SubQuery]
         self._stats = {
             "iterations": 0,
             "queries": 0,
             "done": 0,
         }  # type: Stats
         self._session = requests.session()
+        self._transport = transport
+        self._telemetry = telemetry
+        self._queued_at = {}  # type: Dict[SubQuery, float]
+        self._render_sizes = []  # type: List[int]
+        self._rate_limit = None  # type: Mapping[str, Any] | None
         self._render_entry_point = jinja_env().get_template(
             "compound_query.j2"
         )
@@ -38,11 +55,19 @@ class CompoundQuery:
         return len(self._sub_queries) >= self._max_parallel
 
     def _append(self, sub_query: SubQuery) -> None:
+        if self._telemetry:
+            self._telemetry.queued(
+                sub_query, time.perf_counter() - self._queued_at.pop(sub_query)
+            )
         self._sub_queries.append(sub_query)
 
     def append(self, sub_query: SubQuery) -> None:
         self._stats["queries"] += 1
+        if self._telemetry:
+            self._telemetry.appended(sub_query)
         if self._parallel_wait():
+            if self._telemetry:
+                self._queued_at[sub_query] = time.perf_counter()
             self._queue.append(sub_query)
         else:
             self._sub_queries.append(sub_query)
@@ -80,13 +105,12 @@ class CompoundQuery:
         main_frag = self._render_entry_point.render(
             {"params": params, "fragments": fragments}
         )
-        sub_renders = "".join(
-            [
-                x.render({"page_infos": x.get_page_info()})
-                for x in self._sub_queries
-            ]
-        )
-        return common_fragments + sub_renders + main_frag
+        sub_renders = [
+            x.render({"page_infos": x.get_page_info()})
+            for x in self._sub_queries
+        ]
+        self._render_sizes = [len(x) for x in sub_renders]
+        return common_fragments + "".join(sub_renders) + main_frag
 
     def _dequeue(self) -> None:
         while self._queue and not self._parallel_wait():
@@ -100,20 +124,32 @@ class CompoundQuery:
 
         self._dequeue()
         self._verify_params(args)
-        rendered = self.render()
+        render_start = time.process_time()
+        with tracing.span("query.render", sub_queries=len(self._sub_queries)):
+            rendered = self.render()
+        render_cpu = time.process_time() - render_start
 
         for sub_query in self._sub_queries:
             args = {**sub_query.params_values(), **args}
         self._stats["iterations"] += 1
-        result = utils.github_graphql_call(
-            rendered, auth_driver, args, self._session
-        )
+        call_start = time.perf_counter()
+        with tracing.span("http call", request_bytes=len(rendered)) as span:
+            result = self._transport(
+                rendered, auth_driver, args, self._session
+            )
+            span.set("rate_limit", (result.get("data") or {}).get("rateLimit"))
+        latency = time.perf_counter() - call_start
 
         to_remove = []
         if "data" not in result:
             raise RuntimeError(
                 'Invalid response from github: "{}"'.format(json.dumps(result))
             )
+        data = dict(result["data"])
+        self._rate_limit = data.pop("rateLimit", None)
+        result = {**result, "data": data}
+        if self._telemetry:
+            self._report_request(rendered, args, result, latency, render_cpu)
 
         logging.debug("response: %s", utils.LazyJsonFmt(result))
 
@@ -121,11 +157,43 @@ class CompoundQuery:
             sub_query.update_page_info(result["data"])
             if not page_info_continue(sub_query.get_page_info()):
                 to_remove.append(sub_query)
+        self._done = to_remove
         for value in to_remove:
             self._sub_queries.remove(value)
             self._stats["done"] += 1
+            if self._telemetry:
+                self._telemetry.done(value)
         return result
 
+    def _report_request(
+        self,
+        rendered: str,
+        args: Mapping[str, ValidValueType],
+        result: Mapping[str, Any],
+        latency: float,
+        render_cpu: float,
+    ) -> None:
+        if self._telemetry is None:
+            return
+        body = {"query": rendered, "variables": json.dumps(args)}
+        self._telemetry.request(
+            self._sub_queries,
+            len(json.dumps(body)),
+            self._render_sizes,
+            {k: len(json.dumps(v)) for k, v in result["data"].items()},
+            latency,
+            self._rate_limit["cost"] if self._rate_limit else None,
+            render_cpu,
+        )
+
+    def rate_limit(self) -> Mapping[str, Any] | None:
+        """Return the rate limit status reported by the last call."""
+        return self._rate_limit
+
+    def done(self) -> List[SubQuery]:
+        """Return the sub-queries finished by the last call to run."""
+        return self._done
+
     def finished(self) -> bool:
         return not self._sub_queries and not self._queue
 
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Mapping, Set
+
+from ghaudit.query.sub_query import SubQuery, ValidValueType
+from ghaudit.query.utils import PageInfo
+
+# string literals are matched first, to be left as they are
+_TOKEN_RE = re.compile(
+    r'"(?:[^"\\]|\\.)*"'
+    r"|\$(?P<variable>\w+)"
+    r"|(?P<keyword>fragment |\.\.\.)(?P<fragment>\w+)"
+    r"|^(?P<indent>\s*)(?P<alias>\w+)(?P<colon>\s*:)",
+    re.MULTILINE,
+)
+
+
+class NamespacedQuery(SubQuery):
+    """Sub-query renamed apart from the sub-queries of other organisations.
+
+    The fragments, the response alias and the variables of `sub_query' are
+    prefixed with `prefix', so that sub-queries about several organisations
+    share a compound query. `values' are the values of the variables shared
+    by the sub-queries of an organisation, e.g. its name.
+    """
+
+    def __init__(
+        self,
+        sub_query: SubQuery,
+        prefix: str,
+        values: Mapping[str, ValidValueType],
+    ) -> None:
+        SubQuery.__init__(self)
+        self._sub_query = sub_query
+        self._prefix = prefix
+        self._shared = values
+
+    def sub_query(self) -> SubQuery:
+        """Return the sub-query renamed."""
+        return self._sub_query
+
+    def prefix(self) -> str:
+        """Return the prefix of the names of the sub-query."""
+        return self._prefix
+
+    def render(self, args: Mapping[str, ValidValueType]) -> str:
+        rendered = self._sub_query.render(args)
+        fragments = {
+            x.group("fragment")
+            for x in _TOKEN_RE.finditer(rendered)
+            if x.group("keyword") == "fragment "
+        }  # type: Set[str]
+        root = self._sub_query.root()
+
+        def rename(match: Any) -> str:
+            if match.group("variable"):
+                return "$" + self._prefix + match.group("variable")
+            if match.group("fragment") in fragments:
+                return (
+                    match.group("keyword")
+                    + self._prefix
+                    + match.group("fragment")
+                )
+            if match.group("alias") == root:
+                return "{}{}{}{}".format(
+                    match.group("indent"),
+                    self._prefix,
+                    root,
+                    match.group("colon"),
+                )
+            return match.group(0)
+
+        return _TOKEN_RE.sub(rename, rendered)
+
+    def entry(self) -> str:
+        return self._prefix + self._sub_query.entry()
+
+    def params(self) -> Mapping[str, str]:
+        return {
+            self._prefix + k: v for k, v in self._sub_query.params().items()
+        }
+
+    def get_page_info(self) -> PageInfo | None:
+        return self._sub_query.get_page_info()
+
+    def update_page_info(self, response: Mapping[str, Any]) -> None:
+        self._sub_query.update_page_info(
+            {
+                k[len(self._prefix) :]: v
+                for k, v in response.items()
+                if k.startswith(self._prefix)
+            }
+        )
+
+    def params_values(self) -> Mapping[str, ValidValueType]:
+        declared = self._sub_query.params()
+        values = {
+            **{k: v for k, v in self._shared.items() if k in declared},
+            **self._sub_query.params_values(),
+        }
+        return {self._prefix + k: v for k, v in values.items()}
+
+    def __repr__(self) -> str:
+        return "{}{}".format(self._prefix, repr(self._sub_query))
+
+    def root(self) -> str:
+        return self._prefix + self._sub_query.root()
+
+    def entity(self) -> str:
+        return self._sub_query.entity()
+
+    def pages(self) -> int:
+        return self._sub_query.pages()
@@ -27,3 +27,6 @@ class OrgMembersQuery(SubQueryCommon):
                 "endCursor"
             ]
             self._count += 1
+
+    def root(self) -> str:
+        return "root"
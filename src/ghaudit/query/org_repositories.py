@@ -25,3 +25,6 @@ class OrgRepoQuery(SubQueryCommon):
             ]  # type: PageInfo
             self._values["repositoriesCursor"] = self._page_info["endCursor"]
             self._count += 1
+
+    def root(self) -> str:
+        return "root"
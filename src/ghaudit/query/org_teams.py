@@ -29,3 +29,6 @@ class OrgTeamsQuery(SubQueryCommon):
             ]  # type: PageInfo
             self._values["teamsCursor"] = self._page_info["endCursor"]
             self._count += 1
+
+    def root(self) -> str:
+        return "root"
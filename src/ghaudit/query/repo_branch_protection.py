@@ -44,3 +44,9 @@ class RepoBranchProtectionQuery(SubQueryCommon):
             self,
             {**args, "num": self._num, "repository": self._repository},
         )
+
+    def root(self) -> str:
+        return "repo{}".format(self._num)
+
+    def entity(self) -> str:
+        return self._repository
@@ -45,3 +45,9 @@ class RepoCollaboratorQuery(SubQueryCommon):
         return "{}({}, {}): {}".format(
             self._entry, self._count, self._repository, repr(self._page_info)
         )
+
+    def root(self) -> str:
+        return "repo{}".format(self._num)
+
+    def entity(self) -> str:
+        return self._repository
@@ -29,3 +29,15 @@ class SubQuery:
 
     def params_values(self) -> Mapping[str, ValidValueType]:
         raise NotImplementedError("abstract function call")
+
+    def root(self) -> str:
+        """Return the key of the response data answering the sub-query."""
+        raise NotImplementedError("abstract function call")
+
+    def entity(self) -> str:
+        """Return the name of the entity the sub-query is about, if any."""
+        return ""
+
+    def pages(self) -> int:
+        """Return the number of pages received so far."""
+        return self._count
@@ -42,3 +42,9 @@ class TeamRepoQuery(SubQueryCommon):
         return "{}({}, {}): {}".format(
             self._entry, self._count, self._team, repr(self._page_info)
         )
+
+    def root(self) -> str:
+        return "team{}".format(self._num)
+
+    def entity(self) -> str:
+        return self._team
@@ -20,3 +20,9 @@ class UserQuery(SubQueryCommon):
         return SubQueryCommon.render(
             self, {**args, "login": self._login, "num": self._num}
         )
+
+    def root(self) -> str:
+        return "user{}".format(self._num)
+
+    def entity(self) -> str:
+        return self._login
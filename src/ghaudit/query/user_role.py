@@ -40,3 +40,9 @@ class TeamMemberQuery(SubQueryCommon):
         return "{}({}, {}): {}".format(
             self._entry, self._count, self._team, repr(self._page_info)
         )
+
+    def root(self) -> str:
+        return "team{}".format(self._num)
+
+    def entity(self) -> str:
+        return self._team
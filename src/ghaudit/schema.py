@@ -18,6 +18,8 @@ from typing import (
     cast,
 )
 
+from ghaudit import tracing
+
 TeamRole = Literal["MEMBER", "MAINTAINER"]
 OrgRole = Literal["MEMBER", "ADMIN"]
 Perm = Literal["READ", "WRITE", "ADMIN"]
@@ -309,6 +311,11 @@ def org_members(rstate: Rstate) -> List[UserWithOrgRole]:
     ]
 
 
+def org_member_ids(rstate: Rstate) -> List[UserID]:
+    """Return the list of user IDs of the members of the organisation."""
+    return _get_org_members(rstate)
+
+
 def org_team_by_id(rstate: Rstate, team_id: TeamID) -> Team:
     """Return a team from the organisation identified by ID."""
     return _get_unique_x_by_y(rstate, _get_org_teams, "id", team_id)
@@ -730,6 +737,7 @@ def merge_members(old_value, new_value):
     raise NotImplementedError("not implemented")
 
 
+@tracing.traced("schema.merge")
 def merge(rstate, alias, new_data):
     funcs = {
         "teams": {
@@ -767,21 +775,19 @@ def merge(rstate, alias, new_data):
                     rstate["data"]["organization"][key]["edges"] = new_list
                 else:
                     funcs[key]["create"](rstate, item)
-        if "pushAllowances" in new_data["data"]["organization"]:
-            for item in new_data["data"]["organization"]["pushAllowances"][
-                "nodes"
-            ]:
-                repo = org_repo_by_id(
-                    rstate, item["branchProtectionRule"]["repository"]["id"]
-                )
-                edges = rstate["data"]["organization"]["repositories"]["edges"]
-                new_list = [
-                    x for x in edges if x["node"]["id"] != repo["node"]["id"]
-                ]
-                new_list.append(merge_repo_branch_protection(repo, item))
-                rstate["data"]["organization"]["repositories"][
-                    "edges"
-                ] = new_list
+    if "pushAllowances" in new_data["data"]["organization"]:
+        for item in new_data["data"]["organization"]["pushAllowances"][
+            "nodes"
+        ]:
+            repo = org_repo_by_id(
+                rstate, item["branchProtectionRule"]["repository"]["id"]
+            )
+            edges = rstate["data"]["organization"]["repositories"]["edges"]
+            new_list = [
+                x for x in edges if x["node"]["id"] != repo["node"]["id"]
+            ]
+            new_list.append(merge_repo_branch_protection(repo, item))
+            rstate["data"]["organization"]["repositories"]["edges"] = new_list
     if "repository" in new_data["data"]["organization"]:
         repo = new_data["data"]["organization"]["repository"]
         edges = rstate["data"]["organization"]["repositories"]["edges"]
@@ -807,13 +813,15 @@ def missing_collaborators(rstate: Rstate, repo: Repo) -> List[str]:
     return missing
 
 
-def _missing_repositories(rstate: Rstate, team: Team) -> List[Hashable]:
+def _missing_repositories(
+    repo_ids: Collection[RepoID], team: Team
+) -> List[Hashable]:
     missing = []  # type: list[Hashable]
     if "repositories" in team["node"] and team["node"]["repositories"]:
         edges = team["node"]["repositories"]["edges"]
         for edge in [x for x in edges if x is not None]:
             repo_id = edge["node"]["id"]
-            if not org_repo_by_id(rstate, repo_id):
+            if repo_id not in repo_ids:
                 missing.append(repo_id)
     return missing
 
@@ -829,6 +837,12 @@ def _missing_members(rstate: Rstate, team: Team) -> List[Hashable]:
     return missing
 
 
+# version of the checks made by `validate', to increase when they change, so
+# that cache files validated by previous versions are validated again
+VALIDATION_VERSION = 1
+
+
+@tracing.traced("schema.validate")
 def validate(rstate: Rstate) -> bool:
     """Validate the consistency of the remote state data structure.
 
@@ -848,8 +862,9 @@ def validate(rstate: Rstate) -> bool:
                     repo_name(repo),
                 )
             )
+    repo_ids = {x["node"]["id"] for x in org_repositories(rstate)}
     for team in org_teams(rstate):
-        for missing_id in _missing_repositories(rstate, team):
+        for missing_id in _missing_repositories(repo_ids, team):
             msg = 'unknown repositories referenced by ID "{}" in team "{}"'
             raise RuntimeError(
                 msg.format(
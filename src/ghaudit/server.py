@@ -0,0 +1,258 @@
+"""Resident ghaudit process answering commands over a Unix socket.
+
+`ghaudit serve' keeps the remote state, the organisation configuration, the
+user map and the policy in memory, and runs the commands forwarded by the
+ghaudit CLI (see `forward'), so that they do not pay for the interpreter
+startup, the parsing of the configuration files and the loading of the cache
+each time. Each of them is reloaded when one of the files it is read from
+changes.
+
+The protocol is one JSON line per connection in each direction: the client
+sends {"args": ARGS, "files": FILES}, the command line arguments and the
+files the command would read (see `files'), and the server answers
+{"status": STATUS, "stdout": STDOUT, "stderr": STDERR}, or {"refused":
+REASON} when it reads other files. Commands are run one at a time.
+
+Only the commands in `FORWARDED' are forwarded, and only when no option
+precedes them, since the client sends the default files. The client side
+only imports the standard library, so that forwarding does not pay for the
+imports of the rest of ghaudit.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import traceback
+from os import environ, stat
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    List,
+    Mapping,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+if TYPE_CHECKING:
+    import click
+
+# commands reading the cache and the configuration only
+FORWARDED = ("compliance", "config", "org", "stats", "user", "usermap")
+
+# seconds to wait for the server to accept a connection and the command
+CONNECT_TIMEOUT = 1.0
+
+_T = TypeVar("_T")
+Stamp = Tuple[Tuple[int, int, int], ...]
+
+
+def socket_path() -> Path:
+    """Return the path of the socket of the server.
+
+    It is in $XDG_RUNTIME_DIR when set, and in the directory of the cache
+    otherwise (see ghaudit.cache.file_path, not imported here).
+    """
+    runtime_dir = environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "ghaudit.sock"
+    data_dir = _home_dir("XDG_DATA_HOME", ".local/share") / "compliance"
+    return data_dir / "ghaudit.sock"
+
+
+def _home_dir(variable: str, default: str) -> Path:
+    if environ.get(variable):
+        return Path(environ[variable]) / "ghaudit"
+    if environ.get("HOME"):
+        return Path(environ["HOME"]) / default / "ghaudit"
+    return Path("/") / "ghaudit"
+
+
+def files(
+    config: Path, usermap: Path, policy: Path, cache: Path
+) -> Dict[str, str]:
+    """Return the files read by the commands, to compare them.
+
+    `cache' is the directory of the cache.
+    """
+    return {
+        "config": str(config.resolve()),
+        "usermap": str(usermap.resolve()),
+        "policy": str(policy.resolve()),
+        "cache": str(cache.resolve()),
+    }
+
+
+def default_files() -> Dict[str, str]:
+    """Return the files read by the commands run without options.
+
+    See ghaudit.config.default_dir and ghaudit.cache.data_dir, not imported
+    here.
+    """
+    config_dir = _home_dir("XDG_CONFIG_HOME", ".config")
+    return files(
+        config_dir / "organisation.yml",
+        config_dir / "user map.yml",
+        config_dir / "policy.yml",
+        _home_dir("XDG_DATA_HOME", ".local/share") / "compliance",
+    )
+
+
+def _stamp(paths: Sequence[Path]) -> Stamp:
+    def file_stamp(path_: Path) -> Tuple[int, int, int]:
+        try:
+            stat_ = stat(path_)
+        except FileNotFoundError:
+            return (0, 0, 0)
+        return (stat_.st_ino, stat_.st_size, stat_.st_mtime_ns)
+
+    return tuple(file_stamp(x) for x in paths)
+
+
+class Resident(Generic[_T]):  # pylint: disable=too-few-public-methods
+    """Value loaded from files, and loaded again when one of them changes."""
+
+    def __init__(
+        self, paths: Callable[[], Sequence[Path]], load: Callable[[], _T]
+    ) -> None:
+        self._paths = paths
+        self._load = load
+        self._stamp = None  # type: Stamp | None
+        self._value = None  # type: _T | None
+
+    def __call__(self) -> _T:
+        stamp = _stamp(self._paths())
+        if stamp != self._stamp or self._value is None:
+            logging.info("loading %s", ", ".join(map(str, self._paths())))
+            self._value = self._load()
+            self._stamp = stamp
+        return self._value
+
+
+def _run(
+    command: click.Command, args: List[str], obj: Dict[str, Any]
+) -> Tuple[int, str, str]:
+    """Run a command with `args', capturing its output."""
+    import click  # pylint: disable=import-outside-toplevel
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(
+        stderr
+    ):
+        try:
+            status = command.main(
+                args, "ghaudit", obj=obj, standalone_mode=False
+            )
+            status = status if isinstance(status, int) else 0
+        except click.ClickException as exc:
+            exc.show()
+            status = exc.exit_code
+        except click.Abort:
+            print("Aborted!", file=stderr)
+            status = 1
+        except Exception:  # pylint: disable=broad-except
+            traceback.print_exc(file=stderr)
+            status = 1
+    return status, stdout.getvalue(), stderr.getvalue()
+
+
+def _handler(
+    command: click.Command,
+    obj: Callable[[], Dict[str, Any]],
+    files_: Mapping[str, str],
+) -> type:
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            request = json.loads(self.rfile.readline())
+            if request.get("files") != files_:
+                answer = {
+                    "refused": "the server reads {}".format(
+                        json.dumps(files_, sort_keys=True)
+                    )
+                }  # type: Dict[str, Any]
+            else:
+                status, stdout, stderr = _run(command, request["args"], obj())
+                answer = {"status": status, "stdout": stdout, "stderr": stderr}
+            self.wfile.write(json.dumps(answer).encode("UTF-8") + b"\n")
+
+    return Handler
+
+
+def server(
+    path_: Path,
+    command: click.Command,
+    obj: Callable[[], Dict[str, Any]],
+    files_: Mapping[str, str],
+) -> socketserver.UnixStreamServer:
+    """Return a server running `command' with the context objects `obj'.
+
+    Only the commands reading the same `files_' are run (see `files'). A
+    socket left over by a previous server is replaced. The socket is only
+    accessible to the current user.
+    """
+    path_.parent.mkdir(parents=True, exist_ok=True)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path_)
+    umask = os.umask(0o077)
+    try:
+        return socketserver.UnixStreamServer(
+            str(path_), _handler(command, obj, files_)
+        )
+    finally:
+        os.umask(umask)
+
+
+def forward(
+    args: List[str], path_: Path | None = None
+) -> Tuple[int, str, str] | None:
+    """Run a command in the server, if it is running and `args' allow it.
+
+    Return the status and the output of the command, or None if it must run
+    locally: the server is not running, or reads other files than the
+    command would. A socket which does not belong to the current user is
+    ignored.
+
+    :raises: RuntimeError if the server does not answer the command sent.
+    """
+    if not args or args[0] not in FORWARDED:
+        return None
+    path_ = path_ or socket_path()
+    try:
+        if stat(path_).st_uid != os.getuid():
+            return None
+    except FileNotFoundError:
+        return None
+    request = {"args": args, "files": default_files()}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(CONNECT_TIMEOUT)
+        try:
+            client.connect(str(path_))
+            client.sendall(json.dumps(request).encode("UTF-8") + b"\n")
+        except OSError:
+            # the server is not running
+            return None
+        # the command may run for long, and must not run twice
+        client.settimeout(None)
+        try:
+            with client.makefile("rb") as stream:
+                response = json.loads(stream.readline())
+            if "refused" in response:
+                logging.info("running locally: %s", response["refused"])
+                return None
+            return response["status"], response["stdout"], response["stderr"]
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            raise RuntimeError(
+                "the ghaudit server at {} did not answer: {}".format(
+                    path_, " ".join(args)
+                )
+            ) from exc
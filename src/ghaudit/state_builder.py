@@ -0,0 +1,321 @@
+"""Bulk construction of the remote state of a synchronisation.
+
+By default, each response of a synchronisation is merged in the remote state
+as it arrives (see ghaudit.schema.merge), which looks up and rebuilds edge
+lists for every page, and the entities to request next are found by scanning
+the whole remote state after each round trip.
+
+The builder appends the pages of each entity to buffers instead, and
+assembles the remote state in one pass once the synchronisation is over.
+The entities found since the previous round trip are kept aside, so that
+discovery only looks at them.
+
+Given a spill directory, the builder also bounds the memory used by the
+synchronisation: a repository or a team is written to a file of the
+directory as soon as the last sub-query about it is finished (see
+`Builder.finished'), and forgotten. The remote state built then reads them
+back from the files one at a time when iterated, so that the cache can be
+stored as a stream (see ghaudit.cache_format.dump). Users and members stay
+in memory.
+"""
+
+from __future__ import annotations
+
+import functools
+import struct
+from pathlib import Path
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Set,
+    Tuple,
+)
+
+from ghaudit import cache_format, schema
+from ghaudit.cache_freshness import CONNECTIONS
+
+# size of an entity in a spill file
+_SIZE = struct.Struct(">I")
+
+
+class Discovered(NamedTuple):
+    # (name, slug) of the teams
+    teams: List[Tuple[str, str]]
+    repositories: List[str]
+    logins: List[str]
+    rules: List[str]
+
+
+class SpilledList(list):
+    """List of the entities written to a spill file, read on iteration.
+
+    The list itself holds nothing: indexing iterates the file. `complete'
+    is applied to each entity read.
+    """
+
+    def __init__(
+        self, path_: Path, count: int, complete: Callable[[Any], Any]
+    ) -> None:
+        super().__init__()
+        self._path = path_
+        self._count = count
+        self._complete = complete
+
+    def __iter__(self) -> Iterator[Any]:
+        with open(self._path, "rb") as spill:
+            for _ in range(self._count):
+                (size,) = _SIZE.unpack(spill.read(_SIZE.size))
+                yield self._complete(cache_format.unpack(spill.read(size)))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: Any) -> Any:
+        return list(self)[index]
+
+    def __eq__(self, other: object) -> bool:
+        return list(self) == other
+
+    def __ne__(self, other: object) -> bool:
+        return not self == other
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+class Builder:  # pylint: disable=too-many-instance-attributes
+    """Remote state buffered page by page.
+
+    With a `spill' directory, the complete repositories and teams are
+    written to it, see `finished'.
+    """
+
+    def __init__(self, spill: Path | None = None) -> None:
+        self._users = {}  # type: Dict[Any, Any]
+        self._members = []  # type: List[Any]
+        # edges of the repositories and teams by kind and ID, not spilled
+        self._entities = {
+            "repository": {},
+            "team": {},
+        }  # type: Dict[str, Dict[Any, Any]]
+        self._known = set()  # type: Set[Any]
+        # connection pages by repository or team ID, and push allowances by
+        # branch protection rule ID
+        self._connections = {}  # type: Dict[Any, Dict[str, List[Any]]]
+        self._allowances = {}  # type: Dict[Any, List[Any]]
+        self._rules = set()  # type: Set[str]
+        self._pending = Discovered([], [], [], [])
+        # (ID, login) of the collaborators found since the last discovery
+        self._collaborators = []  # type: List[Tuple[Any, str]]
+        self._spill = spill
+        self._files = {}  # type: Dict[str, IO[bytes]]
+        self._spilled = {"repository": 0, "team": 0}
+        # ID by kind and name, number of unfinished sub-queries by ID, and
+        # repository ID by branch protection rule ID, to spill entities
+        self._ids = {
+            "repository": {},
+            "team": {},
+            "team slug": {},
+        }  # type: Dict[str, Dict[str, Any]]
+        self._unfinished = {}  # type: Dict[Any, int]
+        self._rule_repositories = {}  # type: Dict[str, Any]
+
+    def counts(self) -> Mapping[str, int]:
+        """Return the number of entities received so far."""
+        return {
+            "teams": len(self._entities["team"]) + self._spilled["team"],
+            "repositories": len(self._entities["repository"])
+            + self._spilled["repository"],
+            "members": len(self._members),
+            "users": len(self._users),
+            "bprules": len(self._rules),
+        }
+
+    def _connection(self, id_: Any, name: str) -> List[Any]:
+        return self._connections.setdefault(id_, {}).setdefault(name, [])
+
+    def _track(self, kind: str, edge: Any) -> None:
+        node = edge["node"]
+        self._entities[kind][node["id"]] = edge
+        self._known.add(node["id"])
+        self._ids[kind][node["name"]] = node["id"]
+        self._unfinished[node["id"]] = len(CONNECTIONS[kind])
+
+    def _add_listing(self, key: str, edges: List[Any]) -> None:
+        # the connections of a team are requested through a listing too, with
+        # nodes holding only the ID besides the connection
+        for edge in edges:
+            node = edge["node"]
+            if key == "membersWithRole":
+                self._members.append(node["id"])
+                self._users[node.pop("id")] = edge
+            elif key == "repositories":
+                if node["id"] not in self._known:
+                    self._track("repository", edge)
+                    self._pending.repositories.append(node["name"])
+                self._add_repository(node)
+            elif key == "teams":
+                if node["id"] not in self._known and "slug" in node:
+                    self._track("team", edge)
+                    self._ids["team slug"][node["slug"]] = node["id"]
+                    self._pending.teams.append((node["name"], node["slug"]))
+                self._add_team(node)
+
+    def _add_repository(self, repo: Mapping[str, Any]) -> None:
+        if repo.get("collaborators"):
+            edges = [x for x in repo["collaborators"]["edges"] if x]
+            self._connection(repo["id"], "collaborators").extend(edges)
+            self._collaborators.extend(
+                (x["node"]["id"], x["node"]["login"]) for x in edges
+            )
+        if repo.get("branchProtectionRules"):
+            rules = [x for x in repo["branchProtectionRules"]["nodes"] if x]
+            self._connection(repo["id"], "branchProtectionRules").extend(rules)
+            for rule in rules:
+                rule_id = str(rule["id"])
+                if rule_id not in self._rules:
+                    self._rules.add(rule_id)
+                    self._pending.rules.append(rule_id)
+                    self._rule_repositories[rule_id] = repo["id"]
+                    if repo["id"] in self._unfinished:
+                        self._unfinished[repo["id"]] += 1
+
+    def _add_team(self, team: Mapping[str, Any]) -> None:
+        for name in CONNECTIONS["team"]:
+            if team.get(name):
+                self._connection(team["id"], name).extend(
+                    x for x in team[name]["edges"] if x
+                )
+
+    def add(self, alias: str, value: Any) -> None:
+        """Buffer the response of the sub-query of root `alias'."""
+        if alias.startswith("user"):
+            self._users[value.pop("id")] = {"node": value}
+            return
+        for key in ("repositories", "teams", "membersWithRole"):
+            if key in value:
+                self._add_listing(key, value[key]["edges"])
+        if "pushAllowances" in value:
+            for item in value["pushAllowances"]["nodes"]:
+                self._allowances.setdefault(
+                    item["branchProtectionRule"]["id"], []
+                ).append(item)
+        if "repository" in value:
+            self._add_repository(value["repository"])
+        if "team" in value:
+            self._add_team(value["team"])
+
+    def discover(self) -> Discovered:
+        """Return the entities found since the last call.
+
+        The collaborators are the ones not received as users yet.
+        """
+        logins = [
+            login
+            for id_, login in self._collaborators
+            if id_ not in self._users
+        ]
+        result = self._pending._replace(logins=logins)
+        self._pending = Discovered([], [], [], [])
+        self._collaborators = []
+        return result
+
+    def finished(self, sub_queries: Iterable[Tuple[str, str]]) -> None:
+        """Record that sub-queries are finished, spilling complete entities.
+
+        The sub-queries are given by the kind and the name of their entity:
+        `repository', `team' or `team slug' and a name, or `rule' and the
+        ID of a branch protection rule. The sub-queries of the entities
+        discovered must be queued. An entity is complete once the
+        sub-queries of its connections are finished, and those of the
+        push allowances of its rules.
+        """
+        for kind, name in sub_queries:
+            if kind == "rule":
+                id_ = self._rule_repositories.pop(name, None)
+            else:
+                id_ = self._ids[kind].get(name)
+            if id_ not in self._unfinished:
+                continue
+            self._unfinished[id_] -= 1
+            if not self._unfinished[id_]:
+                del self._unfinished[id_]
+                self._forget(id_)
+
+    def _forget(self, id_: Any) -> None:
+        kind = "repository" if id_ in self._entities["repository"] else "team"
+        node = self._entities[kind][id_]["node"]
+        del self._ids[kind][node["name"]]
+        if kind == "team":
+            del self._ids["team slug"][node["slug"]]
+        if self._spill:
+            self._write(kind, id_)
+
+    def _complete(self, kind: str, edge: Any) -> Any:
+        """Add the buffered connections to an entity, and forget them."""
+        node = edge["node"]
+        connections = self._connections.pop(node["id"], {})
+        for rule in connections.get("branchProtectionRules", []):
+            rule["pushAllowances"] = self._allowances.pop(rule["id"], [])
+        for name in CONNECTIONS[kind]:
+            key = "nodes" if name == "branchProtectionRules" else "edges"
+            node.setdefault(name, {key: []})[key].extend(
+                connections.get(name, [])
+            )
+        return edge
+
+    def _write(self, kind: str, id_: Any) -> None:
+        assert self._spill  # nosec: only called with a spill directory
+        edge = self._complete(kind, self._entities[kind].pop(id_))
+        if kind not in self._files:
+            # pylint: disable-next=consider-using-with
+            self._files[kind] = open(self._spill / kind, "wb")
+        raw = cache_format.pack(edge)
+        self._files[kind].write(_SIZE.pack(len(raw)))
+        self._files[kind].write(raw)
+        self._spilled[kind] += 1
+
+    def _edges(self, kind: str) -> List[Any]:
+        if not self._spill:
+            return [
+                self._complete(kind, x) for x in self._entities[kind].values()
+            ]
+        for id_ in list(self._entities[kind]):
+            self._write(kind, id_)
+        if kind in self._files:
+            self._files.pop(kind).close()
+        # pages received for an entity after it was spilled are added when
+        # it is read back
+        return SpilledList(
+            self._spill / kind,
+            self._spilled[kind],
+            functools.partial(self._complete, kind),
+        )
+
+    def build(self) -> schema.Rstate:
+        """Assemble the remote state from the buffered pages.
+
+        With a spill directory, the repositories and teams of the remote
+        state are read from it when iterated, and the directory must be
+        kept until the remote state is no longer used. The builder must not
+        be used afterwards.
+        """
+        return {
+            "data": {
+                "users": self._users,
+                "organization": {
+                    "repositories": {"edges": self._edges("repository")},
+                    "membersWithRole": self._members,
+                    "teams": {"edges": self._edges("team")},
+                },
+            }
+        }
@@ -0,0 +1,345 @@
+"""Differences between two remote states.
+
+The entities of both remote states are indexed by ID, and only the entities
+whose subtrees differ are compared field by field, so that the cost of a diff
+is dominated by the size of the change. See ghaudit.cache_history for a diff
+of snapshots only reading the entities whose digest changed.
+
+Each change is a flat mapping, meant to be written as a JSON line:
+
+ * kind: member, user, repository, collaborator, branch_protection,
+   push_allowance, team, team_repository or team_member.
+ * change: added, removed or changed.
+ * the entities it applies to, by name: user (a login), repository, team,
+   pattern (of a branch protection rule).
+ * field, for changed attributes of users, repositories, branch protection
+   rules and teams.
+ * old and new values, when relevant (e.g. the permission of a
+   collaborator).
+"""
+
+from __future__ import annotations
+
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Tuple,
+    TypeVar,
+)
+
+from ghaudit import schema
+
+_K = TypeVar("_K", bound=Hashable)
+
+Change = Dict[str, Any]
+# kind of entity (user, repository, team) -> ID -> name
+Names = Dict[str, Dict[Hashable, str]]
+
+_REPO_CONNECTIONS = ("collaborators", "branchProtectionRules")
+_TEAM_CONNECTIONS = ("repositories", "members", "childTeams", "parentTeam")
+
+
+def _edges(connection: Mapping | None) -> List[Any]:
+    if not connection:
+        return []
+    return [x for x in connection.get("edges") or [] if x is not None]
+
+
+def _by_id(items: Iterable[Any]) -> Dict[Hashable, Any]:
+    return {x["node"]["id"]: x for x in items}
+
+
+def _union(old: Mapping[_K, Any], new: Mapping[_K, Any]) -> Iterator[_K]:
+    """Iterate over the keys of `old', then over the new keys of `new'."""
+    yield from old
+    yield from (x for x in new if x not in old)
+
+
+def _name(names_: Names, kind: str, id_: Hashable) -> Any:
+    return names_[kind].get(id_, id_)
+
+
+def entity_names(*rstates: schema.Rstate) -> Names:
+    """Return the names of the entities of remote states, by ID."""
+    result = {"user": {}, "repository": {}, "team": {}}  # type: Names
+    for rstate in rstates:
+        for user_id, user in rstate["data"]["users"].items():
+            result["user"][user_id] = schema.user_login(user)
+        for repo in schema.org_repositories(rstate):
+            result["repository"][repo["node"]["id"]] = schema.repo_name(repo)
+        for team in schema.org_teams(rstate):
+            result["team"][team["node"]["id"]] = schema.team_name(team)
+    return result
+
+
+def _fields(
+    old: Mapping[str, Any],
+    new: Mapping[str, Any],
+    skip: Iterable[str],
+    base: Change,
+) -> Iterator[Change]:
+    for field in _union(old, new):
+        if field not in skip and old.get(field) != new.get(field):
+            yield {
+                **base,
+                "change": "changed",
+                "field": field,
+                "old": old.get(field),
+                "new": new.get(field),
+            }
+
+
+def _keyed(
+    old: Mapping[Hashable, Any],
+    new: Mapping[Hashable, Any],
+    base: Callable[[Hashable], Change],
+) -> Iterator[Change]:
+    """Compare mappings of keys to values, e.g. users to permissions."""
+    for key in _union(old, new):
+        if key not in new:
+            yield {**base(key), "change": "removed", "old": old[key]}
+        elif key not in old:
+            yield {**base(key), "change": "added", "new": new[key]}
+        elif old[key] != new[key]:
+            yield {
+                **base(key),
+                "change": "changed",
+                "old": old[key],
+                "new": new[key],
+            }
+
+
+def user_changes(
+    names_: Names, user_id: Hashable, old: Any | None, new: Any | None
+) -> Iterator[Change]:
+    """Return the changes of a user, given its old and new entries."""
+    login = _name(names_, "user", user_id)
+    if old is None or new is None:
+        yield {
+            "kind": "user",
+            "change": "added" if old is None else "removed",
+            "user": login,
+        }
+        return
+    yield from _fields(
+        old["node"], new["node"], (), {"kind": "user", "user": login}
+    )
+    if old.get("role") != new.get("role"):
+        yield {
+            "kind": "user",
+            "change": "changed",
+            "user": login,
+            "field": "role",
+            "old": old.get("role"),
+            "new": new.get("role"),
+        }
+
+
+def _push_allowances(rule: Any, names_: Names) -> Dict[Tuple, str]:
+    result = {}
+    for allowance in rule.get("pushAllowances") or []:
+        actor = schema.push_allowance_actor(allowance)
+        kind = "team" if schema.actor_type(actor) == "Team" else "user"
+        result[(kind, actor["id"])] = _name(names_, kind, actor["id"])
+    return result
+
+
+def _rule(
+    names_: Names, repository: str, old: Any, new: Any
+) -> Iterator[Change]:
+    base = {
+        "kind": "branch_protection",
+        "repository": repository,
+        "pattern": schema.branch_protection_pattern(new or old),
+    }
+    if old is None or new is None:
+        yield {**base, "change": "added" if old is None else "removed"}
+        if old is not None:
+            return
+    else:
+        yield from _fields(old, new, ("id", "pushAllowances"), base)
+    old_actors = _push_allowances(old or {}, names_)
+    new_actors = _push_allowances(new, names_)
+    for key in _union(old_actors, new_actors):
+        if key in old_actors and key in new_actors:
+            continue
+        yield {
+            **base,
+            "kind": "push_allowance",
+            "change": "added" if key in new_actors else "removed",
+            key[0]: new_actors.get(key) or old_actors[key],
+        }
+
+
+def repository_changes(
+    names_: Names, old: schema.Repo | None, new: schema.Repo | None
+) -> Iterator[Change]:
+    """Return the changes of the attributes and relations of a repository.
+
+    A repository is added if `old' is None, and removed if `new' is None.
+    """
+    name = schema.repo_name(new or old)  # type: ignore
+    if new is None:
+        yield {"kind": "repository", "change": "removed", "repository": name}
+        return
+    old_node = old["node"] if old else {}  # type: Mapping[str, Any]
+    new_node = new["node"]  # type: Mapping[str, Any]
+    if old is None:
+        yield {"kind": "repository", "change": "added", "repository": name}
+    else:
+        yield from _fields(
+            old_node,
+            new_node,
+            _REPO_CONNECTIONS,
+            {"kind": "repository", "repository": name},
+        )
+
+    def permissions(node: Mapping[str, Any]) -> Dict[Hashable, str]:
+        return {
+            x["node"]["id"]: x["permission"]
+            for x in _edges(node.get("collaborators"))
+        }
+
+    yield from _keyed(
+        permissions(old_node),
+        permissions(new_node),
+        lambda x: {
+            "kind": "collaborator",
+            "repository": name,
+            "user": _name(names_, "user", x),
+        },
+    )
+
+    def rules(node: Mapping[str, Any]) -> Dict[Hashable, Any]:
+        return {
+            x["id"]: x
+            for x in (node.get("branchProtectionRules") or {}).get("nodes")
+            or []
+        }
+
+    old_rules, new_rules = rules(old_node), rules(new_node)
+    for rule_id in _union(old_rules, new_rules):
+        if old_rules.get(rule_id) != new_rules.get(rule_id):
+            yield from _rule(
+                names_, name, old_rules.get(rule_id), new_rules.get(rule_id)
+            )
+
+
+def team_changes(
+    names_: Names, old: schema.Team | None, new: schema.Team | None
+) -> Iterator[Change]:
+    """Return the changes of the attributes and relations of a team.
+
+    A team is added if `old' is None, and removed if `new' is None.
+    """
+    name = schema.team_name(new or old)  # type: ignore
+    if new is None:
+        yield {"kind": "team", "change": "removed", "team": name}
+        return
+    old_node = old["node"] if old else {}  # type: Mapping[str, Any]
+    new_node = new["node"]  # type: Mapping[str, Any]
+    if old is None:
+        yield {"kind": "team", "change": "added", "team": name}
+    else:
+        yield from _fields(
+            old_node,
+            new_node,
+            _TEAM_CONNECTIONS,
+            {"kind": "team", "team": name},
+        )
+
+        def parent(node: Mapping[str, Any]) -> Any:
+            ref = node.get("parentTeam")
+            return _name(names_, "team", ref["id"]) if ref else None
+
+        if parent(old_node) != parent(new_node):
+            yield {
+                "kind": "team",
+                "change": "changed",
+                "team": name,
+                "field": "parentTeam",
+                "old": parent(old_node),
+                "new": parent(new_node),
+            }
+
+    def relations(
+        node: Mapping[str, Any], connection: str, value: str
+    ) -> Dict:
+        return {
+            x["node"]["id"]: x[value] for x in _edges(node.get(connection))
+        }
+
+    yield from _keyed(
+        relations(old_node, "repositories", "permission"),
+        relations(new_node, "repositories", "permission"),
+        lambda x: {
+            "kind": "team_repository",
+            "team": name,
+            "repository": _name(names_, "repository", x),
+        },
+    )
+    yield from _keyed(
+        relations(old_node, "members", "role"),
+        relations(new_node, "members", "role"),
+        lambda x: {
+            "kind": "team_member",
+            "team": name,
+            "user": _name(names_, "user", x),
+        },
+    )
+
+
+def member_changes(
+    names_: Names, old: Iterable[Hashable], new: Iterable[Hashable]
+) -> Iterator[Change]:
+    """Return the organisation members added and removed."""
+    old_set, new_set = dict.fromkeys(old), dict.fromkeys(new)
+    for user_id in _union(old_set, new_set):
+        if user_id not in old_set or user_id not in new_set:
+            yield {
+                "kind": "member",
+                "change": "added" if user_id in new_set else "removed",
+                "user": _name(names_, "user", user_id),
+            }
+
+
+def _changes(
+    names_: Names,
+    old: Mapping[Hashable, Any],
+    new: Mapping[Hashable, Any],
+    changes: Callable[[Names, Hashable, Any, Any], Iterator[Change]],
+) -> Iterator[Change]:
+    """Return the changes of the entities of two mappings indexed by ID."""
+    for id_ in _union(old, new):
+        old_value, new_value = old.get(id_), new.get(id_)
+        if old_value != new_value:
+            yield from changes(names_, id_, old_value, new_value)
+
+
+def diff(old: schema.Rstate, new: schema.Rstate) -> Iterator[Change]:
+    """Return the changes from the remote state `old' to `new'."""
+    names_ = entity_names(old, new)
+    yield from member_changes(
+        names_, schema.org_member_ids(old), schema.org_member_ids(new)
+    )
+    yield from _changes(
+        names_, old["data"]["users"], new["data"]["users"], user_changes
+    )
+    yield from _changes(
+        names_,
+        _by_id(schema.org_repositories(old)),
+        _by_id(schema.org_repositories(new)),
+        lambda n, _, x, y: repository_changes(n, x, y),
+    )
+    yield from _changes(
+        names_,
+        _by_id(schema.org_teams(old)),
+        _by_id(schema.org_teams(new)),
+        lambda n, _, x, y: team_changes(n, x, y),
+    )
@@ -0,0 +1,244 @@
+"""Telemetry of the cache refresh.
+
+Measurements are collected for each HTTP round trip and for each kind of
+sub-query (e.g. RepoCollaboratorQuery), to find out which connections
+dominate the cost of a synchronisation. The report is written as JSON and
+optionally in the OpenMetrics text format.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Mapping, MutableMapping, Sequence, TypedDict
+
+from ghaudit.query.sub_query import SubQuery
+
+# number of entities with the most pages reported for each kind of sub-query
+TOP_ENTITIES = 10
+
+
+class RequestRecord(TypedDict):
+    iteration: int
+    sub_queries: Mapping[str, int]
+    request_bytes: int
+    response_bytes: int
+    latency: float
+    cost: int | None
+    render_cpu: float
+    merge_cpu: float
+    discovery_cpu: float
+
+
+class KindRecord(TypedDict):
+    sub_queries: int
+    done: int
+    pages: int
+    max_pages: int
+    request_bytes: int
+    response_bytes: int
+    queued_time: float
+    top_entities: List[List]
+
+
+class Report(TypedDict):
+    totals: Mapping[str, float | int]
+    kinds: Mapping[str, KindRecord]
+    requests: List[RequestRecord]
+
+
+def kind(sub_query: SubQuery) -> str:
+    """Return the kind of a sub-query."""
+    return type(sub_query).__name__
+
+
+def _empty_kind() -> KindRecord:
+    return {
+        "sub_queries": 0,
+        "done": 0,
+        "pages": 0,
+        "max_pages": 0,
+        "request_bytes": 0,
+        "response_bytes": 0,
+        "queued_time": 0.0,
+        "top_entities": [],
+    }
+
+
+class Telemetry:
+    """Collector of synchronisation measurements.
+
+    CompoundQuery reports round trips and sub-queries to it, and the
+    synchronisation loop reports the CPU time spent merging responses and
+    discovering new sub-queries.
+    """
+
+    def __init__(self) -> None:
+        self._start = time.perf_counter()
+        self._requests = []  # type: List[RequestRecord]
+        self._kinds = {}  # type: Dict[str, KindRecord]
+        self._pages = {}  # type: Dict[str, Dict[str, int]]
+
+    def _kind(self, sub_query: SubQuery) -> KindRecord:
+        return self._kinds.setdefault(kind(sub_query), _empty_kind())
+
+    def appended(self, sub_query: SubQuery) -> None:
+        """Account for a new sub-query."""
+        self._kind(sub_query)["sub_queries"] += 1
+
+    def queued(self, sub_query: SubQuery, seconds: float) -> None:
+        """Account for the time a sub-query spent in the pending queue."""
+        self._kind(sub_query)["queued_time"] += seconds
+
+    # pylint: disable=too-many-arguments
+    def request(
+        self,
+        sub_queries: Sequence[SubQuery],
+        body_bytes: int,
+        request_bytes: Sequence[int],
+        response_bytes: Mapping[str, int],
+        latency: float,
+        cost: int | None,
+        render_cpu: float,
+    ) -> None:
+        """Account for an HTTP round trip.
+
+        `body_bytes' is the size of the HTTP request body, `request_bytes'
+        holds the size of the rendered text of each sub-query, and
+        `response_bytes' the size of the response data by root key. The size
+        of a root shared by several sub-queries is split evenly between them.
+        """
+        kinds = {}  # type: MutableMapping[str, int]
+        sharing = {}  # type: MutableMapping[str, int]
+        for sub_query in sub_queries:
+            kinds[kind(sub_query)] = kinds.get(kind(sub_query), 0) + 1
+            sharing[sub_query.root()] = sharing.get(sub_query.root(), 0) + 1
+        for sub_query, size in zip(sub_queries, request_bytes):
+            record = self._kind(sub_query)
+            record["request_bytes"] += size
+            record["response_bytes"] += (
+                response_bytes.get(sub_query.root(), 0)
+                // sharing[sub_query.root()]
+            )
+        self._requests.append(
+            {
+                "iteration": len(self._requests) + 1,
+                "sub_queries": kinds,
+                "request_bytes": body_bytes,
+                "response_bytes": sum(response_bytes.values()),
+                "latency": latency,
+                "cost": cost,
+                "render_cpu": render_cpu,
+                "merge_cpu": 0.0,
+                "discovery_cpu": 0.0,
+            }
+        )
+
+    def done(self, sub_query: SubQuery) -> None:
+        """Account for a sub-query which received all its pages."""
+        record = self._kind(sub_query)
+        pages = max(sub_query.pages(), 1)
+        record["done"] += 1
+        record["pages"] += pages
+        record["max_pages"] = max(record["max_pages"], pages)
+        entities = self._pages.setdefault(kind(sub_query), {})
+        entity = sub_query.entity()
+        entities[entity] = entities.get(entity, 0) + pages
+
+    def merge_cpu(self, seconds: float) -> None:
+        """Account for the time spent merging the last response."""
+        if self._requests:
+            self._requests[-1]["merge_cpu"] += seconds
+
+    def discovery_cpu(self, seconds: float) -> None:
+        """Account for the time spent discovering new sub-queries."""
+        if self._requests:
+            self._requests[-1]["discovery_cpu"] += seconds
+
+    def report(self) -> Report:
+        """Return the measurements collected so far."""
+
+        def total(key: str) -> float:
+            return sum(x[key] or 0 for x in self._requests)  # type: ignore
+
+        for name, entities in self._pages.items():
+            top = sorted(entities.items(), key=lambda x: -x[1])
+            self._kinds[name]["top_entities"] = [
+                list(x) for x in top[:TOP_ENTITIES]
+            ]
+        return {
+            "totals": {
+                "requests": len(self._requests),
+                "sub_queries": sum(
+                    x["sub_queries"] for x in self._kinds.values()
+                ),
+                "request_bytes": total("request_bytes"),
+                "response_bytes": total("response_bytes"),
+                "latency": round(total("latency"), 6),
+                "cost": total("cost"),
+                "render_cpu": round(total("render_cpu"), 6),
+                "merge_cpu": round(total("merge_cpu"), 6),
+                "discovery_cpu": round(total("discovery_cpu"), 6),
+                "wall_time": round(time.perf_counter() - self._start, 6),
+            },
+            "kinds": dict(self._kinds),
+            "requests": self._requests,
+        }
+
+    def write(self, path: Path, openmetrics_path: Path | None = None) -> None:
+        """Write the report as JSON, and optionally as OpenMetrics."""
+        report = self.report()
+        with open(path, "w", encoding="UTF-8") as output:
+            json.dump(report, output, indent=2)
+        if openmetrics_path:
+            with open(openmetrics_path, "w", encoding="UTF-8") as output:
+                output.write(openmetrics(report))
+
+
+# metric name, help, report totals key and kind record key
+_METRICS = [
+    ("requests", "HTTP round trips.", "requests", None),
+    ("sub_queries", "GraphQL sub-queries.", "sub_queries", "sub_queries"),
+    ("pages", "Pages received.", None, "pages"),
+    (
+        "request_bytes",
+        "Size of the requests.",
+        "request_bytes",
+        "request_bytes",
+    ),
+    (
+        "response_bytes",
+        "Size of the responses.",
+        "response_bytes",
+        "response_bytes",
+    ),
+    ("latency_seconds", "Latency of round trips.", "latency", None),
+    ("rate_limit_cost", "Rate limit points spent.", "cost", None),
+    ("render_cpu_seconds", "CPU time rendering.", "render_cpu", None),
+    ("merge_cpu_seconds", "CPU time merging.", "merge_cpu", None),
+    ("discovery_cpu_seconds", "CPU time discovering.", "discovery_cpu", None),
+    ("queued_seconds", "Time spent queued.", None, "queued_time"),
+]
+
+
+def openmetrics(report: Report) -> str:
+    """Format a telemetry report in the OpenMetrics text format."""
+    lines = []
+    for name, help_, totals_key, kind_key in _METRICS:
+        metric = "ghaudit_sync_{}".format(name)
+        lines.append("# TYPE {} counter".format(metric))
+        lines.append("# HELP {} {}".format(metric, help_))
+        if kind_key:
+            for kind_name, record in sorted(report["kinds"].items()):
+                lines.append(
+                    '{}_total{{kind="{}"}} {}'.format(
+                        metric, kind_name, record[kind_key]  # type: ignore
+                    )
+                )
+        elif totals_key:
+            lines.append(
+                "{}_total {}".format(metric, report["totals"][totals_key])
+            )
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
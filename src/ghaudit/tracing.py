@@ -0,0 +1,153 @@
+"""Lightweight tracing of ghaudit phases.
+
+A span is a named and timed section of the execution, with attributes.
+Spans nest naturally by time. Tracing is disabled by default, in which case
+opening a span is close to free. Collected spans can be exported in the
+Chrome trace event format, to be displayed as a timeline by chrome://tracing
+or Perfetto.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Callable, Dict, List, Type, TypeVar, cast
+
+# pylint: disable=invalid-name
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class Span:
+    """Context manager recording a span into a tracer."""
+
+    def __init__(
+        self, tracer: Tracer, name: str, attributes: Dict[str, Any]
+    ) -> None:
+        self._tracer = tracer
+        self._name = name
+        self._attributes = attributes
+        self._start = 0
+
+    def set(self, key: str, value: Any) -> None:
+        """Set an attribute of the span."""
+        self._attributes[key] = value
+
+    def __enter__(self) -> Span:
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        end = time.perf_counter_ns()
+        if exc_type:
+            self._attributes["error"] = exc_type.__name__
+        self._tracer.record(self._name, self._start, end, self._attributes)
+
+
+class _NullSpan:
+    """Span used when tracing is disabled."""
+
+    def set(self, key: str, value: Any) -> None:
+        """Ignore the attribute."""
+
+    def __enter__(self) -> _NullSpan:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """Collector of finished spans."""
+
+    def __init__(self) -> None:
+        self._origin = time.perf_counter_ns()
+        self._events = []  # type: List[Dict[str, Any]]
+
+    def record(
+        self, name: str, start: int, end: int, attributes: Dict[str, Any]
+    ) -> None:
+        """Record a finished span, with times in nanoseconds."""
+        self._events.append(
+            {
+                "name": name,
+                "cat": "ghaudit",
+                "ph": "X",
+                "ts": (start - self._origin) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": attributes,
+            }
+        )
+
+    def events(self) -> List[Dict[str, Any]]:
+        """Return the recorded spans as Chrome trace events."""
+        return self._events
+
+    def export_chrome(self, path: Path) -> None:
+        """Write the recorded spans to a Chrome trace event JSON file."""
+        with open(path, "w", encoding="UTF-8") as output:
+            json.dump(
+                {"traceEvents": self._events, "displayTimeUnit": "ms"},
+                output,
+                default=str,
+            )
+
+
+_TRACER = None  # type: Tracer | None
+
+
+def enable() -> Tracer:
+    """Start collecting spans and return the collecting tracer."""
+    # pylint: disable=global-statement
+    global _TRACER
+    _TRACER = Tracer()
+    return _TRACER
+
+
+def disable() -> None:
+    """Stop collecting spans."""
+    # pylint: disable=global-statement
+    global _TRACER
+    _TRACER = None
+
+
+def span(name: str, **attributes: Any) -> Span | _NullSpan:
+    """Return a context manager timing a section of code as a span."""
+    if _TRACER is None:
+        return _NULL_SPAN
+    return Span(_TRACER, name, attributes)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Decorate a function to time each of its calls as a span."""
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _TRACER is None:
+                return func(*args, **kwargs)
+            with Span(_TRACER, name, {}):
+                return func(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
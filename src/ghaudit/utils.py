@@ -4,7 +4,16 @@ from __future__ import annotations
 
 import json
 import logging
-from typing import Any, Callable, Iterable, Mapping, Set, TypeVar, cast
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Mapping,
+    Optional,
+    Set,
+    TypeVar,
+    cast,
+)
 
 import requests
 
@@ -12,6 +21,13 @@ from ghaudit.auth import AuthDriver
 
 GITHUB_GRAPHQL_DEFAULT_ENDPOINT = "https://api.github.com/graphql"
 
+# the interface implemented by github_graphql_call, which can be substituted
+# by other transports (see ghaudit.cassette). As with other Callable aliases,
+# the newer Optional syntax is not supported here.
+Transport = Callable[
+    [str, AuthDriver, Any, Optional[requests.Session]], Mapping[str, Any]
+]
+
 
 # pylint: disable=too-few-public-methods
 class LazyJsonFmt:
@@ -0,0 +1,470 @@
+"""Targeted updates of the cache from github organisation webhook events.
+
+Instead of refreshing the whole organisation, `cache ingest' applies the
+events github delivers to an organisation webhook as targeted updates of the
+cached remote state:
+
+ * the repositories and teams a payload describes are updated from it, or
+   removed when deleted (with the children of a deleted team), and the
+   membership of the organisation is updated from `organization' events;
+ * the relations a payload names without describing them are requested
+   again with the sub-queries of a refresh, for the entities involved only
+   (see ghaudit.cache.ingest): the collaborators and branch protection rules
+   of a repository (`member', `branch_protection_rule' and new
+   repositories), the repositories, members and children of a team
+   (`membership', `team', `team_add'), and the users the cache does not know
+   yet.
+
+The updated entities are then appended to the journal of the cache (see
+ghaudit.cache_journal). The organisation base permission granted to a new
+member is only seen by the next refresh.
+
+Events are read from a spool directory, one JSON file per delivery holding
+{"event": EVENT, "payload": PAYLOAD}, where EVENT is the X-GitHub-Event
+header of the delivery. Files are applied in the order of their names, and
+removed once applied. The receiver (see `receiver') writes the deliveries it
+accepts to the spool. Events of other organisations or of other kinds are
+ignored.
+"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import hmac
+import http.server
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Mapping,
+    Set,
+    Tuple,
+    TypedDict,
+)
+
+from ghaudit import schema
+
+EVENTS = (
+    "branch_protection_rule",
+    "member",
+    "membership",
+    "organization",
+    "repository",
+    "team",
+    "team_add",
+)
+
+_PRIVACY = {"closed": "VISIBLE", "secret": "SECRET"}
+
+
+class Changes(TypedDict):
+    """Targeted updates collected from events, see `changes'."""
+
+    # base fields of repositories and teams, by ID
+    repositories: Dict[Hashable, Dict[str, Any]]
+    teams: Dict[Hashable, Dict[str, Any]]
+    # IDs of the repositories and teams whose relations are requested again
+    refreshed_repositories: Set[Hashable]
+    refreshed_teams: Set[Hashable]
+    deleted_repositories: Set[Hashable]
+    deleted_teams: Set[Hashable]
+    # login -> ID of the users involved, requested if unknown
+    users: Dict[str, Hashable]
+    # ID -> role of the new organisation members
+    members: Dict[Hashable, str]
+    removed_members: Set[Hashable]
+
+
+def no_changes() -> Changes:
+    """Return empty targeted updates."""
+    return {
+        "repositories": {},
+        "teams": {},
+        "refreshed_repositories": set(),
+        "refreshed_teams": set(),
+        "deleted_repositories": set(),
+        "deleted_teams": set(),
+        "users": {},
+        "members": {},
+        "removed_members": set(),
+    }
+
+
+def _repository_node(repository: Mapping[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": repository["node_id"],
+        "name": repository["name"],
+        "description": repository.get("description"),
+        "isFork": repository.get("fork", False),
+        "isArchived": repository.get("archived", False),
+        "isMirror": repository.get("mirror_url") is not None,
+        "isPrivate": repository.get("private", False),
+        "isTemplate": repository.get("is_template", False),
+    }
+
+
+def _team_node(team: Mapping[str, Any]) -> Dict[str, Any]:
+    node = {
+        "id": team["node_id"],
+        "name": team["name"],
+        "slug": team["slug"],
+        "description": team.get("description"),
+        "privacy": _PRIVACY.get(team.get("privacy", ""), "VISIBLE"),
+    }
+    if "parent" in team:
+        parent = team["parent"]
+        node["parentTeam"] = {"id": parent["node_id"]} if parent else None
+    return node
+
+
+def _delete_repository(changes_: Changes, repository: Any) -> None:
+    changes_["repositories"].pop(repository["node_id"], None)
+    changes_["refreshed_repositories"].discard(repository["node_id"])
+    changes_["deleted_repositories"].add(repository["node_id"])
+
+
+def _delete_team(changes_: Changes, team: Any) -> None:
+    changes_["teams"].pop(team["node_id"], None)
+    changes_["refreshed_teams"].discard(team["node_id"])
+    changes_["deleted_teams"].add(team["node_id"])
+
+
+def _add_event(changes_: Changes, event: str, payload: Mapping) -> None:
+    action = payload.get("action")
+    repository = payload.get("repository")
+    team = payload.get("team")
+    if event == "repository" and action == "deleted":
+        _delete_repository(changes_, repository)
+        return
+    if event == "team" and action == "deleted":
+        _delete_team(changes_, team)
+        return
+    if repository:
+        changes_["repositories"][repository["node_id"]] = _repository_node(
+            repository
+        )
+        if event in ("member", "branch_protection_rule") or (
+            # `transferred' is sent to the organisation receiving it
+            event == "repository"
+            and action in ("created", "transferred")
+        ):
+            changes_["refreshed_repositories"].add(repository["node_id"])
+    # the team of a membership event can be a deleted team, without node ID
+    if team and "node_id" in team:
+        changes_["teams"][team["node_id"]] = _team_node(team)
+        if event in ("membership", "team_add") or (
+            event == "team"
+            and action
+            in ("created", "added_to_repository", "removed_from_repository")
+        ):
+            changes_["refreshed_teams"].add(team["node_id"])
+    if event == "membership" and payload.get("member"):
+        member = payload["member"]
+        changes_["users"][member["login"]] = member["node_id"]
+    if event == "organization" and action == "member_added":
+        user = payload["membership"]["user"]
+        changes_["users"][user["login"]] = user["node_id"]
+        changes_["members"][user["node_id"]] = payload["membership"][
+            "role"
+        ].upper()
+        changes_["removed_members"].discard(user["node_id"])
+    elif event == "organization" and action == "member_removed":
+        user = payload["membership"]["user"]
+        changes_["members"].pop(user["node_id"], None)
+        changes_["removed_members"].add(user["node_id"])
+
+
+def changes(events: List[Tuple[str, Any]], organisation: str) -> Changes:
+    """Collect the targeted updates of events, in delivery order.
+
+    `events' are (event name, payload) pairs. Events of other organisations
+    or of other kinds are ignored.
+    """
+    result = no_changes()
+    for event, payload in events:
+        org = payload.get("organization") or {}
+        if event not in EVENTS:
+            logging.info('ignoring webhook event "%s"', event)
+        elif org.get("login", "").lower() != organisation.lower():
+            logging.info(
+                'ignoring webhook event of organisation "%s"', org.get("login")
+            )
+        else:
+            _add_event(result, event, payload)
+    return result
+
+
+def _edges(connection: Any) -> List[Any]:
+    if not connection:
+        return []
+    return [x for x in connection["edges"] if x is not None]
+
+
+def _strip(node: Any, key: str, ids: Set[Hashable]) -> None:
+    if node.get(key):
+        node[key]["edges"] = [
+            x for x in _edges(node[key]) if x["node"]["id"] not in ids
+        ]
+
+
+def _descendants(teams: List[Any], ids: Set[Hashable]) -> Set[Hashable]:
+    result = set(ids)
+    while True:
+        children = {
+            x["node"]["id"]
+            for x in teams
+            if (x["node"].get("parentTeam") or {}).get("id") in result
+        }
+        if children <= result:
+            return result
+        result |= children
+
+
+def _delete(rstate: schema.Rstate, changes_: Changes) -> None:
+    data = rstate["data"]  # type: Any
+    org = data["organization"]
+    repositories = org["repositories"]
+    repositories["edges"] = [
+        x
+        for x in repositories["edges"]
+        if x["node"]["id"] not in changes_["deleted_repositories"]
+    ]
+    teams = org["teams"]
+    deleted_teams = _descendants(teams["edges"], changes_["deleted_teams"])
+    teams["edges"] = [
+        x for x in teams["edges"] if x["node"]["id"] not in deleted_teams
+    ]
+    removed = changes_["removed_members"]
+    org["membersWithRole"] = [
+        x for x in org["membersWithRole"] if x not in removed
+    ]
+    for user_id in removed:
+        data["users"].get(user_id, {}).pop("role", None)
+    for team in teams["edges"]:
+        _strip(team["node"], "repositories", changes_["deleted_repositories"])
+        _strip(team["node"], "childTeams", deleted_teams)
+
+
+def _update(
+    edges: List[Any], nodes: Mapping[Hashable, Dict[str, Any]], new: Any
+) -> None:
+    """Update the base fields of entities, adding the unknown ones."""
+    by_id = {x["node"]["id"]: x for x in edges}
+    for id_, node in nodes.items():
+        if id_ in by_id:
+            by_id[id_]["node"].update(node)
+        else:
+            edges.append({"node": {**new, **node}})
+
+
+def _refreshed(
+    repositories: List[Any],
+    teams: List[Any],
+    parents: Mapping[Hashable, Hashable],
+    changes_: Changes,
+) -> Tuple[Set[Hashable], Set[Hashable]]:
+    """Return the IDs of the repositories and teams to request again.
+
+    `parents' are the parents of the teams before the update.
+    """
+    refreshed_repositories = set(changes_["refreshed_repositories"])
+    refreshed_teams = set(changes_["refreshed_teams"])
+    # a moved or new team changes the children of its previous and new parent
+    for team in teams:
+        parent = (team["node"].get("parentTeam") or {}).get("id")
+        if team["node"]["id"] in changes_["teams"] and parent != parents.get(
+            team["node"]["id"]
+        ):
+            refreshed_teams |= {parent, parents.get(team["node"]["id"])}
+    # the access a removed member had is requested again
+    removed = changes_["removed_members"]
+    for repo in repositories:
+        if any(
+            x["node"]["id"] in removed
+            for x in _edges(repo["node"].get("collaborators"))
+        ):
+            refreshed_repositories.add(repo["node"]["id"])
+    for team in teams:
+        if any(
+            x["node"]["id"] in removed
+            for x in _edges(team["node"].get("members"))
+        ):
+            refreshed_teams.add(team["node"]["id"])
+    return refreshed_repositories, refreshed_teams
+
+
+def prepare(
+    rstate: schema.Rstate, changes_: Changes
+) -> Tuple[schema.Rstate, Set[str], Set[str], List[str]]:
+    """Apply the targeted updates which need no query to a remote state.
+
+    Return the updated copy of the remote state, with the names of the
+    repositories and teams whose relations are requested again, and the
+    logins of the users to request.
+    """
+    rstate = copy.deepcopy(rstate)
+    data = rstate["data"]  # type: Any
+    org = data["organization"]
+    _delete(rstate, changes_)
+    repositories = org["repositories"]["edges"]
+    teams = org["teams"]["edges"]
+    parents = {
+        x["node"]["id"]: (x["node"].get("parentTeam") or {}).get("id")
+        for x in teams
+    }
+    _update(repositories, changes_["repositories"], {"isLocked": False})
+    _update(teams, changes_["teams"], {"parentTeam": None})
+
+    refreshed_repositories, refreshed_teams = _refreshed(
+        repositories, teams, parents, changes_
+    )
+    for user_id, role in changes_["members"].items():
+        if user_id not in org["membersWithRole"]:
+            org["membersWithRole"].append(user_id)
+        if user_id in data["users"]:
+            data["users"][user_id]["role"] = role
+    return (
+        rstate,
+        {
+            schema.repo_name(x)
+            for x in repositories
+            if x["node"]["id"] in refreshed_repositories
+        },
+        {
+            schema.team_name(x)
+            for x in teams
+            if x["node"]["id"] in refreshed_teams
+        },
+        [
+            login
+            for login, id_ in changes_["users"].items()
+            if id_ not in data["users"]
+        ],
+    )
+
+
+def finish(rstate: schema.Rstate, changes_: Changes) -> schema.Rstate:
+    """Complete a remote state once the requested entities are merged.
+
+    The roles of new members requested as users are set, and the users which
+    are no longer organisation members nor collaborators are removed, as a
+    refresh would not request them.
+    """
+    data = rstate["data"]  # type: Any
+    for user_id, role in changes_["members"].items():
+        if user_id in data["users"]:
+            data["users"][user_id]["role"] = role
+    kept = set(data["organization"]["membersWithRole"]) | {
+        y["node"]["id"]
+        for x in schema.org_repositories(rstate)
+        for y in _edges(x["node"].get("collaborators"))
+    }
+    data["users"] = {k: v for k, v in data["users"].items() if k in kept}
+    return rstate
+
+
+def spooled(spool: Path) -> List[Path]:
+    """Return the event files of a spool directory, in delivery order."""
+    return sorted(spool.glob("*.json"))
+
+
+def read(path_: Path) -> Tuple[str, Any]:
+    """Return the event name and the payload of a spool file."""
+    event = json.loads(path_.read_text(encoding="UTF-8"))
+    return event["event"], event["payload"]
+
+
+def write(spool: Path, event: str, delivery: str, payload: Any) -> Path:
+    """Atomically add an event to a spool directory.
+
+    The file is named after the reception time, so that files sort in
+    delivery order, and after the delivery ID.
+    """
+    spool.mkdir(parents=True, exist_ok=True)
+    path_ = spool / "{:020d}-{}.json".format(
+        time.time_ns(), "".join(x for x in delivery if x.isalnum() or x == "-")
+    )
+    with tempfile.NamedTemporaryFile(
+        "w", dir=spool, suffix=".tmp", delete=False, encoding="UTF-8"
+    ) as output:
+        json.dump({"event": event, "payload": payload}, output)
+    os.replace(output.name, path_)
+    return path_
+
+
+def signature(secret: bytes, body: bytes) -> str:
+    """Return the X-Hub-Signature-256 header of a delivery."""
+    return "sha256=" + hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+
+class _Receiver(http.server.HTTPServer):
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        handler: type,
+        idle: Callable[[], None] | None,
+    ) -> None:
+        super().__init__(address, handler)
+        self._idle = idle
+
+    def handle_timeout(self) -> None:
+        if self._idle:
+            self._idle()
+
+
+def receiver(
+    address: Tuple[str, int],
+    spool: Path,
+    secret: bytes,
+    idle: Callable[[], None] | None = None,
+) -> http.server.HTTPServer:
+    """Return an HTTP server writing the webhook deliveries to a spool.
+
+    Deliveries are POST requests whose X-Hub-Signature-256 header must be
+    the signature of their body with the webhook secret. The server answers
+    202 once the delivery is spooled. `idle' is called when no request comes
+    within the timeout of `handle_request', so that the deliveries of a burst
+    are applied together.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        # pylint: disable=invalid-name
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not hmac.compare_digest(
+                signature(secret, body),
+                self.headers.get("X-Hub-Signature-256", ""),
+            ):
+                self.send_error(401, "invalid signature")
+                return
+            event = self.headers.get("X-GitHub-Event", "")
+            if event in EVENTS:
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    self.send_error(400, "invalid payload")
+                    return
+                write(
+                    spool,
+                    event,
+                    self.headers.get("X-GitHub-Delivery", ""),
+                    payload,
+                )
+            self.send_response(202)
+            self.end_headers()
+
+        def log_message(
+            self, format: str, *args: Any  # pylint: disable=redefined-builtin
+        ) -> None:
+            logging.info(format, *args)
+
+    return _Receiver(address, Handler, idle)
@@ -0,0 +1,401 @@
+"""In-memory stand-in for the github GraphQL API.
+
+The fake answers the compound queries rendered by ghaudit from a small
+organisation model, so that the synchronisation can be tested without
+network. It only understands the fragments shipped with ghaudit.
+"""
+
+from __future__ import annotations
+
+import functools
+import re
+from typing import Any, Dict, List, Mapping, Tuple
+
+from ghaudit import config, schema
+
+FRAGMENT_RE = re.compile(r"fragment (\w+) on \w+ \{")
+MAIN_RE = re.compile(r"query org_infos\(.*?\) \{(.*)\}\s*$", re.DOTALL)
+ORG_RE = re.compile(r"organization\(login: \$(\w+)\)")
+NAMESPACE_RE = re.compile(r"(org\d+_)?")
+
+
+def make_config(name: str = "foobar") -> config.Config:
+    """Return a minimal configuration for the organisation `name'."""
+    return config.Config(
+        organisation=name,
+        owners=frozenset(),
+        teams={},
+        by_member={},
+        effective_members={},
+    )
+
+
+def make_org(
+    name: str = "foobar",
+    repos: int = 5,
+    teams: int = 3,
+    members: int = 6,
+    outside: int = 2,
+) -> Dict[str, Any]:
+    """Return a deterministic organisation model."""
+    users = [
+        {
+            "id": "U_{}_{}".format(name, i),
+            "login": "{}-user{}".format(name, i),
+            "name": "User {}".format(i) if i % 3 else None,
+            "email": "",
+            "company": "",
+        }
+        for i in range(members + outside)
+    ]
+    org_repos = []  # type: List[Dict[str, Any]]
+    for i in range(repos):
+        repo_id = "R_{}_{}".format(name, i)
+        collaborators = [
+            (users[(i + j) % len(users)]["id"], ["READ", "WRITE", "ADMIN"][j])
+            for j in range(3)
+        ]
+        rules = [
+            {
+                "id": "BPR_{}_{}_{}".format(name, i, j),
+                "allowsDeletions": False,
+                "allowsForcePushes": False,
+                "creator": {"login": users[0]["login"]},
+                "dismissesStaleReviews": False,
+                "isAdminEnforced": bool(j),
+                "pattern": ["main", "release/*"][j],
+                "requiredApprovingReviewCount": 1,
+                "requiredStatusCheckContexts": [],
+                "requiresApprovingReviews": True,
+                "requiresCodeOwnerReviews": False,
+                "requiresCommitSignatures": False,
+                "requiresLinearHistory": False,
+                "requiresStatusChecks": False,
+                "requiresStrictStatusChecks": False,
+                "restrictsPushes": True,
+                "restrictsReviewDismissals": False,
+                "pushAllowances": [
+                    {"id": users[i % members]["id"], "__typename": "User"}
+                ],
+            }
+            for j in range(i % 3)
+        ]
+        org_repos.append(
+            {
+                "id": repo_id,
+                "name": "repo{}".format(i),
+                "description": "repository {}".format(i),
+                "isFork": False,
+                "isArchived": False,
+                "isLocked": False,
+                "isMirror": False,
+                "isPrivate": bool(i % 2),
+                "isTemplate": False,
+                "collaborators": collaborators,
+                "branchProtectionRules": rules,
+            }
+        )
+    org_teams = []  # type: List[Dict[str, Any]]
+    for i in range(teams):
+        org_teams.append(
+            {
+                "id": "T_{}_{}".format(name, i),
+                "name": "team{}".format(i),
+                "slug": "team{}".format(i),
+                "description": "team {}".format(i),
+                "privacy": "VISIBLE",
+                "parentTeam": ({"id": "T_{}_0".format(name)} if i else None),
+                "repositories": [
+                    (org_repos[(i + j) % repos]["id"], "WRITE")
+                    for j in range(2)
+                ],
+                "members": [
+                    (users[(i + j) % members]["id"], "MEMBER")
+                    for j in range(2)
+                ],
+                "children": (
+                    ["T_{}_{}".format(name, j) for j in range(1, teams)]
+                    if i == 0
+                    else []
+                ),
+            }
+        )
+    return {
+        "name": name,
+        "users": users,
+        "members": [
+            (x["id"], "ADMIN" if i == 0 else "MEMBER")
+            for i, x in enumerate(users[:members])
+        ],
+        "repos": org_repos,
+        "teams": org_teams,
+    }
+
+
+def by_id(rstate: schema.Rstate) -> Tuple[Any, ...]:
+    """Return the entities of a remote state, to compare remote states."""
+    org = rstate["data"]["organization"]  # type: Any
+    return (
+        rstate["data"]["users"],
+        sorted(org["membersWithRole"]),
+        {x["node"]["id"]: x for x in org["repositories"]["edges"]},
+        {x["node"]["id"]: x for x in org["teams"]["edges"]},
+    )
+
+
+def _page(
+    items: List[Any],
+    variables: Mapping[str, Any],
+    text: str,
+    max_: str,
+    prefix: str = "",
+):
+    cursor = re.search(r"after: \$(\w+)", text)
+    start = int(variables[cursor.group(1)]) if cursor else 0
+    size = int(variables[prefix + max_])
+    end = start + size
+    page_info = {"hasNextPage": end < len(items), "endCursor": str(end)}
+    return items[start:end], page_info
+
+
+class FakeGithub:
+    """Transport answering ghaudit queries from organisation models."""
+
+    def __init__(self, *orgs: Mapping[str, Any]) -> None:
+        self._orgs = {x["name"]: x for x in orgs}
+        self.calls = 0
+
+    def _user(self, user_id: str) -> Mapping[str, Any]:
+        for org in self._orgs.values():
+            for user in org["users"]:
+                if user["id"] == user_id:
+                    return user
+        raise KeyError(user_id)
+
+    def __call__(
+        self,
+        call_str: str,
+        auth_driver: Any,
+        variables: Mapping[str, Any],
+        session: Any,
+    ) -> Mapping[str, Any]:
+        del auth_driver, session
+        self.calls += 1
+        frags = {}
+        bounds = [m for m in FRAGMENT_RE.finditer(call_str)]
+        for i, match in enumerate(bounds):
+            end = bounds[i + 1].start() if i + 1 < len(bounds) else None
+            frags[match.group(1)] = call_str[match.start() : end]
+        main = MAIN_RE.search(call_str)
+        assert main  # nosec: testing only
+        data = {}  # type: Dict[str, Any]
+        for name in re.findall(r"\.\.\.(\w+)", main.group(1)):
+            alias, value = self._answer(name, frags, variables)
+            if isinstance(data.get(alias), dict):
+                data[alias] = {**data[alias], **value}
+            else:
+                data[alias] = value
+        if "rateLimit" in main.group(1):
+            data["rateLimit"] = {"cost": 1, "remaining": 4999}
+        return {"data": data}
+
+    def _org(self, text: str, variables: Mapping[str, Any]):
+        match = ORG_RE.search(text)
+        assert match  # nosec: testing only
+        return self._orgs[variables[match.group(1)]]
+
+    # pylint: disable=too-many-locals,too-many-return-statements
+    def _answer(
+        self, name: str, frags: Mapping[str, str], variables: Mapping
+    ) -> Tuple[str, Any]:
+        text = frags[name]
+        # sub-queries about several organisations are prefixed by org{N}_
+        prefix = NAMESPACE_RE.match(name).group(0)  # type: ignore[union-attr]
+        name = name[len(prefix) :]
+        num = re.sub(r"^\D+", "", name)
+        page = functools.partial(_page, prefix=prefix)
+        if name.startswith("user"):
+            login = re.search(r'login: "([^"]+)"', text)
+            assert login  # nosec: testing only
+            for org in self._orgs.values():
+                for user in org["users"]:
+                    if user["login"] == login.group(1):
+                        return prefix + "user" + num, dict(user)
+            return prefix + "user" + num, None
+        if name.startswith("branchProtection"):
+            rule_id = re.search(r'node\(id: "([^"]+)"\)', text)
+            assert rule_id  # nosec: testing only
+            for org in self._orgs.values():
+                for repo in org["repos"]:
+                    for rule in repo["branchProtectionRules"]:
+                        if rule["id"] != rule_id.group(1):
+                            continue
+                        nodes = [
+                            {
+                                "branchProtectionRule": {
+                                    "id": rule["id"],
+                                    "repository": {"id": repo["id"]},
+                                },
+                                "actor": actor,
+                            }
+                            for actor in rule["pushAllowances"]
+                        ]
+                        items, page_info = page(
+                            nodes, variables, text, "pushAllowancesMax"
+                        )
+                        return prefix + "branch_protection" + num, {
+                            "pushAllowances": {
+                                "pageInfo": page_info,
+                                "nodes": items,
+                            }
+                        }
+            raise KeyError(rule_id.group(1))
+        org = self._org(text, variables)
+        alias = re.search(r"(\w+) ?: organization", text)
+        assert alias  # nosec: testing only
+        alias_name = alias.group(1)
+        if name.startswith("teams"):
+            edges = [
+                {
+                    "node": {
+                        k: v
+                        for k, v in x.items()
+                        if k not in ("repositories", "members", "children")
+                    }
+                }
+                for x in org["teams"]
+            ]
+            items, page_info = page(edges, variables, text, "teamsMax")
+            return alias_name, {
+                "teams": {"pageInfo": page_info, "edges": items}
+            }
+        if name.startswith("membersWithRole"):
+            edges = [
+                {"role": role, "node": dict(self._user(user_id))}
+                for user_id, role in org["members"]
+            ]
+            items, page_info = page(
+                edges, variables, text, "membersWithRoleMax"
+            )
+            return alias_name, {
+                "membersWithRole": {"pageInfo": page_info, "edges": items}
+            }
+        if name.startswith("repositories"):
+            edges = [
+                {
+                    "node": {
+                        k: v
+                        for k, v in x.items()
+                        if k not in ("collaborators", "branchProtectionRules")
+                    }
+                }
+                for x in org["repos"]
+            ]
+            items, page_info = page(edges, variables, text, "repositoriesMax")
+            return alias_name, {
+                "repositories": {"pageInfo": page_info, "edges": items}
+            }
+        if name.startswith("repo"):
+            repo_name = re.search(r'repository\(name: "([^"]+)"\)', text)
+            assert repo_name  # nosec: testing only
+            repo = [x for x in org["repos"] if x["name"] == repo_name.group(1)]
+            if not repo:
+                return alias_name, {"repository": None}
+            if name.startswith("repoCollaborator"):
+                edges = [
+                    {
+                        "permission": perm,
+                        "node": {
+                            "id": user_id,
+                            "login": self._user(user_id)["login"],
+                        },
+                    }
+                    for user_id, perm in repo[0]["collaborators"]
+                ]
+                items, page_info = page(
+                    edges,
+                    variables,
+                    frags[_edge(frags, prefix, num)],
+                    "repoCollaboratorMax",
+                )
+                connection = "collaborators"
+                key = "edges"
+            else:
+                nodes = [
+                    {k: v for k, v in x.items() if k != "pushAllowances"}
+                    for x in repo[0]["branchProtectionRules"]
+                ]
+                items, page_info = page(
+                    nodes,
+                    variables,
+                    frags[_edge(frags, prefix, num)],
+                    "branchProtectionMax",
+                )
+                connection = "branchProtectionRules"
+                key = "nodes"
+            return alias_name, {
+                "repository": {
+                    "id": repo[0]["id"],
+                    connection: {"pageInfo": page_info, key: items},
+                }
+            }
+        team_name = re.search(r'(?:query|slug): "([^"]+)"', text)
+        assert team_name  # nosec: testing only
+        team = [
+            x
+            for x in org["teams"]
+            if team_name.group(1) in (x["name"], x["slug"])
+        ]
+        edge_text = frags[_edge(frags, prefix, num)]
+        if name.startswith("teamMember"):
+            edges = [
+                {"role": role, "node": {"id": user_id}}
+                for user_id, role in team[0]["members"]
+            ]
+            items, page_info = page(
+                edges, variables, edge_text, "teamMemberMax"
+            )
+            return alias_name, {
+                "team": {
+                    "id": team[0]["id"],
+                    "members": {"pageInfo": page_info, "edges": items},
+                }
+            }
+        if name.startswith("teamRepo"):
+            edges = [
+                {"permission": perm, "node": {"id": repo_id}}
+                for repo_id, perm in team[0]["repositories"]
+            ]
+            items, page_info = page(edges, variables, edge_text, "teamRepoMax")
+            connection = "repositories"
+        else:
+            edges = [{"node": {"id": child}} for child in team[0]["children"]]
+            items, page_info = page(
+                edges, variables, edge_text, "teamChildrenMax"
+            )
+            connection = "childTeams"
+        return alias_name, {
+            "teams": {
+                "edges": [
+                    {
+                        "node": {
+                            "id": team[0]["id"],
+                            connection: {
+                                "pageInfo": page_info,
+                                "edges": items,
+                            },
+                        }
+                    }
+                ]
+            }
+        }
+
+
+def _edge(frags: Mapping[str, str], prefix: str, num: str) -> str:
+    """Return the name of the edge fragment used by an entry fragment."""
+    for name, text in frags.items():
+        if re.match(r"^{}(repo|team){}[A-Z]".format(prefix, num), name) and (
+            "first: $" in text
+        ):
+            return name
+    raise KeyError(num)
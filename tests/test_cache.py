@@ -0,0 +1,87 @@
+import copy
+from pathlib import Path
+from typing import Any, List
+
+import pytest
+
+from ghaudit import cache, schema
+
+from .fake_github import FakeGithub, by_id, make_config, make_org
+
+
+@pytest.fixture(name="rstate")
+def fixture_rstate(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> schema.Rstate:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    fake = FakeGithub(make_org(repos=6, teams=3))
+    # pylint: disable=protected-access
+    return cache._sync(make_config(), lambda: {}, lambda _: None, fake)
+
+
+@pytest.fixture(name="validations")
+def fixture_validations(monkeypatch: pytest.MonkeyPatch) -> List[Any]:
+    validations = []  # type: List[Any]
+    validate = schema.validate
+
+    def counting_validate(rstate: schema.Rstate) -> bool:
+        validations.append(rstate)
+        return validate(rstate)
+
+    monkeypatch.setattr(schema, "validate", counting_validate)
+    return validations
+
+
+@pytest.mark.parametrize("format_", ["json", "binary", "sqlite"])
+def test_validated_once(
+    rstate: schema.Rstate, validations: List[Any], format_: str
+) -> None:
+    cache.store(rstate, format_, validated=True)
+    assert cache.load() == rstate
+    assert not validations
+    cache.store(rstate, format_)
+    assert cache.load() == rstate
+    assert len(validations) == 1
+
+
+def test_changed_file(rstate: schema.Rstate, validations: List[Any]) -> None:
+    cache.store(rstate, validated=True)
+    with open(cache.file_path(), "a", encoding="UTF-8") as cache_file:
+        cache_file.write(" ")
+    cache.load()
+    assert len(validations) == 1
+
+
+def test_verify(rstate: schema.Rstate, validations: List[Any]) -> None:
+    invalid = copy.deepcopy(rstate)  # type: Any
+    invalid["data"]["users"].popitem()
+    cache.store(invalid)
+    with pytest.raises(RuntimeError):
+        cache.verify()
+    cache.store(rstate)
+    assert cache.verify() == 0
+    validations.clear()
+    cache.load()
+    assert not validations
+
+
+def test_refresh_entities(rstate: schema.Rstate) -> None:
+    cache.store(rstate, validated=True)
+    model = make_org(repos=6, teams=3)
+    model["repos"][2]["collaborators"].pop()
+    model["repos"][2]["branchProtectionRules"].pop()
+    model["teams"][1]["members"].append((model["users"][5]["id"], "MEMBER"))
+    user = model["users"][3]
+    user["name"] = "renamed"
+    fake = FakeGithub(model)
+    assert cache.refresh_entities(
+        make_config(), lambda: {}, ["repo2"], ["team1"], [user["login"]], fake
+    )
+    # pylint: disable=protected-access
+    expected = cache._sync(
+        make_config(), lambda: {}, lambda _: None, FakeGithub(model)
+    )
+    assert by_id(cache.load()) == by_id(expected)
+    assert fake.calls < 4
+    with pytest.raises(RuntimeError):
+        cache.refresh_entities(make_config(), lambda: {}, ["unknown"], [], [])
@@ -0,0 +1,102 @@
+import io
+import json
+from pathlib import Path
+from typing import Any, List
+
+import pytest
+
+from ghaudit import cache, cache_format, schema
+
+from .fake_github import FakeGithub, make_config, make_org
+
+
+def _rstate() -> schema.Rstate:
+    fake = FakeGithub(make_org(repos=6, teams=3))
+    # pylint: disable=protected-access
+    return cache._sync(make_config(), lambda: {}, lambda _: None, fake)
+
+
+@pytest.mark.parametrize("format_", ["json", "binary"])
+def test_roundtrip(format_: str) -> None:
+    rstate = _rstate()
+    raw = cache_format.dumps(rstate, format_)
+    assert cache_format.detect(raw) == format_
+    assert cache_format.loads(raw) == rstate
+
+
+def test_unsupported_version() -> None:
+    raw = bytearray(cache_format.dumps(schema.empty(), "binary"))
+    raw[len(cache_format.MAGIC) + 1] += 1
+    with pytest.raises(RuntimeError):
+        cache_format.loads(bytes(raw))
+
+
+def test_convert(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    rstate = _rstate()
+    cache.store(rstate)
+    assert cache.convert("binary") == ("json", "none")
+    with open(cache.file_path(), "rb") as cache_file:
+        assert cache_format.detect(cache_file.read()) == "binary"
+    assert cache.load() == rstate
+    assert cache.convert("json", "gzip") == ("binary", "none")
+    assert cache.load() == rstate
+    assert cache.convert("sqlite") == ("json", "gzip")
+    assert cache.load() == rstate
+    with pytest.raises(RuntimeError):
+        cache.convert("sqlite", "gzip")
+
+
+@pytest.mark.parametrize("format_", ["json", "binary"])
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_roundtrip(format_: str, compression: str) -> None:
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    rstate = _rstate()
+    raw = cache_format.dumps(rstate, format_, compression)
+    assert cache_format.detect_compression(raw) == compression
+    assert cache_format.detect_stream(io.BytesIO(raw)) == (
+        format_,
+        compression,
+    )
+    assert cache_format.loads(raw) == rstate
+
+
+def test_streamed_json() -> None:
+    rstate = _rstate()
+    output = io.BytesIO()
+    cache_format.dump(rstate, output, "json", "none")
+    assert json.loads(output.getvalue()) == rstate
+
+
+def test_sections_decoded_on_access() -> None:
+    rstate = _rstate()
+    lazy = cache_format.loads(cache_format.dumps(rstate, "binary"))
+    org = lazy["data"]["organization"]  # type: Any
+    assert schema.org_member_ids(lazy) == schema.org_member_ids(rstate)
+    assert dict.__getitem__(org["repositories"], "edges") is None
+    assert dict.__getitem__(org["teams"], "edges") is None
+    assert lazy == rstate
+    assert json.loads(json.dumps(lazy)) == rstate
+
+
+@pytest.mark.parametrize("format_", ["json", "binary"])
+def test_shared_strings(format_: str) -> None:
+    rstate = _rstate()
+    loaded = cache_format.loads(cache_format.dumps(rstate, format_))
+    assert loaded == rstate
+    teams = schema.org_teams(loaded)[1:]  # type: List[Any]
+    parents = [x["node"]["parentTeam"]["id"] for x in teams]
+    assert len(parents) > 1
+    assert all(x is parents[0] for x in parents)
+
+
+def test_dump_keeps_strings() -> None:
+    rstate = _rstate()
+    teams = schema.org_teams(rstate)[1:]  # type: List[Any]
+    for team in teams:
+        parent = team["node"]["parentTeam"]
+        parent["id"] = "".join(list(parent["id"]))
+    cache_format.dumps(rstate, "binary")
+    parents = [x["node"]["parentTeam"]["id"] for x in teams]
+    assert parents[0] is not parents[1]
@@ -0,0 +1,138 @@
+import functools
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+from click.testing import CliRunner
+
+from ghaudit import auth, cache, schema
+from ghaudit.cli import cli
+
+from .fake_github import FakeGithub, by_id, make_config, make_org
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> List[float]:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    clock = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    return clock
+
+
+def _collaborators(name: str) -> Any:
+    repo = schema.org_repo_by_name(cache.load(), name)
+    return [x["node"]["id"] for x in repo["node"]["collaborators"]["edges"]]
+
+
+def test_stale_sections(clock: List[float]) -> None:
+    model = make_org(repos=6, teams=3)
+    fake = FakeGithub(model)
+    # without cache, the remote state is synchronised as a whole
+    assert (
+        cache.refresh_stale(make_config(), lambda: {}, 60, None, None, fake)
+        is None
+    )
+    assert cache.fetch_times()["listings"] == 1000
+    calls = fake.calls
+    assert (
+        cache.refresh_stale(make_config(), lambda: {}, 60, None, None, fake)
+        == 0
+    )
+    assert fake.calls == calls
+
+    clock[0] = 1500
+    cache.refresh_entities(make_config(), lambda: {}, ["repo2"], [], [], fake)
+    for name in ("repo2", "repo3"):
+        model["repos"][int(name[-1])]["collaborators"].pop()
+    clock[0] = 2000
+    # the sections of repo2 are fresh enough, only those of repo3 are not
+    assert (
+        cache.refresh_stale(
+            make_config(), lambda: {}, 800, ["repo2", "repo3"], [], fake
+        )
+        == 2
+    )
+    assert len(_collaborators("repo2")) == 3
+    assert len(_collaborators("repo3")) == 2
+    assert cache.fetch_times()["listings"] == 2000
+
+
+def test_times_after_compaction(
+    clock: List[float], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(cache, "COMPACT_RATIO", 0.0)
+    model = make_org(repos=6, teams=3)
+    fake = FakeGithub(model)
+    cache.refresh_stale(make_config(), lambda: {}, 60, None, None, fake)
+    model["repos"][3]["collaborators"].pop()
+    clock[0] = 2000
+    assert cache.refresh_stale(
+        make_config(), lambda: {}, 800, ["repo3"], [], fake
+    )
+    assert not cache.journal_path().exists()
+    assert len(_collaborators("repo3")) == 2
+    assert [x.name for x in cache.file_path().parent.parent.iterdir()] == [
+        cache.file_path().parent.name
+    ]
+    calls = fake.calls
+    assert (
+        cache.refresh_stale(
+            make_config(), lambda: {}, 800, ["repo3"], [], fake
+        )
+        == 0
+    )
+    assert fake.calls == calls
+
+
+def test_stale_listings(clock: List[float]) -> None:
+    model = make_org(repos=6, teams=3)
+    cache.refresh_stale(
+        make_config(), lambda: {}, 60, transport=FakeGithub(model)
+    )
+    new_repo = dict(model["repos"][0], id="R_foobar_new", name="new")
+    model["repos"].append(new_repo)
+    deleted = model["teams"].pop()
+    model["teams"][0]["children"].remove(deleted["id"])
+    removed = model["users"][4]["id"]
+    model["members"] = [x for x in model["members"] if x[0] != removed]
+    for entity in model["repos"] + model["teams"]:
+        key = "collaborators" if "collaborators" in entity else "members"
+        entity[key] = [x for x in entity[key] if x[0] != removed]
+    clock[0] = 1100
+    assert cache.refresh_stale(
+        make_config(), lambda: {}, 60, [], [], FakeGithub(model)
+    )
+    # pylint: disable=protected-access
+    expected = cache._sync(
+        make_config(), lambda: {}, lambda _: None, FakeGithub(model)
+    )
+    assert by_id(cache.load()) == by_id(expected)
+    times = cache.fetch_times()  # type: Dict[str, Any]
+    assert times["listings"] == 1100
+    assert times["refresh"] == 1000
+
+
+def test_command_max_age(
+    clock: List[float], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    model = make_org(repos=6, teams=3)
+    monkeypatch.setattr(
+        cache,
+        "refresh_stale",
+        functools.partial(cache.refresh_stale, transport=FakeGithub(model)),
+    )
+    monkeypatch.setattr(auth, "github_auth_token_passpy", lambda _: lambda: {})
+    args = ["org", "members", "count", "--max-age", "1m"]
+    # without cache, the remote state is synchronised before being read
+    result = CliRunner().invoke(cli, args, obj={"config": make_config})
+    assert result.exit_code == 0, result.output
+    assert result.output == "{}\n".format(len(model["members"]))
+    model["members"].pop()
+    clock[0] = 1100
+    result = CliRunner().invoke(cli, args, obj={"config": make_config})
+    assert result.exit_code == 0, result.output
+    assert result.output == "{}\n".format(len(model["members"]))
+    assert len(schema.org_members(cache.load())) == len(model["members"])
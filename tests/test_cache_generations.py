@@ -0,0 +1,84 @@
+import copy
+import threading
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from ghaudit import cache, cache_generations, schema
+
+from .fake_github import FakeGithub, make_config, make_org
+
+
+@pytest.fixture(name="rstate")
+def fixture_rstate(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> schema.Rstate:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    fake = FakeGithub(make_org(repos=6, teams=3))
+    # pylint: disable=protected-access
+    return cache._sync(make_config(), lambda: {}, lambda _: None, fake)
+
+
+def _generations() -> Any:
+    return sorted(
+        x.name
+        for x in (cache.data_dir() / cache_generations.GENERATIONS).iterdir()
+    )
+
+
+def test_generations(rstate: schema.Rstate) -> None:
+    cache.store(rstate)
+    cache.store(rstate, "binary")
+    assert cache_generations.current(cache.data_dir()) == 2
+    assert cache.file_path().parent.name == "2"
+    assert _generations() == ["2"]
+    assert cache.load() == rstate
+
+
+def test_pinned_reader(rstate: schema.Rstate) -> None:
+    changed = copy.deepcopy(rstate)  # type: Any
+    changed["data"]["organization"]["membersWithRole"].pop()
+    cache.store(rstate)
+    with cache.pinned() as pinned:
+        cache.store(changed, "binary")
+        assert cache.load() == rstate
+        assert cache.file_path() == pinned
+        assert _generations() == ["1", "2"]
+    assert cache.load() == changed
+    assert cache.collect() == [1]
+    assert _generations() == ["2"]
+
+
+def test_failed_writer(rstate: schema.Rstate) -> None:
+    cache.store(rstate)
+    with pytest.raises(RuntimeError):
+        cache.store(rstate, "sqlite", "gzip")
+    assert cache_generations.current(cache.data_dir()) == 1
+    assert cache.load() == rstate
+    cache.store(rstate)
+    assert _generations() == ["3"]
+
+
+def test_previous_cache(rstate: schema.Rstate) -> None:
+    # pylint: disable=protected-access
+    cache._encode(cache.data_dir() / cache.NAME, rstate, "json", "none")
+    assert cache.file_path() == cache.data_dir() / cache.NAME
+    assert cache.load() == rstate
+
+
+def test_writer_lock(rstate: schema.Rstate) -> None:
+    cache.store(rstate)
+    stored = threading.Event()
+
+    def store() -> None:
+        cache.store(rstate)
+        stored.set()
+
+    with cache_generations.writer_lock(cache.data_dir()):
+        writer = threading.Thread(target=store)
+        writer.start()
+        assert not stored.wait(0.2)
+        assert cache_generations.current(cache.data_dir()) == 1
+    writer.join()
+    assert cache_generations.current(cache.data_dir()) == 2
@@ -0,0 +1,59 @@
+import copy
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+from ghaudit import cache, cache_history, schema
+
+from .fake_github import FakeGithub, make_config, make_org
+
+
+def _rstate() -> schema.Rstate:
+    fake = FakeGithub(make_org(repos=6, teams=3))
+    # pylint: disable=protected-access
+    return cache._sync(make_config(), lambda: {}, lambda _: None, fake)
+
+
+def _objects(directory: Path) -> int:
+    return len(list((directory / "objects").glob("*/*")))
+
+
+def test_record_and_load(tmp_path: Path) -> None:
+    rstate = _rstate()
+    time = datetime(2026, 3, 1, 12, tzinfo=timezone.utc)
+    first = cache_history.record(tmp_path, rstate, time)
+    objects = _objects(tmp_path)
+    assert first.repositories == 6
+    assert first.teams == 3
+
+    changed = copy.deepcopy(rstate)
+    repo = schema.org_repositories(changed)[0]
+    repo["node"]["description"] = "updated"
+    second = cache_history.record(tmp_path, changed, time + timedelta(1))
+    assert _objects(tmp_path) == objects + 1
+
+    assert cache_history.snapshots(tmp_path) == [first, second]
+    assert cache_history.load(tmp_path, first.name) == rstate
+    assert cache_history.load(tmp_path, second.name) == changed
+
+
+def test_find(tmp_path: Path) -> None:
+    rstate = _rstate()
+    time = datetime(2026, 3, 1, 12, tzinfo=timezone.utc)
+    first = cache_history.record(tmp_path, rstate, time)
+    second = cache_history.record(tmp_path, rstate, time + timedelta(1))
+    assert cache_history.find(tmp_path, time) == first
+    assert cache_history.find(tmp_path, time + timedelta(1.5)) == second
+    with pytest.raises(RuntimeError):
+        cache_history.find(tmp_path, time - timedelta(seconds=1))
+
+
+def test_load_snapshot(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    rstate = _rstate()
+    cache.record_snapshot(rstate)
+    assert len(cache.snapshots()) == 1
+    assert cache.load_snapshot(datetime.now()) == rstate
@@ -0,0 +1,104 @@
+import copy
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from ghaudit import cache, cache_journal, schema
+
+from .fake_github import FakeGithub, make_config, make_org
+
+
+@pytest.fixture(name="rstate")
+def fixture_rstate(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> schema.Rstate:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    fake = FakeGithub(make_org(repos=6, teams=3))
+    # pylint: disable=protected-access
+    rstate = cache._sync(make_config(), lambda: {}, lambda _: None, fake)
+    cache.store(rstate)
+    return rstate
+
+
+def _changes(
+    rstate: schema.Rstate,
+) -> List[cache_journal.Record]:
+    repo = copy.deepcopy(schema.org_repositories(rstate)[0])
+    repo["node"]["description"] = "updated"
+    team = schema.org_teams(rstate)[2]
+    member = schema.org_member_ids(rstate)[-1]
+    return [
+        cache_journal.upsert("repository", repo["node"]["id"], repo),
+        cache_journal.delete("team", team["node"]["id"]),
+        cache_journal.delete("member", member),
+    ]
+
+
+def _expected(rstate: schema.Rstate) -> schema.Rstate:
+    expected = copy.deepcopy(rstate)
+    org = expected["data"]["organization"]
+    org["repositories"]["edges"][0]["node"]["description"] = "updated"
+    del org["teams"]["edges"][2]
+    del org["membersWithRole"][-1]
+    return expected
+
+
+def test_replay(rstate: schema.Rstate) -> None:
+    state = copy.deepcopy(rstate)
+    assert cache_journal.replay(state, _changes(rstate)) == _expected(rstate)
+
+
+def test_update_and_compact(rstate: schema.Rstate) -> None:
+    size = cache.file_path().stat().st_size
+    assert cache.update(_changes(rstate)) == 3
+    assert cache.file_path().stat().st_size == size
+    assert cache.load() == _expected(rstate)
+    assert cache.compact() == 3
+    assert not cache.journal_path().exists()
+    assert cache.load() == _expected(rstate)
+    assert cache.compact() == 0
+
+
+def test_update_under_stale_pin(rstate: schema.Rstate) -> None:
+    with cache.pinned() as pinned:
+        cache.store(rstate, "binary")
+        assert cache.update(_changes(rstate)) == 3
+        assert cache.file_path() == pinned
+        assert cache.load() == rstate
+    assert cache.journal_path().exists()
+    assert cache.journal_path().parent != pinned.parent
+    assert cache.load() == _expected(rstate)
+
+
+def test_journal_of_previous_cache(rstate: schema.Rstate) -> None:
+    cache.update(_changes(rstate))
+    journal = cache.journal_path().read_bytes()
+    cache.store(rstate, "binary")
+    cache.journal_path().write_bytes(journal)
+    assert cache.load() == rstate
+
+
+def test_truncated_record(rstate: schema.Rstate) -> None:
+    changes = _changes(rstate)
+    cache.update(changes[:2])
+    with open(cache.journal_path(), "a", encoding="UTF-8") as journal:
+        journal.write('{"op": "delete", "kind": "mem')
+    expected = _expected(rstate)
+    expected["data"]["organization"]["membersWithRole"] = list(
+        schema.org_member_ids(rstate)
+    )
+    assert cache.load() == expected
+
+
+@pytest.mark.parametrize("chunk", [4096, 7])
+def test_update_after_truncated_record(
+    rstate: schema.Rstate, monkeypatch: pytest.MonkeyPatch, chunk: int
+) -> None:
+    monkeypatch.setattr(cache_journal, "_CHUNK", chunk)
+    changes = _changes(rstate)
+    cache.update(changes[:2])
+    with open(cache.journal_path(), "a", encoding="UTF-8") as journal:
+        journal.write('{"op": "delete", "kind": "mem')
+    assert cache.update(changes[2:]) == 1
+    assert cache.load() == _expected(rstate)
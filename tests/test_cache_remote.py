@@ -0,0 +1,133 @@
+import copy
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+import pytest
+
+from ghaudit import cache, cache_remote, schema
+
+from .fake_github import FakeGithub, make_config, make_org
+
+KEY = b"secret"
+
+
+@pytest.fixture(name="rstate")
+def fixture_rstate(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> schema.Rstate:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "publisher"))
+    fake = FakeGithub(make_org(repos=6, teams=3))
+    # pylint: disable=protected-access
+    rstate = cache._sync(make_config(), lambda: {}, lambda _: None, fake)
+    cache.store(rstate, validated=True)
+    return rstate
+
+
+@pytest.fixture(name="url")
+def fixture_url() -> Iterator[str]:
+    """Serve an in-memory object store with GET and PUT."""
+    objects = {}  # type: Dict[str, bytes]
+
+    class Handler(BaseHTTPRequestHandler):
+        # pylint: disable=invalid-name
+        def do_GET(self) -> None:
+            if self.path not in objects:
+                # as S3 without the ListBucket permission
+                self.send_error(403 if "forbidden" in self.path else 404)
+                return
+            etag = '"{}"'.format(hashlib.md5(objects[self.path]).hexdigest())
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(objects[self.path])))
+            self.end_headers()
+            self.wfile.write(objects[self.path])
+
+        def do_PUT(self) -> None:
+            length = int(self.headers["Content-Length"])
+            objects[self.path] = self.rfile.read(length)
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield "http://127.0.0.1:{}/bucket".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def _fetcher(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "fetcher"))
+
+
+@pytest.mark.parametrize("remote", ["directory", "http"])
+def test_publish_fetch(
+    rstate: schema.Rstate,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    remote: str,
+    url: str,
+) -> None:
+    if remote == "directory":
+        url = str(tmp_path / "published")
+    first = cache.publish(url, KEY)
+    assert first.transferred == first.objects
+    changed = copy.deepcopy(rstate)  # type: Any
+    schema.org_repositories(changed)[0]["node"]["description"] = "updated"
+
+    _fetcher(tmp_path, monkeypatch)
+    assert cache.fetch(url, KEY).transferred == first.objects
+    assert cache.load() == rstate
+    assert cache.fetch(url, KEY).objects == 0
+
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "publisher"))
+    cache.store(changed)
+    # only the changed repository
+    assert cache.publish(url, KEY).transferred == 1
+
+    _fetcher(tmp_path, monkeypatch)
+    assert cache.fetch(url, KEY).transferred == 1
+    assert cache.load() == changed
+    assert len(cache.snapshots()) == 2
+
+
+def test_publish_forbidden(
+    rstate: schema.Rstate,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    url: str,
+) -> None:
+    url += "-forbidden"
+    first = cache.publish(url, KEY)
+    assert first.transferred == first.objects
+    _fetcher(tmp_path, monkeypatch)
+    assert cache.fetch(url, KEY).transferred == first.objects
+    assert cache.load() == rstate
+
+
+def test_signature(rstate: schema.Rstate, tmp_path: Path) -> None:
+    published = tmp_path / "published"
+    cache.publish(str(published), KEY)
+    location = cache_remote.location(str(published))
+    with pytest.raises(RuntimeError, match="signature"):
+        cache_remote.fetch(location, b"other", tmp_path / "history")
+    for object_path in (published / "objects").glob("*/*"):
+        object_path.write_bytes(
+            cache_remote.zlib.compress(b'{"tampered": true}')
+        )
+        break
+    with pytest.raises(RuntimeError, match="corrupted"):
+        cache_remote.fetch(location, KEY, tmp_path / "history")
+    assert rstate
@@ -0,0 +1,84 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from ghaudit import cache, cache_format, cache_shards
+
+from .fake_github import FakeGithub, by_id, make_config, make_org
+
+
+@pytest.fixture(name="model")
+def fixture_model(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Dict[str, Any]:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    return make_org(repos=12, teams=4)
+
+
+def _shards(
+    model: Dict[str, Any], count: int, seed: Optional[Path] = None
+) -> List[Path]:
+    paths = []
+    for number in range(1, count + 1):
+        path_ = cache.shard_path(number, count)
+        cache.refresh_shard(
+            make_config(),
+            lambda: {},
+            number,
+            count,
+            path_,
+            seed,
+            FakeGithub(model),
+        )
+        paths.append(path_)
+    return paths
+
+
+def _expected(model: Dict[str, Any]) -> Any:
+    # pylint: disable=protected-access
+    return by_id(
+        cache._sync(
+            make_config(), lambda: {}, lambda _: None, FakeGithub(model)
+        )
+    )
+
+
+def test_owner() -> None:
+    assert cache_shards.owner("R_foobar_0", 4) == 1
+    assert {cache_shards.owner(x, 3) for x in range(30)} == {1, 2, 3}
+
+
+def test_merge(model: Dict[str, Any]) -> None:
+    paths = _shards(model, 3)
+    assert cache.merge_shards(make_config(), reversed(paths)) == 3
+    assert by_id(cache.load()) == _expected(model)
+    assert cache.fetch_times()["listings"] is not None
+
+
+def test_seed(model: Dict[str, Any], tmp_path: Path) -> None:
+    # pylint: disable=protected-access
+    seed = tmp_path / "seed.json"
+    seed.write_bytes(
+        cache_format.dumps(
+            cache._sync(
+                make_config(), lambda: {}, lambda _: None, FakeGithub(model)
+            )
+        )
+    )
+    model["repos"][3]["collaborators"].pop()
+    cache.merge_shards(make_config(), _shards(model, 2, seed))
+    assert by_id(cache.load()) == _expected(model)
+    assert cache.fetch_times()["listings"] is None
+
+
+def test_invalid(model: Dict[str, Any]) -> None:
+    paths = _shards(model, 3)
+    with pytest.raises(RuntimeError, match="expected shards 1 to 3"):
+        cache.merge_shards(make_config(), paths[:2])
+    model["repos"].append(dict(model["repos"][0], id="R_new", name="new"))
+    cache.refresh_shard(
+        make_config(), lambda: {}, 3, 3, paths[2], None, FakeGithub(model)
+    )
+    with pytest.raises(RuntimeError, match="different listings"):
+        cache.merge_shards(make_config(), paths)
@@ -0,0 +1,51 @@
+from pathlib import Path
+
+from ghaudit import cache, cache_sqlite, schema
+
+from .fake_github import FakeGithub, make_config, make_org
+
+
+def _rstate() -> schema.Rstate:
+    fake = FakeGithub(make_org(repos=6, teams=3))
+    # pylint: disable=protected-access
+    return cache._sync(make_config(), lambda: {}, lambda _: None, fake)
+
+
+def test_roundtrip(tmp_path: Path) -> None:
+    rstate = _rstate()
+    cache_sqlite.write(tmp_path / "cache.db", rstate)
+    assert cache_sqlite.load(tmp_path / "cache.db") == rstate
+
+
+def test_repository_state(tmp_path: Path) -> None:
+    rstate = _rstate()
+    cache_sqlite.write(tmp_path / "cache.db", rstate)
+    partial = cache_sqlite.repository_state(tmp_path / "cache.db", "repo2")
+    assert [schema.repo_name(x) for x in schema.org_repositories(partial)] == [
+        "repo2"
+    ]
+    repo = schema.org_repo_by_name(partial, "repo2")
+    assert schema.repo_collaborators(
+        partial, repo
+    ) == schema.repo_collaborators(
+        rstate, schema.org_repo_by_name(rstate, "repo2")
+    )
+    assert schema.repo_branch_protection_rules(
+        repo
+    ) == schema.repo_branch_protection_rules(
+        schema.org_repo_by_name(rstate, "repo2")
+    )
+
+
+def test_user_state(tmp_path: Path) -> None:
+    rstate = _rstate()
+    cache_sqlite.write(tmp_path / "cache.db", rstate)
+    partial = cache_sqlite.user_state(tmp_path / "cache.db", "foobar-user1")
+    assert len(schema.users(partial)) == 1
+    assert [schema.team_name(x) for x in schema.org_teams(partial)] == [
+        "team0",
+        "team1",
+    ]
+    assert not schema.org_teams(
+        cache_sqlite.user_state(tmp_path / "cache.db", "nobody")
+    )
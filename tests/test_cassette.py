@@ -0,0 +1,50 @@
+import gzip
+import json
+from pathlib import Path
+
+import pytest
+
+from ghaudit import cache, cassette, schema
+
+from .fake_github import FakeGithub, make_config, make_org
+
+
+def test_normalise() -> None:
+    assert cassette.normalise("query  {\n   a\n}\n") == "query { a }"
+
+
+def test_record_replay(tmp_path: Path) -> None:
+    fake = FakeGithub(make_org(repos=12, teams=4))
+    path = tmp_path / "refresh.jsonl.gz"
+    with cassette.Recorder(path, fake) as recorder:
+        # pylint: disable=protected-access
+        recorded = cache._sync(
+            make_config(), lambda: {}, lambda _: None, recorder
+        )
+    assert recorder.recorded() == fake.calls
+    assert schema.validate(recorded)
+
+    measures = cache.replay(make_config(), path, lambda _: None)
+    assert measures["roundtrips"] == fake.calls
+    assert measures["unplayed roundtrips"] == 0
+    assert measures["repositories"] == 12
+    assert measures["teams"] == 4
+    measures = cache.replay(make_config(), path, lambda _: None, bulk=True)
+    assert measures["unplayed roundtrips"] == 0
+    assert measures["repositories"] == 12
+
+
+def test_unrecorded_variables(tmp_path: Path) -> None:
+    path = tmp_path / "refresh.jsonl.gz"
+    with cassette.Recorder(path, FakeGithub(make_org())) as recorder:
+        # pylint: disable=protected-access
+        cache._sync(make_config(), lambda: {}, lambda _: None, recorder)
+    with gzip.open(path, "rt", encoding="UTF-8") as cassette_file:
+        entry = json.loads(cassette_file.readline())
+    player = cassette.Player(path)
+    variables = dict(entry["variables"], organisation="other")
+    with pytest.raises(RuntimeError, match="with variables"):
+        player(entry["query"], lambda: {}, variables, None)
+    assert player(entry["query"], lambda: {}, entry["variables"], None) == (
+        entry["response"]
+    )
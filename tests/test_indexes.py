@@ -0,0 +1,82 @@
+import io
+from pathlib import Path
+
+import pytest
+
+from ghaudit import cache, indexes, schema
+
+from .fake_github import FakeGithub, make_config, make_org
+
+
+@pytest.fixture(name="rstate")
+def fixture_rstate(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> schema.Rstate:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    fake = FakeGithub(make_org(repos=6, teams=3))
+    # pylint: disable=protected-access
+    return cache._sync(make_config(), lambda: {}, lambda _: None, fake)
+
+
+def _roundtrip(rstate: schema.Rstate, tmp_path: Path) -> indexes.Indexes:
+    cache_path = tmp_path / "cache"
+    cache_path.write_text("", encoding="UTF-8")
+    stream = io.BytesIO()
+    indexes.dump(indexes.build(rstate), indexes.stamp(cache_path), stream)
+    return indexes.loads(stream.getvalue())
+
+
+def test_build(rstate: schema.Rstate, tmp_path: Path) -> None:
+    indexes_ = _roundtrip(rstate, tmp_path)
+    assert indexes_["members"] == set(schema.org_member_ids(rstate))
+    for repo in schema.org_repositories(rstate):
+        name = schema.repo_name(repo)
+        assert indexes_["repository_ids"][name] == repo["node"]["id"]
+    for team in schema.org_teams(rstate):
+        team_id = team["node"]["id"]
+        assert indexes_["names"][team_id] == schema.team_name(team)
+        for member in schema.team_members(rstate, team):
+            user_id = indexes_["user_ids"][schema.user_login(member)]
+            assert [team_id, member["role"]] in indexes_["user_teams"][user_id]
+
+
+def test_reduced_states(rstate: schema.Rstate, tmp_path: Path) -> None:
+    indexes_ = _roundtrip(rstate, tmp_path)
+    for repo in schema.org_repositories(rstate):
+        name = schema.repo_name(repo)
+        reduced = indexes.repository_state(indexes_, name)
+        assert schema.validate(reduced)
+        assert schema.repo_collaborators(
+            reduced, schema.org_repo_by_name(reduced, name)
+        ) == schema.repo_collaborators(rstate, repo)
+    for team in schema.org_teams(rstate):
+        name = schema.team_name(team)
+        reduced = indexes.team_state(indexes_, name)
+        reduced_team = schema.org_team_by_name(reduced, name)
+        assert schema.team_members(reduced, reduced_team) == (
+            schema.team_members(rstate, team)
+        )
+        assert schema.team_repos(reduced, reduced_team) == (
+            schema.team_repos(rstate, team)
+        )
+    for user in schema.users(rstate):
+        login = schema.user_login(user)
+        reduced = indexes.user_state(indexes_, login)
+        assert schema.user_by_login(reduced, login) == user
+    assert indexes.user_state(indexes_, "nobody") == (
+        indexes.repository_state(indexes_, "nothing")
+    )
+
+
+@pytest.mark.parametrize("format_", ["json", "binary"])
+def test_cache_indexes(rstate: schema.Rstate, format_: str) -> None:
+    cache.store(rstate, format_)
+    assert cache.load_indexes()
+    team = schema.org_teams(rstate)[0]
+    reduced = cache.load_team(schema.team_name(team))
+    assert schema.org_teams(reduced)[0] == team
+
+    # a cache file written behind the back of the indexes makes them stale
+    with open(cache.file_path(), "ab") as cache_file:
+        cache_file.write(b" " if format_ == "json" else b"\0")
+    assert cache.load_indexes() is None
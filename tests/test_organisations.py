@@ -0,0 +1,115 @@
+from pathlib import Path
+from typing import Any, List
+
+import pytest
+from click.testing import CliRunner
+
+from ghaudit import cache, config, schema, user_map
+from ghaudit.cli import cli
+
+from .fake_github import FakeGithub, by_id, make_config, make_org
+
+USERMAP = user_map.load({"map": [{"login": "alice", "email": "a@example"}]})
+
+
+@pytest.fixture(name="models")
+def fixture_models(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> List[Any]:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    return [
+        make_org("foo", repos=6, teams=3),
+        make_org("bar", repos=4, teams=2, members=4),
+    ]
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_refresh(models: List[Any], bulk: bool) -> None:
+    # pylint: disable=protected-access
+    fake = FakeGithub(*models)
+    cache.refresh_organisations(
+        [
+            make_config("foo")._replace(cache_apart=True),
+            make_config("bar")._replace(cache_apart=True),
+        ],
+        lambda: {},
+        lambda _: None,
+        fake,
+        bulk,
+    )
+    calls = 0
+    for model in models:
+        alone = FakeGithub(model)
+        expected = cache._sync(
+            make_config(model["name"]), lambda: {}, lambda _: None, alone
+        )
+        calls = max(calls, alone.calls)
+        with cache.organisation(model["name"]):
+            assert by_id(cache.load()) == by_id(expected)
+    # the round trips are shared by the organisations
+    assert fake.calls == calls
+    assert not cache.file_path().exists()
+
+
+def test_single_organisation(models: List[Any]) -> None:
+    # the cache of a single organisation is the usual one, with --org or not
+    cache.refresh_organisations(
+        [make_config("foo")], lambda: {}, lambda _: None, FakeGithub(models[0])
+    )
+    count = "{}\n".format(len(schema.org_members(cache.load())))
+    for args in [[], ["--org", "foo"]]:
+        result = CliRunner().invoke(
+            cli,
+            args + ["org", "members", "count"],
+            obj={"config": lambda: make_config("foo")},
+        )
+        assert result.exit_code == 0, result.output
+        assert result.output == count
+
+
+def test_organisation(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    default = cache.file_path()
+    with cache.organisation("foo"):
+        assert cache.file_path().parent.name == "foo"
+        with cache.organisation("bar"):
+            assert cache.file_path().parent.name == "bar"
+        assert cache.file_path().parent.name == "foo"
+    assert cache.file_path() == default
+    with pytest.raises(RuntimeError, match="invalid organisation name"):
+        with cache.organisation("../foo"):
+            pass
+
+
+def test_config() -> None:
+    raw = {
+        "organisations": [
+            {"name": "foo", "owners": ["a@example"], "teams": []},
+            {"name": "bar", "owners": ["a@example"], "teams": []},
+        ],
+        "cache": {"history": False},
+    }  # type: Any
+    configs = config.load_all(raw, USERMAP)
+    assert [config.get_org_name(x) for x in configs] == ["foo", "bar"]
+    assert all(config.get_cache_apart(x) for x in configs)
+    assert not any(config.get_cache_history(x) for x in configs)
+    assert config.get_org_name(config.select(configs, "bar")) == "bar"
+    with pytest.raises(RuntimeError, match="several organisations"):
+        config.select(configs, None)
+    with pytest.raises(RuntimeError, match="not configured"):
+        config.select(configs, "baz")
+    raw["organisations"].append(raw["organisations"][0])
+    with pytest.raises(RuntimeError, match="more than once: foo"):
+        config.load_all(raw, USERMAP)
+    single = config.load_all(
+        {
+            "organisation": {
+                "name": "foo",
+                "owners": ["a@example"],
+                "teams": [],
+            }
+        },
+        USERMAP,
+    )
+    assert config.get_org_name(config.select(single, None)) == "foo"
+    assert not config.get_cache_apart(single[0])
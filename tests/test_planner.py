@@ -0,0 +1,19 @@
+from ghaudit import cache, planner
+
+from .fake_github import FakeGithub, make_config, make_org
+
+
+def test_points() -> None:
+    assert planner.points([]) == 1
+    assert planner.points(["user"] * 40) == 1
+    assert planner.points(["team children"] * 100) == 2
+
+
+def test_estimate() -> None:
+    fake = FakeGithub(make_org(repos=200, teams=30, members=100, outside=20))
+    # pylint: disable=protected-access
+    rstate = cache._sync(make_config(), lambda: {}, lambda _: None, fake)
+    estimate = planner.estimate(rstate)
+    assert abs(estimate.requests - fake.calls) <= fake.calls // 10
+    assert estimate.points >= estimate.requests
+    assert estimate.peak_queue > 0
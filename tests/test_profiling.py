@@ -0,0 +1,23 @@
+import io
+import pstats
+from pathlib import Path
+
+from ghaudit import profiling
+
+
+def test_cpu_profile(tmp_path: Path) -> None:
+    output = io.StringIO()
+    with profiling.cpu_profile(tmp_path / "out.pstats", 5, output):
+        sorted(range(1000), key=str)
+    assert "cumulative" in output.getvalue()
+    assert pstats.Stats(str(tmp_path / "out.pstats")).get_stats_profile()
+
+
+def test_memory_profile() -> None:
+    output = io.StringIO()
+    with profiling.memory_profile(3, output):
+        data = [bytes(1024) for _ in range(100)]
+    del data
+    lines = output.getvalue().splitlines()
+    assert lines[0].startswith("peak traced memory: ")
+    assert float(lines[0].split()[3]) >= 100
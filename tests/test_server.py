@@ -0,0 +1,142 @@
+import contextlib
+import copy
+import json
+import socketserver
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator, List
+
+import pytest
+
+from ghaudit import cache, schema, server
+from ghaudit.cli import cli
+
+from .fake_github import FakeGithub, make_config, make_org
+
+
+@pytest.fixture(name="rstate")
+def fixture_rstate(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> schema.Rstate:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    fake = FakeGithub(make_org(repos=6, teams=3))
+    # pylint: disable=protected-access
+    rstate = cache._sync(make_config(), lambda: {}, lambda _: None, fake)
+    cache.store(rstate, validated=True)
+    return rstate
+
+
+@pytest.fixture(name="loads")
+# pylint: disable=unused-argument
+def fixture_loads(rstate: schema.Rstate) -> Iterator[Any]:
+    loads = []  # type: List[schema.Rstate]
+
+    def load() -> schema.Rstate:
+        loads.append(cache.load())
+        return loads[-1]
+
+    resident = server.Resident(lambda: [cache.file_path()], load)
+    server_ = server.server(
+        server.socket_path(),
+        cli,
+        lambda: {"rstate": resident},
+        server.default_files(),
+    )
+    thread = threading.Thread(target=server_.serve_forever)
+    thread.start()
+    yield loads
+    server_.shutdown()
+    server_.server_close()
+    thread.join()
+
+
+def test_forward(rstate: schema.Rstate, loads: Any) -> None:
+    assert server.forward(["org", "members", "count"]) == (
+        0,
+        "{}\n".format(len(schema.org_members(rstate))),
+        "",
+    )
+    status, _, stderr = server.forward(["org", "nothing"]) or (0, "", "")
+    assert status == 2
+    assert "No such command" in stderr
+    # not forwarded: options precede the command, or the command writes
+    assert server.forward(["--at", "2026-01-01", "stats"]) is None
+    assert server.forward(["cache", "compact"]) is None
+
+    changed = copy.deepcopy(rstate)  # type: Any
+    changed["data"]["organization"]["membersWithRole"].pop()
+    server.forward(["org", "members", "count"])
+    assert len(loads) == 1
+    cache.store(changed, validated=True)
+    assert server.forward(["org", "members", "count"]) == (
+        0,
+        "{}\n".format(len(schema.org_members(changed))),
+        "",
+    )
+    assert len(loads) == 2
+
+
+@pytest.mark.usefixtures("rstate")
+def test_not_running() -> None:
+    assert server.forward(["org", "members", "count"]) is None
+
+
+@pytest.mark.usefixtures("rstate")
+def test_other_files(tmp_path: Path) -> None:
+    files = server.default_files()
+    server_ = server.server(
+        server.socket_path(),
+        cli,
+        lambda: {},
+        dict(files, policy=str(tmp_path / "other.yml")),
+    )
+    thread = threading.Thread(target=server_.serve_forever)
+    thread.start()
+    try:
+        assert server.forward(["org", "members", "count"]) is None
+    finally:
+        server_.shutdown()
+        server_.server_close()
+        thread.join()
+
+
+@contextlib.contextmanager
+def _serving(answer: bytes) -> Iterator[None]:
+    # pylint: disable-next=too-few-public-methods
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            self.rfile.readline()
+            # slower than the connection, the answer is still waited for
+            time.sleep(0.2)
+            self.wfile.write(answer)
+
+    path_ = server.socket_path()
+    path_.parent.mkdir(parents=True, exist_ok=True)
+    server_ = socketserver.UnixStreamServer(str(path_), Handler)
+    thread = threading.Thread(target=server_.serve_forever)
+    thread.start()
+    try:
+        yield
+    finally:
+        server_.shutdown()
+        server_.server_close()
+        thread.join()
+
+
+@pytest.mark.usefixtures("rstate")
+def test_slow_server(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(server, "CONNECT_TIMEOUT", 0.05)
+    answer = {"status": 0, "stdout": "6\n", "stderr": ""}
+    with _serving(json.dumps(answer).encode("UTF-8") + b"\n"):
+        assert server.forward(["org", "members", "count"]) == (0, "6\n", "")
+
+
+@pytest.mark.parametrize("answer", [b"", b"not json\n", b"{}\n"])
+@pytest.mark.usefixtures("rstate")
+def test_broken_server(answer: bytes) -> None:
+    with _serving(answer):
+        with pytest.raises(RuntimeError, match="did not answer"):
+            server.forward(["org", "members", "count"])
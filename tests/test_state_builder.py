@@ -0,0 +1,77 @@
+from pathlib import Path
+from typing import Any, List
+
+import pytest
+
+from ghaudit import cache, schema
+
+from .fake_github import FakeGithub, by_id, make_config, make_org
+
+
+def test_bulk_build() -> None:
+    model = make_org(repos=60, teams=8, members=50)
+    merged, buffered = FakeGithub(model), FakeGithub(model)
+    # pylint: disable=protected-access
+    expected = cache._sync(make_config(), lambda: {}, lambda _: None, merged)
+    rstate = cache._sync(
+        make_config(), lambda: {}, lambda _: None, buffered, bulk=True
+    )
+    assert schema.validate(rstate)
+    assert by_id(rstate) == by_id(expected)
+    assert buffered.calls == merged.calls
+    rules = [
+        y
+        for x in schema.org_repositories(rstate)
+        for y in schema.repo_branch_protection_rules(x)
+    ]
+    assert rules
+    assert all(len(x["pushAllowances"]) == 1 for x in rules)
+
+
+def test_spill(tmp_path: Path) -> None:
+    model = make_org(repos=60, teams=8, members=50)
+    spill = tmp_path / "spill"
+    spill.mkdir()
+    spilled = []  # type: List[int]
+
+    def progress(_: Any) -> None:
+        path_ = spill / "repository"
+        spilled.append(path_.stat().st_size if path_.exists() else 0)
+
+    # pylint: disable=protected-access
+    expected = cache._sync(
+        make_config(), lambda: {}, lambda _: None, FakeGithub(model)
+    )
+    rstate = cache._sync(
+        make_config(),
+        lambda: {},
+        progress,
+        FakeGithub(model),
+        spill=spill,
+    )
+    # repositories were written before the end of the synchronisation
+    assert 0 < spilled[-2] < spilled[-1]
+    assert len(schema.org_repositories(rstate)) == 60
+    assert schema.validate(rstate)
+    assert by_id(rstate) == by_id(expected)
+
+
+def test_refresh_spill(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    model = make_org(repos=12, teams=4)
+    cache.refresh(
+        make_config(),
+        lambda: {},
+        lambda _: None,
+        FakeGithub(model),
+        spill=True,
+    )
+    # pylint: disable=protected-access
+    expected = cache._sync(
+        make_config(), lambda: {}, lambda _: None, FakeGithub(model)
+    )
+    assert by_id(cache.load()) == by_id(expected)
+    assert not list(cache.data_dir().glob("spill-*"))
+    assert cache.load_indexes() is None
@@ -0,0 +1,102 @@
+import copy
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+
+from ghaudit import cache, cache_history, schema, state_diff
+
+from .fake_github import FakeGithub, make_config, make_org
+
+
+def _rstate() -> schema.Rstate:
+    fake = FakeGithub(make_org(repos=6, teams=3))
+    # pylint: disable=protected-access
+    return cache._sync(make_config(), lambda: {}, lambda _: None, fake)
+
+
+def _change(rstate: schema.Rstate) -> schema.Rstate:
+    changed = copy.deepcopy(rstate)  # type: Any
+    org = changed["data"]["organization"]
+    repo = org["repositories"]["edges"][1]["node"]
+    repo["isPrivate"] = not repo["isPrivate"]
+    repo["collaborators"]["edges"][0]["permission"] = "ADMIN"
+    del org["repositories"]["edges"][0]
+    team = org["teams"]["edges"][1]["node"]
+    team["members"]["edges"][0]["role"] = "MAINTAINER"
+    org["membersWithRole"].pop()
+    return changed
+
+
+def _expected(rstate: schema.Rstate) -> list:
+    org = rstate["data"]["organization"]  # type: Any
+    repo = org["repositories"]["edges"][1]["node"]
+    collaborator = repo["collaborators"]["edges"][0]
+    team = org["teams"]["edges"][1]["node"]
+    member = team["members"]["edges"][0]
+    users = rstate["data"]["users"]
+    return [
+        {
+            "kind": "member",
+            "change": "removed",
+            "user": users[org["membersWithRole"][-1]]["node"]["login"],
+        },
+        {
+            "kind": "repository",
+            "change": "removed",
+            "repository": org["repositories"]["edges"][0]["node"]["name"],
+        },
+        {
+            "kind": "repository",
+            "change": "changed",
+            "repository": repo["name"],
+            "field": "isPrivate",
+            "old": repo["isPrivate"],
+            "new": not repo["isPrivate"],
+        },
+        {
+            "kind": "collaborator",
+            "change": "changed",
+            "repository": repo["name"],
+            "user": users[collaborator["node"]["id"]]["node"]["login"],
+            "old": collaborator["permission"],
+            "new": "ADMIN",
+        },
+        {
+            "kind": "team_member",
+            "change": "changed",
+            "team": team["name"],
+            "user": users[member["node"]["id"]]["node"]["login"],
+            "old": member["role"],
+            "new": "MAINTAINER",
+        },
+    ]
+
+
+def test_diff() -> None:
+    rstate = _rstate()
+    assert not list(state_diff.diff(rstate, rstate))
+    assert list(state_diff.diff(rstate, _change(rstate))) == _expected(rstate)
+
+
+def test_added_repository() -> None:
+    rstate = _rstate()
+    changes = list(state_diff.diff(_change(rstate), rstate))
+    repo = schema.org_repositories(rstate)[0]
+    assert {
+        "kind": "repository",
+        "change": "added",
+        "repository": schema.repo_name(repo),
+    } in changes
+    assert len([x for x in changes if x["kind"] == "collaborator"]) == 1 + len(
+        repo["node"]["collaborators"]["edges"]
+    )
+
+
+def test_diff_snapshots(tmp_path: Path) -> None:
+    rstate = _rstate()
+    time = datetime(2026, 3, 1, tzinfo=timezone.utc)
+    old = cache_history.record(tmp_path, rstate, time)
+    new = cache_history.record(tmp_path, _change(rstate), time + timedelta(1))
+    assert list(cache_history.diff(tmp_path, old.name, new.name)) == (
+        _expected(rstate)
+    )
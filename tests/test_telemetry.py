@@ -0,0 +1,33 @@
+from ghaudit import cache, telemetry
+
+from .fake_github import FakeGithub, make_config, make_org
+
+
+def test_report() -> None:
+    fake = FakeGithub(make_org(repos=60, teams=8))
+    telemetry_ = telemetry.Telemetry()
+    # pylint: disable=protected-access
+    cache._sync(make_config(), lambda: {}, lambda _: None, fake, telemetry_)
+    report = telemetry_.report()
+    assert report["totals"]["requests"] == fake.calls
+    assert report["totals"]["cost"] == fake.calls
+    kinds = report["kinds"]
+    assert kinds["RepoCollaboratorQuery"]["done"] == 60
+    assert kinds["TeamMemberQuery"]["pages"] == 8
+    assert kinds["RepoCollaboratorQuery"]["response_bytes"] > 0
+    assert report["requests"][0]["sub_queries"] == {
+        "OrgTeamsQuery": 1,
+        "OrgMembersQuery": 1,
+        "OrgRepoQuery": 1,
+    }
+
+
+def test_openmetrics() -> None:
+    fake = FakeGithub(make_org())
+    telemetry_ = telemetry.Telemetry()
+    # pylint: disable=protected-access
+    cache._sync(make_config(), lambda: {}, lambda _: None, fake, telemetry_)
+    text = telemetry.openmetrics(telemetry_.report())
+    assert text.endswith("# EOF\n")
+    assert "ghaudit_sync_requests_total {}\n".format(fake.calls) in text
+    assert 'ghaudit_sync_pages_total{kind="OrgRepoQuery"} 1\n' in text
@@ -0,0 +1,38 @@
+import json
+from pathlib import Path
+
+from ghaudit import cache, tracing
+
+from .fake_github import FakeGithub, make_config, make_org
+
+
+def test_disabled() -> None:
+    with tracing.span("nothing", key=1) as span:
+        span.set("other", 2)
+
+
+def test_sync_trace(tmp_path: Path) -> None:
+    fake = FakeGithub(make_org(repos=4, teams=2))
+    tracer = tracing.enable()
+    try:
+        # pylint: disable=protected-access
+        cache._sync(make_config(), lambda: {}, lambda _: None, fake)
+    finally:
+        tracing.disable()
+    names = [x["name"] for x in tracer.events()]
+    assert names.count("sync iteration") == fake.calls
+    assert names.count("http call") == fake.calls
+    assert "schema.merge" in names
+
+    iterations = [x for x in tracer.events() if x["name"] == "sync iteration"]
+    calls = [x for x in tracer.events() if x["name"] == "http call"]
+    for iteration, call in zip(iterations, calls):
+        assert iteration["ts"] <= call["ts"]
+        assert call["ts"] + call["dur"] <= iteration["ts"] + iteration["dur"]
+
+    path = tmp_path / "trace.json"
+    tracer.export_chrome(path)
+    with open(path, encoding="UTF-8") as trace:
+        events = json.load(trace)["traceEvents"]
+    assert events[0]["ph"] == "X"
+    assert events[0]["args"]
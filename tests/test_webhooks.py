@@ -0,0 +1,259 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+import pytest
+
+from ghaudit import cache, cache_journal, webhooks
+
+from .fake_github import FakeGithub, by_id, make_config, make_org
+
+ORG = {"login": "foobar"}
+
+
+@pytest.fixture(name="model")
+def fixture_model(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Dict[str, Any]:
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    model = make_org(repos=6, teams=3)
+    # pylint: disable=protected-access
+    rstate = cache._sync(
+        make_config(), lambda: {}, lambda _: None, FakeGithub(model)
+    )
+    cache.store(rstate, validated=True)
+    return model
+
+
+def _repository(repo: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "node_id": repo["id"],
+        "name": repo["name"],
+        "description": repo["description"],
+        "fork": repo["isFork"],
+        "archived": repo["isArchived"],
+        "mirror_url": None,
+        "private": repo["isPrivate"],
+        "is_template": repo["isTemplate"],
+    }
+
+
+def _team(team: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "node_id": team["id"],
+        "name": team["name"],
+        "slug": team["slug"],
+        "description": team["description"],
+        "privacy": "closed",
+        "parent": (
+            {"node_id": team["parentTeam"]["id"]}
+            if team["parentTeam"]
+            else None
+        ),
+    }
+
+
+def _user(user: Dict[str, Any]) -> Dict[str, Any]:
+    return {"node_id": user["id"], "login": user["login"]}
+
+
+def _assert_refreshed(model: Dict[str, Any], fake: FakeGithub) -> None:
+    # pylint: disable=protected-access
+    expected = cache._sync(
+        make_config(), lambda: {}, lambda _: None, FakeGithub(model)
+    )
+    assert by_id(cache.load()) == by_id(expected)
+    assert fake.calls < 4
+
+
+def test_collaborator_and_membership(model: Dict[str, Any]) -> None:
+    outside = model["users"][-1]
+    repo, team = model["repos"][1], model["teams"][2]
+    repo["collaborators"].append((outside["id"], "READ"))
+    team["members"].append((model["users"][5]["id"], "MAINTAINER"))
+    events = [
+        (
+            "member",
+            {
+                "action": "added",
+                "member": _user(outside),
+                "repository": _repository(repo),
+                "organization": ORG,
+            },
+        ),
+        (
+            "membership",
+            {
+                "action": "added",
+                "scope": "team",
+                "member": _user(model["users"][5]),
+                "team": _team(team),
+                "organization": ORG,
+            },
+        ),
+        ("push", {"organization": ORG}),
+        ("member", {"repository": _repository(repo), "organization": {}}),
+    ]
+    fake = FakeGithub(model)
+    assert cache.ingest(make_config(), lambda: {}, events, fake) == 2
+    _assert_refreshed(model, fake)
+
+
+def test_new_team_and_deleted_repository(model: Dict[str, Any]) -> None:
+    deleted = model["repos"].pop(0)
+    for team in model["teams"]:
+        team["repositories"] = [
+            x for x in team["repositories"] if x[0] != deleted["id"]
+        ]
+    new_team = {
+        "id": "T_foobar_new",
+        "name": "new team",
+        "slug": "new-team",
+        "description": "",
+        "privacy": "VISIBLE",
+        "parentTeam": {"id": "T_foobar_0"},
+        "repositories": [(model["repos"][0]["id"], "ADMIN")],
+        "members": [(model["users"][0]["id"], "MAINTAINER")],
+        "children": [],
+    }
+    model["teams"].append(new_team)
+    model["teams"][0]["children"].append(new_team["id"])
+    events = [
+        (
+            "repository",
+            {
+                "action": "deleted",
+                "repository": _repository(deleted),
+                "organization": ORG,
+            },
+        ),
+        (
+            "team",
+            {
+                "action": "created",
+                "team": _team(new_team),
+                "organization": ORG,
+            },
+        ),
+        (
+            "team_add",
+            {
+                "team": _team(new_team),
+                "repository": _repository(model["repos"][0]),
+                "organization": ORG,
+            },
+        ),
+    ]
+    fake = FakeGithub(model)
+    cache.ingest(make_config(), lambda: {}, events, fake)
+    _assert_refreshed(model, fake)
+
+
+def test_transferred_repository(model: Dict[str, Any]) -> None:
+    repo = dict(
+        model["repos"][0],
+        id="R_foobar_moved",
+        name="moved",
+        collaborators=[(model["users"][1]["id"], "WRITE")],
+        branchProtectionRules=[],
+    )
+    model["repos"].append(repo)
+    payload = {
+        "action": "transferred",
+        "changes": {
+            "owner": {
+                "from": {
+                    "organization": {
+                        "login": "elsewhere",
+                        "id": 2,
+                        "node_id": "O_elsewhere",
+                    }
+                }
+            }
+        },
+        "repository": dict(
+            _repository(repo),
+            id=3,
+            full_name="foobar/moved",
+            owner={"login": "foobar", "type": "Organization"},
+        ),
+        "organization": dict(ORG, id=1, node_id="O_foobar"),
+        "sender": {"login": "foobar-user0", "type": "User"},
+    }
+    fake = FakeGithub(model)
+    assert cache.ingest(
+        make_config(), lambda: {}, [("repository", payload)], fake
+    )
+    _assert_refreshed(model, fake)
+
+
+def test_organization_members(model: Dict[str, Any]) -> None:
+    removed = model["users"][4]
+    added = model["users"][-1]
+    model["members"] = [x for x in model["members"] if x[0] != removed["id"]]
+    model["members"].append((added["id"], "MEMBER"))
+    for entity in model["repos"] + model["teams"]:
+        key = "collaborators" if "collaborators" in entity else "members"
+        entity[key] = [x for x in entity[key] if x[0] != removed["id"]]
+    events = [
+        (
+            "organization",
+            {
+                "action": action,
+                "membership": {"role": "member", "user": _user(user)},
+                "organization": ORG,
+            },
+        )
+        for action, user in (
+            ("member_removed", removed),
+            ("member_added", added),
+        )
+    ]
+    fake = FakeGithub(model)
+    cache.ingest(make_config(), lambda: {}, events, fake)
+    _assert_refreshed(model, fake)
+
+
+def test_diff(model: Dict[str, Any]) -> None:
+    del model
+    rstate = cache.load()
+    assert not cache_journal.diff(rstate, rstate)
+
+
+@pytest.fixture(name="receiver")
+def fixture_receiver(tmp_path: Path) -> Iterator[str]:
+    server = webhooks.receiver(("127.0.0.1", 0), tmp_path / "spool", b"key")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}/".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_receiver(receiver: str, tmp_path: Path) -> None:
+    body = json.dumps({"action": "created", "organization": ORG}).encode()
+
+    def post(event: str, signature: str) -> int:
+        request = urllib.request.Request(
+            receiver,
+            data=body,
+            headers={
+                "X-GitHub-Event": event,
+                "X-GitHub-Delivery": "d1",
+                "X-Hub-Signature-256": signature,
+            },
+        )
+        try:
+            with urllib.request.urlopen(request) as response:  # nosec
+                return response.status
+        except urllib.error.HTTPError as exc:
+            return exc.code
+
+    assert post("team", "sha256=0") == 401
+    assert post("team", webhooks.signature(b"key", body)) == 202
+    assert post("ping", webhooks.signature(b"key", body)) == 202
+    spooled = webhooks.spooled(tmp_path / "spool")
+    assert [webhooks.read(x) for x in spooled] == [("team", json.loads(body))]